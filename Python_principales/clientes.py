@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+Índice persistente de resolución de clientes
+Asigna un id canónico de cliente a partir de IDENTIFICACION / CODIGO CLIENTE
+y, para registros sin identificación, de una clave de bloque del nombre
+normalizado (mayúsculas, sin tildes ni puntuación, sin forma societaria,
+tokens ordenados). El índice se guarda en JSON y se amplía en cada corrida,
+de modo que la mayoría de búsquedas son aciertos directos en un diccionario.
+"""
+
+import json
+import os
+import tempfile
+from datetime import datetime
+from typing import Dict, Optional
+
+import pandas as pd
+
+VERSION_INDICE = 1
+
+# Tokens que no distinguen a un cliente (forma societaria y conectores)
+TOKENS_IGNORADOS = {
+    'SAS', 'SA', 'LTDA', 'LIMITADA', 'EU', 'SCA', 'SCS', 'BIC', 'CIA', 'Y', 'DE', 'LA', 'EL',
+}
+
+VALORES_VACIOS = {'', 'NAN', 'NONE', 'NULL', '0'}
+
+# NIT numérico seguido de '-' y un sufijo corto de sucursal
+PATRON_SUFIJO_SUCURSAL = r'^(\d{6,})\s*-\s*\d{1,3}$'
+
+
+def normalizar_nombre(nombres: pd.Series) -> pd.Series:
+    """Mayúsculas, sin tildes ni puntuación, iniciales unidas (S.A.S -> SAS), un espacio entre tokens."""
+    texto = (
+        nombres.fillna('').astype(str).str.upper()
+        .str.normalize('NFKD').str.encode('ascii', 'ignore').str.decode('ascii')
+        .str.replace(r'[^A-Z0-9]+', ' ', regex=True)
+        .str.replace(r'\b([A-Z0-9]) (?=[A-Z0-9]\b)', r'\1', regex=True)
+        .str.strip()
+    )
+    return texto
+
+
+def clave_bloque(nombres_normalizados: pd.Series) -> pd.Series:
+    """Tokens significativos del nombre, únicos y ordenados (el orden de palabras no importa)."""
+    def _clave(nombre: str) -> str:
+        tokens = sorted(set(nombre.split()) - TOKENS_IGNORADOS)
+        return ' '.join(tokens) if tokens else nombre
+
+    codigos, unicos = pd.factorize(nombres_normalizados)
+    claves = pd.Index([_clave(n) for n in unicos], dtype=object)
+    return pd.Series(claves.take(codigos), index=nombres_normalizados.index)
+
+
+def normalizar_identificacion(valores: Optional[pd.Series], index: pd.Index) -> pd.Series:
+    """
+    Solo letras y dígitos, sin ceros a la izquierda; vacío si no hay identificación.
+    El sufijo de sucursal de un NIT (9011619034-1, 8903019510-01) se quita antes,
+    así todas las sucursales quedan con el NIT base de la empresa.
+    """
+    if valores is None:
+        return pd.Series('', index=index, dtype=object)
+    texto = (
+        valores.fillna('').astype(str).str.upper().str.strip()
+        .str.replace(r'\.0$', '', regex=True)
+        .str.replace(PATRON_SUFIJO_SUCURSAL, r'\1', regex=True)
+        .str.replace(r'[^0-9A-Z]', '', regex=True)
+        .str.lstrip('0')
+    )
+    return texto.where(~texto.isin(VALORES_VACIOS), '')
+
+
+class IndiceClientes:
+    """
+    Claves 'ID:<identificación>', 'CC:<código cliente>' y 'N:<bloque de nombre>'
+    apuntan a un id canónico ('CL000001'); cada id canónico guarda el último
+    nombre con que apareció.
+    """
+
+    def __init__(self, ruta: Optional[str] = None):
+        self.ruta = ruta
+        self.claves: Dict[str, str] = {}
+        self.nombres: Dict[str, str] = {}
+        self.aciertos = 0
+        self.nuevos = 0
+        if ruta and os.path.exists(ruta):
+            with open(ruta, encoding='utf-8') as f:
+                datos = json.load(f)
+            if datos.get('version') == VERSION_INDICE:
+                self.claves = datos.get('claves', {})
+                self.nombres = datos.get('nombres', {})
+
+    def _nuevo_id(self) -> str:
+        self.nuevos += 1
+        cliente_id = f"CL{len(self.nombres) + 1:06d}"
+        self.nombres[cliente_id] = ''
+        return cliente_id
+
+    def resolver(self, identificacion: Optional[pd.Series], codigo_cliente: Optional[pd.Series],
+                 nombre: pd.Series) -> pd.DataFrame:
+        """
+        (CLIENTE_ID, CLIENTE) por fila. Se resuelve una vez por combinación única de
+        claves: primero por identificación o código, y solo sin ellos por el nombre.
+        CLIENTE es el nombre del periodo actual (el primero no vacío del id en
+        esta llamada); el índice se actualiza con él, así un cliente renombrado
+        no arrastra su nombre anterior.
+        """
+        index = nombre.index
+        id_norm = normalizar_identificacion(identificacion, index)
+        cc_norm = normalizar_identificacion(codigo_cliente, index)
+        nombre_limpio = nombre.fillna('').astype(str).str.strip()
+        bloque = clave_bloque(normalizar_nombre(nombre_limpio))
+
+        claves = pd.DataFrame({
+            'ID': ('ID:' + id_norm).where(id_norm != '', ''),
+            'CC': ('CC:' + cc_norm).where(cc_norm != '', ''),
+            'N':  ('N:' + bloque).where(bloque != '', ''),
+        })
+        codigos, _ = pd.MultiIndex.from_frame(claves).factorize()
+        primera = pd.Series(range(len(codigos))).groupby(codigos).first().to_numpy()
+        unicas = claves.iloc[primera].reset_index(drop=True)
+        nombres_unicos = nombre_limpio.iloc[primera].to_numpy()
+
+        # Aciertos directos: identificación, luego código y, sin ninguno de los dos, nombre
+        sin_id = (unicas['ID'] == '') & (unicas['CC'] == '')
+        canon = unicas['ID'].map(self.claves).astype(object)
+        for respaldo in (unicas['CC'], unicas['N'].where(sin_id, '')):
+            faltan = canon.isna()
+            canon[faltan] = respaldo[faltan].map(self.claves)
+        self.aciertos += int(canon.notna().sum())
+
+        # Combinaciones nuevas o con claves aún no registradas
+        pendientes = canon.isna()
+        for col in ('ID', 'CC'):
+            pendientes |= (unicas[col] != '') & ~unicas[col].isin(self.claves.keys())
+        for pos in pendientes.to_numpy().nonzero()[0]:
+            fila = unicas.iloc[pos]
+            propias = [fila['ID'], fila['CC']] if not sin_id.iloc[pos] else [fila['N']]
+            propias = [c for c in propias if c]
+            cliente_id = canon.iloc[pos]
+            if pd.isna(cliente_id):
+                cliente_id = next((self.claves[c] for c in propias if c in self.claves), None)
+            if cliente_id is None:
+                cliente_id = self._nuevo_id() if propias else ''
+            for c in propias:
+                self.claves.setdefault(c, cliente_id)
+            if cliente_id and fila['N']:
+                self.claves.setdefault(fila['N'], cliente_id)
+            canon.iloc[pos] = cliente_id
+
+        # Nombre del periodo: el primero no vacío del id en estos registros
+        actuales: Dict[str, str] = {}
+        for cliente_id, nombre_u in zip(canon.to_numpy(), nombres_unicos):
+            if cliente_id and nombre_u and cliente_id not in actuales:
+                actuales[cliente_id] = nombre_u
+        self.nombres.update(actuales)
+
+        canon = canon.fillna('').to_numpy(dtype=object)
+        canon_filas = canon[codigos]
+        nombre_canon = pd.Series(canon_filas, index=index).map(self.nombres)
+        return pd.DataFrame({
+            'CLIENTE_ID': canon_filas,
+            'CLIENTE':    nombre_canon.fillna(nombre_limpio).to_numpy(),
+        }, index=index)
+
+    def guardar(self) -> Optional[str]:
+        """Escribe el índice en un temporal del mismo directorio y lo reemplaza de forma atómica."""
+        if not self.ruta:
+            return None
+        directorio = os.path.dirname(os.path.abspath(self.ruta))
+        fd, temporal = tempfile.mkstemp(prefix='.indice_clientes_', suffix='.tmp', dir=directorio)
+        try:
+            # mkstemp crea el archivo solo para el dueño: conservar los permisos del índice
+            modo = os.stat(self.ruta).st_mode & 0o777 if os.path.exists(self.ruta) else 0o644
+            os.chmod(temporal, modo)
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({
+                    'version':     VERSION_INDICE,
+                    'actualizado': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                    'claves':      self.claves,
+                    'nombres':     self.nombres,
+                }, f, ensure_ascii=False)
+            os.replace(temporal, self.ruta)
+        except BaseException:
+            if os.path.exists(temporal):
+                os.remove(temporal)
+            raise
+        return self.ruta
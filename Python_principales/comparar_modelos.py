@@ -0,0 +1,295 @@
+# ==========================================================
+# COMPARACIÓN DE MODELOS DE DEUDA (mes anterior vs mes actual)
+# Departamento de Cartera - Editorial Planeta Colombia
+# ==========================================================
+"""
+Compara dos MODELO_DEUDA (o sus resúmenes *_totales.json) y clasifica cada
+factura por (LINEA DE NEGOCIO, NUMERO FACTURA) como NUEVA, PAGADA, ABONO
+PARCIAL, AUMENTO SALDO, CAMBIO BUCKET o SIN CAMBIO. El cruce se hace sobre
+claves enteras (factorize + bincount), sin merge fila a fila.
+
+Uso:
+    python comparar_modelos.py MODELO_ANTERIOR.xlsx MODELO_ACTUAL.xlsx -o DELTA.xlsx
+"""
+
+import argparse
+import json
+import os
+import sys
+from datetime import datetime
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from esquemas import SUFIJO_TOTALES, atributos_linea, ruta_totales_modelo
+from exportar_excel import CacheFormatos, escribir_encabezados, estimar_ancho
+
+HOJAS_FACTURAS = ('PESOS', 'VENCIMIENTOS_EXTRANJERO')
+
+CLAVES_FACTURA = ['LINEA DE NEGOCIO', 'NUMERO FACTURA']
+
+BUCKETS_FACTURA = [
+    'SALDO NO VENCIDO',
+    'VENCIDO 30', 'VENCIDO 60', 'VENCIDO 90',
+    'VENCIDO 180', 'VENCIDO 360', 'VENCIDO + 360',
+]
+
+SIN_BUCKET = 'SIN SALDO'
+
+# Diferencias de saldo por debajo de la tolerancia se consideran redondeo
+TOLERANCIA_SALDO = 0.01
+
+MOVIMIENTOS = ['NUEVA', 'PAGADA', 'ABONO PARCIAL', 'AUMENTO SALDO', 'CAMBIO BUCKET', 'SIN CAMBIO']
+
+
+def resolver_modelo(ruta: str) -> Tuple[str, Optional[str]]:
+    """(libro xlsx, resumen json o None) a partir del libro o de su *_totales.json."""
+    if ruta.lower().endswith(SUFIJO_TOTALES):
+        with open(ruta, encoding='utf-8') as f:
+            archivo_modelo = json.load(f).get('archivo_modelo', '')
+        libro = os.path.join(os.path.dirname(os.path.abspath(ruta)), archivo_modelo)
+        return libro, ruta
+    ruta_json = ruta_totales_modelo(ruta)
+    return ruta, ruta_json if os.path.exists(ruta_json) else None
+
+
+def leer_facturas_modelo(ruta_modelo: str) -> pd.DataFrame:
+    """
+    Filas de factura/anticipo de las hojas PESOS y VENCIMIENTOS_EXTRANJERO
+    (sin filas de total). SALDO y buckets en moneda original.
+    """
+    columnas = CLAVES_FACTURA + ['CODIGO CLIENTE', 'DENOMINACION COMERCIAL', 'MONEDA', 'SALDO'] + BUCKETS_FACTURA
+    partes = []
+    with pd.ExcelFile(ruta_modelo) as xls:
+        for hoja in HOJAS_FACTURAS:
+            if hoja not in xls.sheet_names:
+                continue
+            df = xls.parse(hoja, usecols=lambda c: c in columnas,
+                           dtype={'LINEA DE NEGOCIO': str, 'NUMERO FACTURA': str, 'CODIGO CLIENTE': str})
+            if 'MONEDA' not in df.columns:
+                df['MONEDA'] = 'PESOS COL'
+            linea = df['LINEA DE NEGOCIO'].fillna('').str.strip()
+            es_factura = df['NUMERO FACTURA'].notna() & (linea != '') & ~linea.str.upper().str.startswith('TOTAL')
+            partes.append(df[es_factura])
+    if not partes:
+        raise ValueError(f"{ruta_modelo}: no tiene hojas {', '.join(HOJAS_FACTURAS)}")
+
+    facturas = pd.concat(partes, ignore_index=True)
+    for col in CLAVES_FACTURA:
+        facturas[col] = facturas[col].str.strip().str.upper()
+    facturas['MONEDA'] = (
+        facturas['MONEDA'].astype(str).str.strip().str.upper()
+        .str.replace('DÓLAR', 'DOLAR', regex=False)
+    )
+    for col in ['SALDO'] + BUCKETS_FACTURA:
+        facturas[col] = pd.to_numeric(facturas[col], errors='coerce').fillna(0.0)
+    return facturas
+
+
+def _acumular(codigos: np.ndarray, valores: pd.DataFrame, n: int) -> np.ndarray:
+    """Suma por clave entera: matriz (n claves x columnas)."""
+    return np.column_stack([
+        np.bincount(codigos, weights=valores[col].to_numpy(dtype=float), minlength=n)
+        for col in valores.columns
+    ])
+
+
+def _bucket_dominante(buckets: np.ndarray, presente: np.ndarray) -> np.ndarray:
+    """Bucket con mayor valor absoluto por clave ('SIN SALDO' si todos son cero)."""
+    etiquetas = np.array(BUCKETS_FACTURA + [SIN_BUCKET], dtype=object)
+    idx = np.abs(buckets).argmax(axis=1)
+    idx[~np.abs(buckets).any(axis=1) | ~presente] = len(BUCKETS_FACTURA)
+    return etiquetas[idx]
+
+
+def comparar_facturas(anterior: pd.DataFrame, actual: pd.DataFrame,
+                      tolerancia: float = TOLERANCIA_SALDO) -> pd.DataFrame:
+    """Una fila por (LINEA DE NEGOCIO, NUMERO FACTURA) con saldos, buckets y MOVIMIENTO."""
+    n_ant = len(anterior)
+    claves = pd.concat([anterior[CLAVES_FACTURA], actual[CLAVES_FACTURA]], ignore_index=True)
+    codigos, unicos = pd.MultiIndex.from_frame(claves).factorize()
+    cod_ant, cod_act = codigos[:n_ant], codigos[n_ant:]
+    n = len(unicos)
+
+    en_ant = np.bincount(cod_ant, minlength=n) > 0
+    en_act = np.bincount(cod_act, minlength=n) > 0
+    montos = ['SALDO'] + BUCKETS_FACTURA
+    acum_ant = _acumular(cod_ant, anterior[montos], n)
+    acum_act = _acumular(cod_act, actual[montos], n)
+    saldo_ant, saldo_act = acum_ant[:, 0], acum_act[:, 0]
+    bucket_ant = _bucket_dominante(acum_ant[:, 1:], en_ant)
+    bucket_act = _bucket_dominante(acum_act[:, 1:], en_act)
+
+    # Atributos descriptivos: los del mes actual prevalecen sobre los del anterior
+    atributos = {}
+    for col in ('CODIGO CLIENTE', 'DENOMINACION COMERCIAL', 'MONEDA'):
+        valores = np.full(n, None, dtype=object)
+        valores[cod_ant] = anterior[col].to_numpy(dtype=object)
+        valores[cod_act] = actual[col].to_numpy(dtype=object)
+        atributos[col] = valores
+
+    abs_ant, abs_act = np.abs(saldo_ant), np.abs(saldo_act)
+    movimiento = np.select(
+        [
+            en_act & ~en_ant,
+            en_ant & (~en_act | (abs_act <= tolerancia)),
+            abs_act < abs_ant - tolerancia,
+            abs_act > abs_ant + tolerancia,
+            bucket_ant != bucket_act,
+        ],
+        MOVIMIENTOS[:-1],
+        MOVIMIENTOS[-1],
+    )
+
+    delta = pd.DataFrame({
+        'LINEA DE NEGOCIO':       unicos.get_level_values(0),
+        'NUMERO FACTURA':         unicos.get_level_values(1),
+        'CODIGO CLIENTE':         atributos['CODIGO CLIENTE'],
+        'DENOMINACION COMERCIAL': atributos['DENOMINACION COMERCIAL'],
+        'MONEDA':                 atributos['MONEDA'],
+        'MOVIMIENTO':             movimiento,
+        'BUCKET ANTERIOR':        np.where(en_ant, bucket_ant, ''),
+        'BUCKET ACTUAL':          np.where(en_act, bucket_act, ''),
+        'SALDO ANTERIOR':         np.round(saldo_ant, 2),
+        'SALDO ACTUAL':           np.round(saldo_act, 2),
+    })
+    delta['VARIACION'] = delta['SALDO ACTUAL'] - delta['SALDO ANTERIOR']
+    dim = atributos_linea(delta['LINEA DE NEGOCIO'])
+    delta.insert(1, 'NEGOCIO', dim['NEGOCIO'].to_numpy())
+    delta.insert(2, 'CANAL', dim['CANAL'].to_numpy())
+    return delta
+
+
+def resumir_movimientos(delta: pd.DataFrame) -> pd.DataFrame:
+    """Facturas y saldos por NEGOCIO, CANAL, MONEDA y MOVIMIENTO (monedas sin mezclar)."""
+    movimiento = pd.Categorical(delta['MOVIMIENTO'], categories=MOVIMIENTOS, ordered=True)
+    resumen = (
+        delta.assign(MOVIMIENTO=movimiento)
+        .groupby(['NEGOCIO', 'CANAL', 'MONEDA', 'MOVIMIENTO'], observed=True, sort=True)
+        .agg(FACTURAS=('NUMERO FACTURA', 'size'),
+             **{'SALDO ANTERIOR': ('SALDO ANTERIOR', 'sum'),
+                'SALDO ACTUAL': ('SALDO ACTUAL', 'sum'),
+                'VARIACION': ('VARIACION', 'sum')})
+        .reset_index()
+    )
+    resumen['MOVIMIENTO'] = resumen['MOVIMIENTO'].astype(str)
+    return resumen
+
+
+def matriz_buckets(delta: pd.DataFrame) -> pd.DataFrame:
+    """Número de facturas presentes en ambos meses por bucket anterior x bucket actual."""
+    orden = BUCKETS_FACTURA + [SIN_BUCKET]
+    ambos = delta[(delta['BUCKET ANTERIOR'] != '') & (delta['BUCKET ACTUAL'] != '')]
+    matriz = pd.crosstab(ambos['BUCKET ANTERIOR'], ambos['BUCKET ACTUAL'])
+    matriz = matriz.reindex(index=orden, columns=orden, fill_value=0)
+    matriz.index.name = 'BUCKET ANTERIOR \\ ACTUAL'
+    return matriz.reset_index()
+
+
+def comparar_totales(json_anterior: Optional[str], json_actual: Optional[str]) -> Optional[pd.DataFrame]:
+    """
+    Total general en COP por bucket según los *_totales.json (None si falta
+    alguno o si son de versiones distintas: el alcance del total cambió en la 2).
+    """
+    if not json_anterior or not json_actual:
+        return None
+    resumenes = []
+    for ruta in (json_anterior, json_actual):
+        with open(ruta, encoding='utf-8') as f:
+            resumenes.append(json.load(f))
+    versiones = [r.get('version') for r in resumenes]
+    if versiones[0] != versiones[1]:
+        print(f"  [WARN] Resúmenes de totales de versiones distintas {versiones}: no se comparan")
+        return None
+    totales = [r.get('total_general', {}) for r in resumenes]
+    conceptos = list(totales[1]) or list(totales[0])
+    resultado = pd.DataFrame({
+        'CONCEPTO':      conceptos,
+        'ANTERIOR (COP)': [totales[0].get(c, 0.0) for c in conceptos],
+        'ACTUAL (COP)':   [totales[1].get(c, 0.0) for c in conceptos],
+    })
+    resultado['VARIACION (COP)'] = resultado['ACTUAL (COP)'] - resultado['ANTERIOR (COP)']
+    return resultado
+
+
+def comparar_modelos(modelo_anterior: str, modelo_actual: str, output_path: str) -> str:
+    """Compara dos modelos de deuda y escribe el libro de movimientos."""
+    print("\n" + "=" * 62)
+    print("  COMPARACIÓN DE MODELOS DE DEUDA")
+    print("=" * 62)
+
+    libro_ant, json_ant = resolver_modelo(modelo_anterior)
+    libro_act, json_act = resolver_modelo(modelo_actual)
+    for libro in (libro_ant, libro_act):
+        if not os.path.exists(libro):
+            raise FileNotFoundError(f"Modelo de deuda no encontrado: {libro}")
+
+    anterior = leer_facturas_modelo(libro_ant)
+    actual = leer_facturas_modelo(libro_act)
+    print(f"  [OK] Anterior: {os.path.basename(libro_ant)} ({len(anterior):,} registros)")
+    print(f"  [OK] Actual  : {os.path.basename(libro_act)} ({len(actual):,} registros)")
+
+    delta = comparar_facturas(anterior, actual)
+    resumen = resumir_movimientos(delta)
+    matriz = matriz_buckets(delta)
+    totales = comparar_totales(json_ant, json_act)
+
+    conteo = delta['MOVIMIENTO'].value_counts()
+    for mov in MOVIMIENTOS:
+        print(f"  [INFO] {mov:<14}: {int(conteo.get(mov, 0)):>7,}")
+
+    hojas = [('RESUMEN_MOVIMIENTOS', resumen), ('MATRIZ_BUCKETS', matriz)]
+    if totales is not None:
+        hojas.append(('TOTALES', totales))
+    hojas.append(('DETALLE_MOVIMIENTOS', delta[delta['MOVIMIENTO'] != 'SIN CAMBIO']))
+
+    with pd.ExcelWriter(output_path, engine='xlsxwriter') as writer:
+        formatos = CacheFormatos(writer.book)
+        fmt_miles = formatos.obtener({'num_format': '#,##0.00;-#,##0.00;"-";@'})
+        fmt_header = formatos.obtener({
+            'bold': True, 'bg_color': '#1F3864', 'font_color': '#FFFFFF',
+            'border': 1, 'align': 'center', 'valign': 'vcenter', 'text_wrap': True
+        })
+        for nombre, df in hojas:
+            df.to_excel(writer, sheet_name=nombre, index=False)
+            ws = writer.sheets[nombre]
+            escribir_encabezados(ws, df.columns, fmt_header)
+            for idx, col in enumerate(df.columns):
+                if pd.api.types.is_float_dtype(df[col]):
+                    ws.set_column(idx, idx, 20, fmt_miles)
+                else:
+                    ws.set_column(idx, idx, estimar_ancho(df[col], col, minimo=10, maximo=45))
+            ws.freeze_panes(1, 0)
+            print(f"  [OK] Hoja {nombre} escrita ({len(df):,} filas)")
+
+    print(f"\n  ✓ Comparación generada: {output_path}\n")
+    return output_path
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compara dos Modelos de Deuda (mes anterior vs mes actual)"
+    )
+    parser.add_argument("modelo_anterior",
+                        help="MODELO_DEUDA del mes anterior (*.xlsx o *_totales.json)")
+    parser.add_argument("modelo_actual",
+                        help="MODELO_DEUDA del mes actual (*.xlsx o *_totales.json)")
+    parser.add_argument("-o", "--output-file",
+                        help="Nombre del archivo de salida (*.xlsx)",
+                        default=None)
+    args = parser.parse_args()
+
+    if not args.output_file:
+        ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+        args.output_file = f"COMPARACION_MODELO_DEUDA_{ts}.xlsx"
+
+    try:
+        comparar_modelos(args.modelo_anterior, args.modelo_actual, args.output_file)
+    except Exception as e:
+        print(f"\n[ERROR] {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+Escenarios de tasa de cambio (USD / EUR) sobre la cartera en divisas
+Calcula el impacto en COP de choques de TRM, trayectorias históricas o
+simulaciones Monte Carlo por NEGOCIO y bucket, con un único producto de
+matrices: COP[escenario, celda] = TRM[escenario, moneda] @ EXPOSICION[moneda, celda].
+También convierte cada factura a la TRM vigente en su FECHA (diferencia en cambio).
+"""
+
+from itertools import product
+from typing import Iterable, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+MONEDAS_ESCENARIO = ('DOLAR', 'EURO')
+
+BUCKETS_ESCENARIO = [
+    'SALDO NO VENCIDO',
+    'VENCIDO 30', 'VENCIDO 60', 'VENCIDO 90',
+    'VENCIDO 180', 'VENCIDO 360', 'VENCIDO + 360',
+]
+
+CHOQUES_TRM = (-0.20, -0.10, -0.05, 0.0, 0.05, 0.10, 0.20)
+
+PERCENTILES_ESCENARIO = (1, 5, 25, 50, 75, 95, 99)
+
+
+def matriz_exposicion(df_divisas: pd.DataFrame,
+                      buckets: Sequence[str] = BUCKETS_ESCENARIO) -> Tuple[np.ndarray, pd.MultiIndex]:
+    """
+    Exposición en moneda original: matriz (moneda x celda), con celdas (NEGOCIO, bucket).
+    df_divisas debe traer NEGOCIO, MONEDA (DOLAR / EURO) y las columnas de bucket.
+    """
+    moneda = (
+        df_divisas['MONEDA'].astype(str).str.strip().str.upper()
+        .str.replace('DÓLAR', 'DOLAR', regex=False)
+    )
+    valores = (
+        df_divisas[list(buckets)].apply(pd.to_numeric, errors='coerce').fillna(0.0)
+        .groupby([df_divisas['NEGOCIO'].astype(str), moneda]).sum()
+    )
+    negocios = sorted(valores.index.get_level_values(0).unique())
+    celdas = pd.MultiIndex.from_product([negocios, list(buckets)], names=['NEGOCIO', 'BUCKET'])
+
+    exposicion = np.zeros((len(MONEDAS_ESCENARIO), len(celdas)))
+    for i, mon in enumerate(MONEDAS_ESCENARIO):
+        if mon in valores.index.get_level_values(1):
+            por_negocio = valores.xs(mon, level=1).reindex(negocios).fillna(0.0)
+            exposicion[i] = por_negocio.to_numpy().ravel()
+    return exposicion, celdas
+
+
+def escenarios_choque(trm_usd: float, trm_eur: float,
+                      choques: Iterable[float] = CHOQUES_TRM) -> pd.DataFrame:
+    """Rejilla de choques porcentuales independientes sobre la TRM USD y la TRM EUR."""
+    choques = list(choques)
+    filas = [
+        {'ESCENARIO': f"USD {cu:+.0%} / EUR {ce:+.0%}",
+         'TRM USD': trm_usd * (1 + cu), 'TRM EUR': trm_eur * (1 + ce)}
+        for cu, ce in product(choques, choques)
+    ]
+    return pd.DataFrame(filas)
+
+
+def escenarios_historicos(serie_trm: pd.DataFrame) -> pd.DataFrame:
+    """Escenarios a partir de una serie histórica con columnas FECHA, USD y EUR."""
+    serie = serie_trm.dropna(subset=['USD', 'EUR'])
+    return pd.DataFrame({
+        'ESCENARIO': 'HISTORICO ' + pd.to_datetime(serie['FECHA']).dt.strftime('%Y-%m-%d'),
+        'TRM USD':   pd.to_numeric(serie['USD'], errors='coerce').to_numpy(),
+        'TRM EUR':   pd.to_numeric(serie['EUR'], errors='coerce').to_numpy(),
+    })
+
+
+def escenarios_montecarlo(trm_usd: float, trm_eur: float, simulaciones: int = 10000,
+                          vol_usd: float = 0.10, vol_eur: float = 0.10,
+                          correlacion: float = 0.6, semilla: Optional[int] = None) -> pd.DataFrame:
+    """
+    Simulaciones log-normales correlacionadas de la TRM alrededor de la tasa actual
+    (vol_* es la volatilidad del horizonte, no anualizada).
+    """
+    rng = np.random.default_rng(semilla)
+    cov = np.array([[vol_usd ** 2, correlacion * vol_usd * vol_eur],
+                    [correlacion * vol_usd * vol_eur, vol_eur ** 2]])
+    z = rng.standard_normal((simulaciones, 2)) @ np.linalg.cholesky(cov).T
+    factores = np.exp(z - 0.5 * np.diag(cov))
+    return pd.DataFrame({
+        'ESCENARIO': [f"MC {i + 1}" for i in range(simulaciones)],
+        'TRM USD':   trm_usd * factores[:, 0],
+        'TRM EUR':   trm_eur * factores[:, 1],
+    })
+
+
+def evaluar_escenarios(df_divisas: pd.DataFrame, escenarios: pd.DataFrame,
+                       trm_usd: float, trm_eur: float) -> pd.DataFrame:
+    """
+    COP por escenario: total, impacto frente a la TRM base, total por NEGOCIO
+    y detalle NEGOCIO | bucket, calculados con un solo producto de matrices.
+    """
+    exposicion, celdas = matriz_exposicion(df_divisas)
+    tasas = escenarios[['TRM USD', 'TRM EUR']].to_numpy(dtype=float)
+
+    cop = tasas @ exposicion
+    base = np.array([trm_usd, trm_eur]) @ exposicion
+
+    negocios = celdas.get_level_values('NEGOCIO')
+    detalle = pd.DataFrame(cop, columns=[f"{n} | {b}" for n, b in celdas])
+    por_negocio = detalle.T.groupby(np.asarray(negocios)).sum().T
+
+    resultado = escenarios[['ESCENARIO', 'TRM USD', 'TRM EUR']].reset_index(drop=True)
+    resultado['TOTAL COP'] = cop.sum(axis=1)
+    resultado['IMPACTO COP'] = resultado['TOTAL COP'] - base.sum()
+    return pd.concat([resultado, por_negocio, detalle], axis=1)
+
+
+def resumen_percentiles(resultado: pd.DataFrame,
+                        percentiles: Sequence[int] = PERCENTILES_ESCENARIO) -> pd.DataFrame:
+    """Percentiles de cada columna numérica de los escenarios (TRM, totales e impacto)."""
+    numericas = resultado.drop(columns=['ESCENARIO']).select_dtypes('number')
+    valores = np.percentile(numericas.to_numpy(), percentiles, axis=0)
+    resumen = pd.DataFrame(valores, columns=numericas.columns)
+    resumen.insert(0, 'PERCENTIL', [f"P{p}" for p in percentiles])
+    return resumen
+
+
+# ============================================================
+# CONVERSIÓN A LA TRM DE LA FECHA DE FACTURA
+# ============================================================
+COLUMNAS_DIFERENCIA_CAMBIO = [
+    'LINEA DE NEGOCIO', 'CODIGO CLIENTE', 'DENOMINACION COMERCIAL',
+    'NUMERO FACTURA', 'TIPO', 'FECHA', 'MONEDA', 'SALDO',
+]
+
+
+def preparar_serie_trm(serie_trm: pd.DataFrame) -> pd.DataFrame:
+    """Serie de TRM (FECHA, USD, EUR) ordenada por fecha, una fila por fecha."""
+    serie = pd.DataFrame({
+        'FECHA': pd.to_datetime(serie_trm['FECHA'], errors='coerce'),
+        'USD':   pd.to_numeric(serie_trm['USD'], errors='coerce'),
+        'EUR':   pd.to_numeric(serie_trm['EUR'], errors='coerce'),
+    })
+    serie = serie.dropna(subset=['FECHA']).sort_values('FECHA', kind='stable')
+    return serie.drop_duplicates('FECHA', keep='last').reset_index(drop=True)
+
+
+def trm_a_la_fecha(fechas: pd.Series, moneda: pd.Series, serie_trm: pd.DataFrame) -> np.ndarray:
+    """
+    TRM vigente en cada fecha (última publicada en o antes de la fecha), por moneda.
+    Búsqueda binaria vectorizada (searchsorted) sobre la serie ordenada;
+    NaN si la fecha es nula o anterior al inicio de la serie.
+    """
+    fechas = pd.to_datetime(fechas, errors='coerce').to_numpy(dtype='datetime64[ns]')
+    moneda = (
+        moneda.astype(str).str.strip().str.upper()
+        .str.replace('DÓLAR', 'DOLAR', regex=False).to_numpy()
+    )
+    trm = np.full(len(fechas), np.nan)
+    for mon, col in (('DOLAR', 'USD'), ('EURO', 'EUR')):
+        tramo = serie_trm[['FECHA', col]].dropna()
+        if tramo.empty:
+            continue
+        pos = np.searchsorted(tramo['FECHA'].to_numpy(dtype='datetime64[ns]'), fechas, side='right') - 1
+        ok = (moneda == mon) & ~np.isnat(fechas) & (pos >= 0)
+        trm[ok] = tramo[col].to_numpy(dtype=float)[pos[ok]]
+    return trm
+
+
+def convertir_a_fecha_factura(df_divisas: pd.DataFrame, serie_trm: pd.DataFrame,
+                              trm_usd: float, trm_eur: float) -> pd.DataFrame:
+    """
+    SALDO en COP a la TRM de la fecha de factura y a la TRM de cierre,
+    con la diferencia en cambio (cierre - fecha factura).
+    """
+    serie = preparar_serie_trm(serie_trm)
+    columnas = [c for c in COLUMNAS_DIFERENCIA_CAMBIO if c in df_divisas.columns]
+    salida = df_divisas[columnas].reset_index(drop=True)
+
+    saldo = pd.to_numeric(salida['SALDO'], errors='coerce').fillna(0.0).to_numpy()
+    moneda = salida['MONEDA'].astype(str).str.strip().str.upper().str.replace('DÓLAR', 'DOLAR', regex=False)
+    trm_fecha = trm_a_la_fecha(salida['FECHA'], salida['MONEDA'], serie)
+    trm_cierre = np.select([moneda == 'DOLAR', moneda == 'EURO'], [trm_usd, trm_eur], np.nan)
+
+    salida['TRM FECHA FACTURA'] = trm_fecha
+    salida['SALDO COP FECHA FACTURA'] = np.round(saldo * trm_fecha, 2)
+    salida['TRM CIERRE'] = trm_cierre
+    salida['SALDO COP CIERRE'] = np.round(saldo * trm_cierre, 2)
+    salida['DIFERENCIA EN CAMBIO'] = salida['SALDO COP CIERRE'] - salida['SALDO COP FECHA FACTURA']
+    return salida
@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""
+Registro de esquemas de las fuentes PISA (PROVCA y ANTICI)
+Un único lugar para el nombre de cada campo PISA, su nombre en la salida de
+los procesadores, su nombre en el modelo de deuda y su tipo. De aquí salen
+los renombres y la proyección de columnas (usecols / dtype) de cada lector,
+de modo que cada etapa solo lee los campos que consume.
+
+También la dimensión de líneas de negocio (NEGOCIO, CANAL, MONEDA) y el
+nombre del resumen de totales del modelo, que usan modelo_deuda y las
+herramientas que leen sus salidas (comparar_modelos) sin importarlo.
+"""
+
+import os
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional
+
+import pandas as pd
+
+
+class Campo(NamedTuple):
+    origen: str                    # nombre en el CSV PISA
+    destino: Optional[str]         # nombre tras el procesador (None: no se usa)
+    tipo: str = 'texto'            # texto | monto | fecha
+    modelo: Optional[str] = None   # nombre en modelo_deuda si difiere de destino
+
+
+ESQUEMA_PROVCA: List[Campo] = [
+    Campo('PCCDEM', 'EMPRESA'),
+    Campo('PCCDAC', 'ACTIVIDAD'),
+    Campo('PCDEAC', 'EMPRESA CODIGO AGENTE'),
+    Campo('PCCDAG', 'CODIGO AGENTE'),
+    Campo('PCNMAG', 'AGENTE'),
+    Campo('PCCDCO', 'CODIGO COBRADOR'),
+    Campo('PCNMCO', 'COBRADOR'),
+    Campo('PCCDCL', 'CODIGO CLIENTE'),
+    Campo('PCCDDN', 'IDENTIFICACION'),
+    Campo('PCNMCL', 'NOMBRE'),
+    Campo('PCNMCM', 'DENOMINACION COMERCIAL'),
+    Campo('PCNMDO', 'DIRECCION'),
+    Campo('PCTLF1', 'TELEFONO'),
+    Campo('PCNMPO', 'CIUDAD'),
+    Campo('PCNUFC', 'NUMERO FACTURA'),
+    Campo('PCORPD', 'TIPO'),
+    Campo('PCFEFA', 'FECHA', 'fecha'),
+    Campo('PCFEVE', 'FECHA VTO', 'fecha'),
+    Campo('PCVAFA', 'VALOR', 'monto'),
+    Campo('PCSALD', 'SALDO', 'monto'),
+    Campo('PCIMCO', None, 'monto'),
+]
+
+ESQUEMA_ANTICI: List[Campo] = [
+    Campo('NCCDEM', 'EMPRESA'),
+    Campo('NCCDAC', 'ACTIVIDAD'),
+    Campo('NCCDCL', 'CODIGO CLIENTE'),
+    Campo('WWNIT',  'NRO DOCUMENTO', modelo='IDENTIFICACION'),
+    Campo('WWNMCL', 'NOMBRE COMERCIAL', modelo='DENOMINACION COMERCIAL'),
+    Campo('WWNMDO', 'DIRECCION'),
+    Campo('WWTLF1', 'TELEFONO'),
+    Campo('WWNMPO', 'CIUDAD'),
+    Campo('CCCDFB', 'CODIGO AGENTE'),
+    Campo('BDNMNM', 'NOMBRE AGENTE'),
+    Campo('BDNMPA', 'APELLIDO AGENTE'),
+    Campo('NCMOMO', 'TIPO ANTICIPO'),
+    Campo('NCCDR3', 'NRO ANTICIPO', modelo='NUMERO ANTICIPO'),
+    Campo('NCIMAN', 'VALOR ANTICIPO', 'monto'),
+    Campo('NCFEGR', 'FECHA ANTICIPO', 'fecha', modelo='FECHA'),
+]
+
+# Nombres heredados de exportaciones anteriores del procesador de anticipos
+ALIAS_MODELO_ANTICI = {
+    'ANTICIPO': 'VALOR ANTICIPO',
+}
+
+# Campos (con nombre del modelo) que consume modelo_deuda de cada fuente
+CONSUMO_MODELO_PROVISION = [
+    'EMPRESA', 'ACTIVIDAD', 'CODIGO AGENTE', 'AGENTE',
+    'CODIGO CLIENTE', 'IDENTIFICACION', 'NOMBRE', 'DENOMINACION COMERCIAL',
+    'DIRECCION', 'TELEFONO', 'CIUDAD', 'NUMERO FACTURA', 'TIPO',
+    'FECHA', 'FECHA VTO', 'VALOR', 'SALDO', '% DOTACION',
+]
+
+CONSUMO_MODELO_ANTICIPOS = [
+    'EMPRESA', 'ACTIVIDAD', 'CODIGO CLIENTE', 'IDENTIFICACION', 'DENOMINACION COMERCIAL',
+    'DIRECCION', 'TELEFONO', 'CIUDAD', 'CODIGO AGENTE', 'AGENTE',
+    'NOMBRE AGENTE', 'APELLIDO AGENTE', 'NUMERO ANTICIPO', 'NUMERO FACTURA',
+    'VALOR ANTICIPO', 'FECHA',
+]
+
+# Registro por fuente: esquema, campos que consume el modelo y alias aceptados
+FUENTES = {
+    'PROVCA': {'esquema': ESQUEMA_PROVCA, 'consumo_modelo': CONSUMO_MODELO_PROVISION, 'alias_modelo': {}},
+    'ANTICI': {'esquema': ESQUEMA_ANTICI, 'consumo_modelo': CONSUMO_MODELO_ANTICIPOS,
+               'alias_modelo': ALIAS_MODELO_ANTICI},
+}
+
+# Formato de fecha de los CSV PISA
+FORMATO_FECHA_PISA = '%Y%m%d'
+
+
+def normalizar_encabezado(nombre) -> str:
+    """Encabezado sin comillas, saltos de línea ni espacios sobrantes."""
+    return ' '.join(str(nombre).replace('"', ' ').split())
+
+
+def renombres(esquema: Iterable[Campo], con_comillas: bool = False) -> Dict[str, str]:
+    """PISA -> nombre del procesador (opcionalmente también con el encabezado entre comillas)."""
+    mapa = {c.origen: c.destino for c in esquema if c.destino}
+    if con_comillas:
+        mapa.update({f'"{origen}"': destino for origen, destino in list(mapa.items())})
+    return mapa
+
+
+def renombres_modelo(esquema: Iterable[Campo], alias: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+    """
+    PISA y nombre del procesador -> nombre del modelo, para que modelo_deuda
+    acepte tanto el CSV original como el Excel ya procesado.
+    """
+    mapa = {}
+    for c in esquema:
+        if not c.destino:
+            continue
+        final = c.modelo or c.destino
+        mapa[c.origen] = final
+        if c.destino != final:
+            mapa[c.destino] = final
+    mapa.update(alias or {})
+    return mapa
+
+
+def tipos_lectura(esquema: Iterable[Campo], montos_texto: bool = True) -> Dict[str, type]:
+    """
+    dtype por campo PISA (también con el encabezado entre comillas). Con
+    montos_texto=False los montos no se fijan y read_csv(decimal=',') los lee como float.
+    """
+    tipos = {}
+    for c in esquema:
+        if c.destino and (montos_texto or c.tipo != 'monto'):
+            tipos[c.origen] = tipos[f'"{c.origen}"'] = str
+    return tipos
+
+
+def convertir_fechas(df: pd.DataFrame, esquema: Iterable[Campo]) -> pd.DataFrame:
+    """Convierte en el mismo DataFrame los campos fecha PISA (AAAAMMDD) presentes."""
+    for c in esquema:
+        if c.tipo == 'fecha' and c.origen in df.columns:
+            df[c.origen] = pd.to_datetime(df[c.origen].astype(str).str.strip(),
+                                          format=FORMATO_FECHA_PISA, errors='coerce')
+    return df
+
+
+def columnas_procesador(esquema: Iterable[Campo]) -> Callable[[str], bool]:
+    """usecols para un procesador: todos los campos del esquema que tienen destino."""
+    usadas = {c.origen for c in esquema if c.destino}
+    return lambda nombre: normalizar_encabezado(nombre) in usadas
+
+
+def columnas_modelo(esquema: Iterable[Campo], consumo: Iterable[str],
+                    alias: Optional[Dict[str, str]] = None) -> Callable[[str], bool]:
+    """
+    usecols para modelo_deuda: acepta un encabezado si, con su nombre PISA,
+    del procesador o del modelo, corresponde a un campo consumido.
+    """
+    consumo = set(consumo)
+    mapa = renombres_modelo(esquema, alias)
+    return lambda nombre: mapa.get(normalizar_encabezado(nombre),
+                                   normalizar_encabezado(nombre)) in consumo
+
+
+# ============================================================
+# DIMENSIÓN DE LÍNEAS DE NEGOCIO
+# ============================================================
+LINEAS_PESOS = [
+    ('CT', '80'), ('ED', '41'), ('ED', '44'), ('ED', '47'),
+    ('PL', '10'), ('PL', '15'), ('PL', '20'), ('PL', '21'),
+    ('PL', '23'), ('PL', '25'), ('PL', '28'), ('PL', '29'),
+    ('PL', '31'), ('PL', '32'), ('PL', '53'), ('PL', '56'),
+    ('PL', '60'), ('PL', '62'), ('PL', '63'), ('PL', '64'),
+    ('PL', '65'), ('PL', '66'), ('PL', '69')
+]
+
+LINEAS_DIVISAS = [
+    ('PL', '11'), ('PL', '18'), ('PL', '57'), ('PL', '41')
+]
+
+# *** Tabla Negocio-Canal corregida según procedimiento pág. 7 ***
+# CORRECCIÓN OBS-4: PL10 -> LIBRERIAS 2 (no LIBRERIAS 3 como estaba antes)
+TABLA_NEGOCIO_CANAL = {
+    'PL10': {'NEGOCIO': 'LIBRERIAS 2', 'CANAL': 'LIBRERIAS 2'},
+    'PL15': {'NEGOCIO': 'E-COMMERCE',  'CANAL': 'E-COMMERCE'},
+    'PL20': {'NEGOCIO': 'LIBRERIAS 1', 'CANAL': 'LIBRERIAS 1'},
+    'PL21': {'NEGOCIO': 'LIBRERIAS 2', 'CANAL': 'LIBRERIAS 2'},
+    'PL23': {'NEGOCIO': 'LIBRERIAS 1', 'CANAL': 'LIBRERIAS 1'},
+    'PL25': {'NEGOCIO': 'LIBRERIAS 1', 'CANAL': 'LIBRERIAS 1'},
+    'PL28': {'NEGOCIO': 'SALDOS',      'CANAL': 'SALDOS'},
+    'PL29': {'NEGOCIO': 'SALDOS',      'CANAL': 'SALDOS'},
+    'PL31': {'NEGOCIO': 'SALDOS',      'CANAL': 'SALDOS'},
+    'PL32': {'NEGOCIO': 'DISTRIBUIDORES', 'CANAL': 'DISTRIBUIDORES'},
+    'PL53': {'NEGOCIO': 'LIBRERIAS 3', 'CANAL': 'LIBRERIAS 3'},
+    'PL56': {'NEGOCIO': 'OTROS DIGITAL','CANAL': 'OTROS DIGITAL'},
+    'PL57': {'NEGOCIO': 'PRENSA USD',  'CANAL': 'PRENSA USD'},
+    'PL60': {'NEGOCIO': 'OTROS',       'CANAL': 'OTROS'},
+    'PL62': {'NEGOCIO': 'PRENSA',      'CANAL': 'PRENSA'},
+    'PL63': {'NEGOCIO': 'LIBRERIAS 3', 'CANAL': 'LIBRERIAS 3'},
+    'PL64': {'NEGOCIO': 'OTROS',       'CANAL': 'OTROS'},
+    'PL65': {'NEGOCIO': 'OTROS',       'CANAL': 'OTROS'},
+    'PL66': {'NEGOCIO': 'OTROS DIGITAL','CANAL': 'OTROS DIGITAL'},
+    'PL69': {'NEGOCIO': 'LIBRERIAS 1', 'CANAL': 'LIBRERIAS 1'},
+    'PL11': {'NEGOCIO': 'EXPORTACION USD', 'CANAL': 'EXPORTACION USD'},
+    'PL18': {'NEGOCIO': 'EXPORTACION USD', 'CANAL': 'EXPORTACION USD'},
+    'PL41': {'NEGOCIO': 'EXPORTACION EURO','CANAL': 'EXPORTACION EURO'},
+    'CT80': {'NEGOCIO': 'TINTA CLUB DEL LIBRO', 'CANAL': 'TINTA'},
+    'ED41': {'NEGOCIO': 'EDUCACION',   'CANAL': 'EDUCACION'},
+    'ED44': {'NEGOCIO': 'OTROS DIGITAL','CANAL': 'OTROS DIGITAL'},
+    'ED47': {'NEGOCIO': 'EDUCACION',   'CANAL': 'EDUCACION'},
+}
+
+
+def _moneda_por_linea(linea_key: str) -> str:
+    k = str(linea_key).strip().upper()
+    if k in ('PL11', 'PL18', 'PL57'):
+        return 'DÓLAR'
+    if k == 'PL41':
+        return 'EURO'
+    return 'PESOS COL'
+
+
+def _tabla_dimension_lineas() -> pd.DataFrame:
+    """Dimensión de líneas: NEGOCIO, CANAL, MONEDA y banderas pesos/divisas."""
+    lineas_pesos   = {f"{cod}{act}" for cod, act in LINEAS_PESOS}
+    lineas_divisas = {f"{cod}{act}" for cod, act in LINEAS_DIVISAS}
+    claves = sorted(set(TABLA_NEGOCIO_CANAL) | lineas_pesos | lineas_divisas)
+    return pd.DataFrame({
+        'NEGOCIO':    [TABLA_NEGOCIO_CANAL.get(k, {}).get('NEGOCIO', 'OTROS') for k in claves],
+        'CANAL':      [TABLA_NEGOCIO_CANAL.get(k, {}).get('CANAL', 'OTROS') for k in claves],
+        'MONEDA':     [_moneda_por_linea(k) for k in claves],
+        'ES_PESOS':   [k in lineas_pesos for k in claves],
+        'ES_DIVISAS': [k in lineas_divisas for k in claves],
+    }, index=pd.Index(claves, name='LINEA DE NEGOCIO'))
+
+
+DIMENSION_LINEAS = _tabla_dimension_lineas()
+
+
+def atributos_linea(lineas: pd.Series) -> pd.DataFrame:
+    """
+    Cruza cada LINEA DE NEGOCIO con DIMENSION_LINEAS (un solo cruce por valor único).
+    Líneas desconocidas: NEGOCIO/CANAL 'OTROS', MONEDA 'PESOS COL', banderas en False.
+    """
+    clave = lineas.astype(str).str.strip().str.upper()
+    codigos, unicos = pd.factorize(clave)
+    dim = DIMENSION_LINEAS.reindex(unicos)
+    dim[['NEGOCIO', 'CANAL']] = dim[['NEGOCIO', 'CANAL']].fillna('OTROS')
+    dim['MONEDA'] = dim['MONEDA'].fillna('PESOS COL')
+    for col in ('ES_PESOS', 'ES_DIVISAS'):
+        dim[col] = dim[col].eq(True)
+    resultado = dim.iloc[codigos].reset_index(drop=True)
+    resultado.index = lineas.index
+    return resultado
+
+
+# Resumen de totales que modelo_deuda escribe junto al libro (<modelo>_totales.json)
+SUFIJO_TOTALES = '_totales.json'
+
+
+def ruta_totales_modelo(ruta_modelo: str) -> str:
+    return os.path.splitext(ruta_modelo)[0] + SUFIJO_TOTALES
@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+"""
+Evaluador de fórmulas de la hoja MODELO DEUDA del FOCUS
+Cubre el subconjunto que usa la plantilla: referencias ($ opcional), números,
++ - * / y paréntesis, y SUM / AVERAGE con rangos y celdas (=+D15+F15, =-D17,
+=F16, =SUM(H14:H18,H21), =H43+50, =AVERAGE(J7:K8)). Cada fórmula se compila una sola vez a una
+expresión Python y se arma el grafo de dependencias; tras escribir en la hoja
+solo se recalculan las celdas afectadas por los cambios.
+
+openpyxl guarda las fórmulas sin valor en caché, así que los valores
+recalculados se dejan además en un JSON junto al libro (*_valores.json), de
+donde la instantánea del mes siguiente completa los valores que falten.
+"""
+
+import json
+import os
+import re
+from datetime import datetime
+from graphlib import CycleError, TopologicalSorter
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Set, Union
+
+from openpyxl.utils import get_column_letter, range_boundaries
+
+from lectura_excel import CeldaValor, HojaValores
+
+SUFIJO_VALORES = '_valores.json'
+VERSION_VALORES = 1
+
+_TOKENS = re.compile(r'''
+    (?P<rango>\$?[A-Z]{1,3}\$?\d+:\$?[A-Z]{1,3}\$?\d+)
+  | (?P<ref>\$?[A-Z]{1,3}\$?\d+)
+  | (?P<num>\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)
+  | (?P<funcion>(?:SUM|AVERAGE)\()
+  | (?P<op>[-+*/(),])
+  | (?P<esp>\s+)
+''', re.VERBOSE)
+
+_REF_DIRECTA = re.compile(r'^=\+?(\$?[A-Z]{1,3}\$?\d+)$')
+
+# Referencias de una fórmula que no se sabe compilar: solo para saber cuándo queda desactualizada
+_REFERENCIAS = re.compile(r'(\$?[A-Z]{1,3}\$?\d+)(?::(\$?[A-Z]{1,3}\$?\d+))?')
+
+
+class ErrorFormula(Exception):
+    """Error de Excel al evaluar (#VALUE!, #DIV/0!): la celda queda sin valor."""
+
+
+def _coordenada(ref: str) -> str:
+    return ref.replace('$', '')
+
+
+def _celdas_rango(rango: str) -> List[str]:
+    min_col, min_fila, max_col, max_fila = range_boundaries(rango.replace('$', ''))
+    return [f"{get_column_letter(c)}{f}"
+            for f in range(min_fila, max_fila + 1) for c in range(min_col, max_col + 1)]
+
+
+class Formula:
+    """Fórmula compilada: código Python, celdas de las que depende y si es una referencia directa."""
+
+    def __init__(self, texto: str):
+        self.texto = texto
+        directa = _REF_DIRECTA.match(texto.upper())
+        self.directa = _coordenada(directa.group(1)) if directa else None
+        partes: List[str] = []
+        self.dependencias: Set[str] = set()
+        pos = 0
+        cuerpo = texto[1:].upper()
+        while pos < len(cuerpo):
+            m = _TOKENS.match(cuerpo, pos)
+            if not m:
+                raise ValueError(f"Fórmula no soportada: {texto}")
+            pos = m.end()
+            tipo, token = m.lastgroup, m.group()
+            if tipo == 'rango':
+                celdas = _celdas_rango(token)
+                self.dependencias.update(celdas)
+                partes.append(f"_r({celdas!r})")
+            elif tipo == 'ref':
+                if cuerpo.startswith('(', pos):  # función no soportada con nombre de celda (LOG10)
+                    raise ValueError(f"Fórmula no soportada: {texto}")
+                self.dependencias.add(_coordenada(token))
+                partes.append(f"_v({_coordenada(token)!r})")
+            elif tipo == 'num':
+                partes.append(repr(float(token)))
+            elif tipo == 'funcion':
+                partes.append(f"_{token[:-1].lower()}(")
+            elif tipo == 'op':
+                partes.append(token)
+        self.codigo = compile(''.join(partes) or '0', texto, 'eval')
+
+
+def _referencias_texto(texto: str) -> Set[str]:
+    """Celdas que menciona una fórmula no soportada (aproximación por exceso)."""
+    celdas: Set[str] = set()
+    for inicio, fin in _REFERENCIAS.findall(texto.upper()):
+        if fin:
+            celdas.update(_celdas_rango(f"{inicio}:{fin}"))
+        else:
+            celdas.add(_coordenada(inicio))
+    return celdas
+
+
+def _numero(valor: Any) -> float:
+    if valor is None:
+        return 0.0
+    if isinstance(valor, (bool, int, float)):
+        return float(valor)
+    raise ErrorFormula(f"valor no numérico: {valor!r}")
+
+
+def _numeros_argumentos(argumentos) -> List[float]:
+    """Números de los argumentos de SUM / AVERAGE: en rangos se ignoran textos y vacíos."""
+    numeros = []
+    for arg in argumentos:
+        if isinstance(arg, list):
+            numeros.extend(float(v) for v in arg if isinstance(v, (int, float)) and not isinstance(v, bool))
+        else:
+            numeros.append(arg)
+    return numeros
+
+
+def _suma(*argumentos) -> float:
+    return float(sum(_numeros_argumentos(argumentos)))
+
+
+def _promedio(*argumentos) -> float:
+    numeros = _numeros_argumentos(argumentos)
+    if not numeros:
+        raise ErrorFormula('#DIV/0!')
+    return sum(numeros) / len(numeros)
+
+
+def _contenido_hoja(ws) -> Dict[str, Any]:
+    """Contenido (fórmula como texto o constante) de las celdas no vacías de una hoja editable."""
+    return {
+        celda.coordinate: celda.value
+        for fila in ws.iter_rows() for celda in fila
+        if celda.value is not None
+    }
+
+
+class EvaluadorFormulas:
+    """
+    Valores de una hoja a partir de sus fórmulas. Arranca con los valores en
+    caché del archivo base (valores_cache) y con el contenido actual de ws;
+    sincronizar(ws) detecta lo escrito desde entonces y recalcula solo las
+    celdas que dependen de ello. Se consulta como una hoja: evaluador['H22'].value.
+
+    Las fórmulas no soportadas conservan su valor en caché mientras no cambie
+    ninguna celda que mencionan; sin caché, o desactualizadas, quedan en
+    errores y el error se propaga a las fórmulas que dependen de ellas.
+    """
+
+    def __init__(self, ws, valores_cache: Optional[HojaValores] = None):
+        self.title = ws.title
+        self.contenido: Dict[str, Any] = _contenido_hoja(ws)
+        self.valores: Dict[str, Any] = {}
+        self.formulas: Dict[str, Formula] = {}
+        self.no_soportadas: Dict[str, str] = {}
+        self.errores: Dict[str, str] = {}
+        self.recalculadas = 0
+
+        cache = valores_cache.celdas if valores_cache is not None else {}
+        pendientes = set()
+        for coord, valor in self.contenido.items():
+            if self._es_formula(valor):
+                self._registrar_formula(coord, valor)
+                if coord in cache:
+                    self.valores[coord] = cache[coord]
+                else:
+                    pendientes.add(coord)
+            else:
+                self.valores[coord] = valor
+        self._ordenar()
+        # Fórmulas sin valor en caché (libro guardado sin recalcular): se evalúan ya
+        self._recalcular(pendientes, incluir_origen=True)
+
+    @staticmethod
+    def _es_formula(valor: Any) -> bool:
+        return isinstance(valor, str) and valor.startswith('=')
+
+    def _registrar_formula(self, coord: str, texto: str) -> None:
+        try:
+            self.formulas[coord] = Formula(texto)
+            self.no_soportadas.pop(coord, None)
+        except (ValueError, SyntaxError):
+            self.formulas.pop(coord, None)
+            self.no_soportadas[coord] = texto
+
+    def _ordenar(self) -> None:
+        """Orden topológico de las fórmulas y mapa inverso celda -> fórmulas que la usan."""
+        self.dependientes: Dict[str, Set[str]] = {}
+        grafo = {}
+        calculadas = self.formulas.keys() | self.no_soportadas.keys()
+        dependencias = {coord: formula.dependencias for coord, formula in self.formulas.items()}
+        dependencias.update((coord, _referencias_texto(texto)) for coord, texto in self.no_soportadas.items())
+        for coord, celdas in dependencias.items():
+            grafo[coord] = celdas & calculadas
+            for dep in celdas:
+                self.dependientes.setdefault(dep, set()).add(coord)
+        try:
+            orden = list(TopologicalSorter(grafo).static_order())
+        except CycleError as e:
+            raise ValueError(f"Referencia circular en la hoja {self.title}: {e.args[1]}") from e
+        self.posicion = {coord: i for i, coord in enumerate(orden)}
+
+    def _valor_sin_error(self, celda: str) -> Any:
+        """Valor de una celda; un error en ella se propaga (como en Excel)."""
+        if celda in self.errores:
+            raise ErrorFormula(self.errores[celda])
+        return self.valores.get(celda)
+
+    def _evaluar(self, formula: Formula) -> Any:
+        if formula.directa:
+            valor = self._valor_sin_error(formula.directa)
+            return 0.0 if valor is None else valor
+        entorno = {
+            '__builtins__': {},
+            '_v': lambda c: _numero(self._valor_sin_error(c)),
+            '_r': lambda celdas: [self._valor_sin_error(c) for c in celdas],
+            '_sum': _suma,
+            '_average': _promedio,
+        }
+        try:
+            resultado = eval(formula.codigo, entorno)
+        except ZeroDivisionError as e:
+            raise ErrorFormula('#DIV/0!') from e
+        except (TypeError, ValueError) as e:
+            # p. ej. un rango fuera de SUM / AVERAGE (=A1:A2+1)
+            raise ErrorFormula('#VALUE!') from e
+        if not isinstance(resultado, float):
+            raise ErrorFormula(f"resultado no numérico: {resultado!r}")
+        return resultado
+
+    def _recalcular(self, origen: Iterable[str], incluir_origen: bool = False) -> int:
+        """Recalcula, en orden topológico, las fórmulas alcanzables desde las celdas de origen."""
+        afectadas: Set[str] = set()
+        pila = list(origen)
+        if incluir_origen:
+            afectadas.update(c for c in pila if c in self.posicion)
+        while pila:
+            for dep in self.dependientes.get(pila.pop(), ()):
+                if dep not in afectadas:
+                    afectadas.add(dep)
+                    pila.append(dep)
+        for coord in sorted(afectadas, key=self.posicion.__getitem__):
+            if coord in self.no_soportadas:
+                self.valores[coord] = None
+                self.errores[coord] = f"fórmula no soportada: {self.no_soportadas[coord]}"
+                continue
+            try:
+                self.valores[coord] = self._evaluar(self.formulas[coord])
+                self.errores.pop(coord, None)
+            except ErrorFormula as e:
+                self.valores[coord] = None
+                self.errores[coord] = str(e)
+        self.recalculadas += len(afectadas)
+        return len(afectadas)
+
+    def sincronizar(self, ws) -> int:
+        """Toma lo escrito en ws desde la última sincronización y recalcula lo afectado."""
+        self.title = ws.title
+        actual = _contenido_hoja(ws)
+        cambiadas = [c for c in self.contenido.keys() | actual.keys()
+                     if self.contenido.get(c) != actual.get(c)]
+        if not cambiadas:
+            return 0
+        cambio_formulas = False
+        for coord in cambiadas:
+            valor = actual.get(coord)
+            if self._es_formula(valor) or coord in self.formulas or coord in self.no_soportadas:
+                cambio_formulas = True
+                self.formulas.pop(coord, None)
+                self.no_soportadas.pop(coord, None)
+            if self._es_formula(valor):
+                self._registrar_formula(coord, valor)
+            else:
+                self.valores[coord] = valor
+                self.errores.pop(coord, None)
+        self.contenido = actual
+        if cambio_formulas:
+            self._ordenar()
+        return self._recalcular(cambiadas, incluir_origen=True)
+
+    def valor(self, celda: str) -> Any:
+        return self.valores.get(celda.upper())
+
+    def __getitem__(self, celda: str) -> CeldaValor:
+        return CeldaValor(self.valor(celda))
+
+    def valores_formulas(self) -> Dict[str, Any]:
+        return {coord: self.valores.get(coord) for coord in self.formulas}
+
+
+def ruta_valores(ruta_libro: Union[str, Path]) -> Path:
+    ruta = Path(ruta_libro)
+    return ruta.with_name(ruta.stem + SUFIJO_VALORES)
+
+
+def guardar_valores(ruta_libro: Union[str, Path], evaluador: EvaluadorFormulas) -> Path:
+    """JSON con los valores recalculados de las fórmulas, junto al libro."""
+    ruta = ruta_valores(ruta_libro)
+    with open(ruta, 'w', encoding='utf-8') as f:
+        json.dump({
+            'version':  VERSION_VALORES,
+            'libro':    os.path.basename(str(ruta_libro)),
+            'hoja':     evaluador.title,
+            'generado': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'valores':  evaluador.valores_formulas(),
+        }, f, indent=2, ensure_ascii=False, default=str)
+    return ruta
+
+
+def completar_con_valores(hoja: HojaValores, ruta_libro: Union[str, Path]) -> int:
+    """
+    Completa en la instantánea las celdas sin valor en caché con el JSON de
+    valores del libro (si existe). Lo que Excel ya recalculó no se toca.
+    """
+    ruta = ruta_valores(ruta_libro)
+    if not ruta.exists():
+        return 0
+    with open(ruta, encoding='utf-8') as f:
+        datos = json.load(f)
+    if datos.get('version') != VERSION_VALORES:
+        return 0
+    completadas = 0
+    for coord, valor in datos.get('valores', {}).items():
+        if coord not in hoja.celdas and valor is not None:
+            hoja.celdas[coord] = valor
+            completadas += 1
+    return completadas
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+Utilidades compartidas de exportación a Excel (xlsxwriter)
+Estimación rápida de anchos de columna y caché de formatos usados por
+procesador_cartera, procesador_anticipos y modelo_deuda.
+"""
+
+from typing import Any, Dict, Iterable, Optional
+
+import pandas as pd
+
+# Máximo de filas que se inspeccionan para estimar el ancho de una columna
+MUESTRA_ANCHO = 2000
+
+
+class CacheFormatos:
+    """
+    Reutiliza un único objeto Format de xlsxwriter por estilo.
+
+    xlsxwriter crea un Format nuevo en cada add_format, aunque el estilo
+    sea idéntico; la caché evita formatos duplicados en el libro.
+    """
+
+    def __init__(self, workbook):
+        self.workbook = workbook
+        self._formatos: Dict[tuple, Any] = {}
+
+    def obtener(self, estilo: Optional[dict] = None):
+        """Devuelve el Format asociado al estilo (None si no hay estilo)."""
+        if not estilo:
+            return None
+        clave = tuple(sorted(estilo.items()))
+        formato = self._formatos.get(clave)
+        if formato is None:
+            formato = self.workbook.add_format(dict(estilo))
+            self._formatos[clave] = formato
+        return formato
+
+
+def _muestra_columna(serie: pd.Series, muestra: int = MUESTRA_ANCHO) -> pd.Series:
+    """Muestra acotada y repartida a lo largo de la columna."""
+    if len(serie) <= muestra:
+        return serie
+    paso = -(-len(serie) // muestra)
+    return serie.iloc[::paso]
+
+
+def estimar_ancho(serie: pd.Series, encabezado, relleno: int = 2,
+                  minimo: int = 0, maximo: Optional[int] = None,
+                  muestra: int = MUESTRA_ANCHO) -> int:
+    """
+    Ancho de columna = max(largo del texto en la muestra, largo del encabezado) + relleno.
+    Las fechas se consideran de 12 caracteres (dd/mm/yyyy).
+    """
+    largo_encabezado = len(str(encabezado))
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        largo_datos = 12
+    else:
+        valores = _muestra_columna(serie, muestra)
+        largo_datos = valores.astype(str).str.len().max() if len(valores) else 0
+        if pd.isna(largo_datos):
+            largo_datos = 0
+    ancho = max(int(largo_datos), largo_encabezado) + relleno
+    ancho = max(ancho, minimo)
+    if maximo is not None:
+        ancho = min(ancho, maximo)
+    return ancho
+
+
+def escribir_encabezados(worksheet, columnas: Iterable, formato,
+                         alto: Optional[int] = None, fila: int = 0) -> None:
+    """Escribe la fila de encabezados en una sola llamada."""
+    worksheet.write_row(fila, 0, [str(c) for c in columnas], formato)
+    if alto is not None:
+        worksheet.set_row(fila, alto)
+
+
+def reescribir_fechas(worksheet, df: pd.DataFrame, indices_columnas: Iterable[int],
+                      formato, fila_inicial: int = 1) -> None:
+    """Reescribe como datetime real solo las columnas de fecha (omite vacíos)."""
+    for col_num in indices_columnas:
+        serie = pd.to_datetime(df.iloc[:, col_num], errors='coerce')
+        validas = serie.notna().to_numpy()
+        for row_num, valor in zip(validas.nonzero()[0], serie[validas]):
+            worksheet.write_datetime(fila_inicial + int(row_num), col_num,
+                                     valor.to_pydatetime(), formato)
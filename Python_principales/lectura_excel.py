@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+Lectura compartida de libros Excel
+Abre cada libro una sola vez (openpyxl en modo solo lectura, o calamine si
+está instalado y pandas es 2.2 o posterior), elige la hoja por su encabezado
+y primera fila de datos y solo convierte a DataFrame la hoja elegida.
+InstantaneaLibro guarda en un diccionario los valores en caché de un libro
+para consultas repetidas.
+"""
+
+import re
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
+
+import pandas as pd
+from openpyxl import load_workbook
+from openpyxl.utils import get_column_letter
+
+# Motor rápido opcional para .xlsx: python-calamine (ver requirements.txt),
+# que pandas solo acepta como engine desde la 2.2
+_PANDAS_CON_CALAMINE = tuple(map(int, re.match(r'(\d+)\.(\d+)', pd.__version__).groups())) >= (2, 2)
+try:
+    import python_calamine  # noqa: F401  # pyright: ignore[reportMissingImports]
+    MOTOR_XLSX = 'calamine' if _PANDAS_CON_CALAMINE else 'openpyxl'
+except ImportError:
+    MOTOR_XLSX = 'openpyxl'
+
+
+def motor_excel(ruta: Union[str, Path]) -> str:
+    """Motor de lectura según la extensión del archivo."""
+    if str(ruta).lower().endswith('.xls'):
+        return 'xlrd'
+    return MOTOR_XLSX
+
+
+def _hoja_con_datos(xls: pd.ExcelFile, hoja: str) -> bool:
+    """
+    True si la hoja tiene al menos dos columnas de encabezado y una fila de datos.
+    No se usa la dimensión declarada del libro (algunos exportadores escriben
+    A1 en hojas con datos): se lee solo la primera fila de datos.
+    """
+    try:
+        muestra = xls.parse(hoja, nrows=1)
+    except Exception:
+        return False
+    return len(muestra) > 0 and len(muestra.columns) > 1
+
+
+def elegir_hoja(xls: pd.ExcelFile, hojas_prioridad: Optional[Iterable[str]] = None) -> str:
+    """
+    Hoja a leer: la primera de hojas_prioridad que exista; si no, la primera
+    con datos; si ninguna tiene datos, la primera del libro.
+    """
+    hojas = xls.sheet_names
+    for hoja in hojas_prioridad or []:
+        if hoja in hojas:
+            return hoja
+    for hoja in hojas:
+        if _hoja_con_datos(xls, hoja):
+            return hoja
+    return hojas[0]
+
+
+def leer_hoja_excel(ruta: Union[str, Path], hoja: Union[int, str, None] = None,
+                    hojas_prioridad: Optional[Iterable[str]] = None,
+                    **kwargs) -> Tuple[pd.DataFrame, str]:
+    """
+    Abre el libro una sola vez y devuelve (DataFrame, nombre de la hoja leída).
+    Si hoja es None se elige con elegir_hoja().
+    """
+    with pd.ExcelFile(ruta, engine=motor_excel(ruta)) as xls:
+        if hoja is None:
+            hoja = elegir_hoja(xls, hojas_prioridad)
+        elif isinstance(hoja, int):
+            hoja = xls.sheet_names[hoja]
+        df = xls.parse(hoja, **kwargs)
+    return df, hoja
+
+
+class CeldaValor(NamedTuple):
+    value: Any
+
+
+class HojaValores:
+    """Valores en caché de una hoja: diccionario coordenada ('D22') -> valor."""
+
+    def __init__(self, titulo: str, celdas: Dict[str, Any]):
+        self.title = titulo
+        self.celdas = celdas
+
+    def valor(self, celda: str) -> Any:
+        return self.celdas.get(celda.upper())
+
+    def __getitem__(self, celda: str) -> CeldaValor:
+        # Misma forma de acceso que una hoja openpyxl: hoja['D22'].value
+        return CeldaValor(self.valor(celda))
+
+
+def _celdas_hoja(ws) -> Dict[str, Any]:
+    """Celdas no vacías de una hoja en modo solo lectura, en una sola pasada."""
+    ws.reset_dimensions()          # no confiar en la dimensión declarada del archivo
+    letras: List[str] = []
+    celdas: Dict[str, Any] = {}
+    for fila, valores in enumerate(ws.iter_rows(min_row=1, min_col=1, values_only=True), start=1):
+        if len(valores) > len(letras):
+            letras.extend(get_column_letter(i) for i in range(len(letras) + 1, len(valores) + 1))
+        for letra, valor in zip(letras, valores):
+            if valor is not None:
+                celdas[f"{letra}{fila}"] = valor
+    return celdas
+
+
+class InstantaneaLibro:
+    """
+    Valores en caché (data_only) de las hojas elegidas de un libro, leídos una
+    sola vez en modo solo lectura. Sustituye volver a abrir el libro con
+    load_workbook cada vez que se necesita un valor del archivo base.
+    La hoja activa se incluye siempre (es el respaldo habitual de las búsquedas).
+    """
+
+    def __init__(self, ruta: Union[str, Path], incluir: Optional[Callable[[str], bool]] = None):
+        self.ruta = Path(ruta)
+        wb = load_workbook(self.ruta, read_only=True, data_only=True)
+        try:
+            self.nombres_hojas = list(wb.sheetnames)
+            self.activa = wb.active.title if wb.active is not None else self.nombres_hojas[0]
+            self.hojas: Dict[str, HojaValores] = {}
+            for nombre in self.nombres_hojas:
+                if incluir is not None and not incluir(nombre) and nombre != self.activa:
+                    continue
+                ws = wb[nombre]
+                if hasattr(ws, 'iter_rows'):
+                    self.hojas[nombre] = HojaValores(nombre, _celdas_hoja(ws))
+        finally:
+            wb.close()
+
+    def buscar(self, condicion: Callable[[str], bool]) -> Optional[HojaValores]:
+        """Primera hoja cargada (en el orden del libro) cuyo nombre cumple la condición."""
+        return next((hoja for nombre, hoja in self.hojas.items() if condicion(nombre)), None)
+
+    def hoja_o_activa(self, condicion: Callable[[str], bool]) -> HojaValores:
+        return self.buscar(condicion) or self.hojas[self.activa]
+
+    def total_celdas(self) -> int:
+        return sum(len(h.celdas) for h in self.hojas.values())
@@ -0,0 +1,262 @@
+# ==========================================================
+# MATRICES DE TRANSICIÓN (ROLL RATES) ENTRE BUCKETS DE VENCIMIENTO
+# Departamento de Cartera - Editorial Planeta Colombia
+# ==========================================================
+"""
+A partir de una serie de MODELO_DEUDA mensuales (en orden cronológico) cruza
+cada par de meses consecutivos por (LINEA DE NEGOCIO, NUMERO FACTURA) y
+acumula, por LINEA DE NEGOCIO, el saldo y el número de facturas que pasan de
+un bucket al siguiente (o quedan PAGADAS). Con las tasas resultantes proyecta
+la pérdida esperada del último mes: probabilidad de llegar a VENCIDO + 360
+dentro del horizonte (cadena de Markov con VENCIDO + 360 y PAGADA absorbentes).
+
+Las tasas de una línea se ponderan por saldo. Un estado sin historia en la
+línea toma las tasas de las líneas de su MONEDA (también por saldo, sin
+mezclar pesos con dólares o euros) y, si su moneda tampoco tiene historia,
+las de todas las líneas ponderadas por número de facturas, que no dependen
+de la moneda.
+
+Uso:
+    python matrices_transicion.py MODELO_ENE.xlsx MODELO_FEB.xlsx ... -o ROLL_RATES.xlsx
+"""
+
+import argparse
+import sys
+from datetime import datetime
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from comparar_modelos import (BUCKETS_FACTURA, SIN_BUCKET, TOLERANCIA_SALDO,
+                              comparar_facturas, leer_facturas_modelo, resolver_modelo)
+from exportar_excel import CacheFormatos, escribir_encabezados
+
+ESTADO_PAGADA = 'PAGADA'
+ESTADO_INCUMPLIMIENTO = 'VENCIDO + 360'
+
+# Estados de la cadena: buckets en orden de antigüedad + PAGADA
+ESTADOS = BUCKETS_FACTURA + [ESTADO_PAGADA]
+
+LINEA_TODAS = 'TODAS'
+
+HORIZONTE_MESES = 12
+
+
+def transiciones_periodo(anterior: pd.DataFrame, actual: pd.DataFrame) -> pd.DataFrame:
+    """
+    Facturas con saldo positivo en el mes anterior y su estado en el mes actual
+    (LINEA DE NEGOCIO, MONEDA, DESDE, HACIA, SALDO). Los anticipos (saldo negativo) no cuentan.
+    """
+    delta = comparar_facturas(anterior, actual)
+    origen = delta[(delta['BUCKET ANTERIOR'] != '') & (delta['BUCKET ANTERIOR'] != SIN_BUCKET)
+                   & (delta['SALDO ANTERIOR'] > TOLERANCIA_SALDO)]
+    hacia = origen['BUCKET ACTUAL'].where(
+        (origen['MOVIMIENTO'] != 'PAGADA') & (origen['BUCKET ACTUAL'] != SIN_BUCKET),
+        ESTADO_PAGADA,
+    )
+    return pd.DataFrame({
+        'LINEA DE NEGOCIO': origen['LINEA DE NEGOCIO'].to_numpy(),
+        'MONEDA':           origen['MONEDA'].to_numpy(),
+        'DESDE':            origen['BUCKET ANTERIOR'].to_numpy(),
+        'HACIA':            hacia.to_numpy(),
+        'SALDO':            origen['SALDO ANTERIOR'].to_numpy(),
+    })
+
+
+def acumular_transiciones(transiciones: pd.DataFrame) -> Tuple[pd.Index, np.ndarray, np.ndarray]:
+    """
+    (lineas, facturas[L, S, S], saldo[L, S, S]) acumulados con np.add.at sobre el
+    código entero linea * S² + desde * S + hacia.
+    """
+    n_estados = len(ESTADOS)
+    cod_linea, lineas = pd.factorize(transiciones['LINEA DE NEGOCIO'], sort=True)
+    desde = pd.Categorical(transiciones['DESDE'], categories=ESTADOS).codes
+    hacia = pd.Categorical(transiciones['HACIA'], categories=ESTADOS).codes
+    celda = (cod_linea * n_estados + desde) * n_estados + hacia
+
+    facturas = np.zeros(len(lineas) * n_estados * n_estados)
+    saldo = np.zeros_like(facturas)
+    np.add.at(facturas, celda, 1.0)
+    np.add.at(saldo, celda, transiciones['SALDO'].to_numpy(dtype=float))
+    forma = (len(lineas), n_estados, n_estados)
+    return pd.Index(lineas), facturas.reshape(forma), saldo.reshape(forma)
+
+
+def tasas_transicion(acumulado: np.ndarray) -> np.ndarray:
+    """Normaliza cada fila DESDE a proporciones (filas sin observaciones quedan en cero)."""
+    totales = acumulado.sum(axis=-1, keepdims=True)
+    return np.divide(acumulado, totales, out=np.zeros_like(acumulado), where=totales > 0)
+
+
+def tasas_por_moneda(monedas_linea: np.ndarray, saldo: np.ndarray) -> Dict[str, np.ndarray]:
+    """Tasas [S, S] por MONEDA, ponderadas por el saldo de las líneas de esa moneda."""
+    return {moneda: tasas_transicion(saldo[monedas_linea == moneda].sum(axis=0))
+            for moneda in pd.unique(monedas_linea)}
+
+
+def completar_tasas(tasas: np.ndarray, respaldo: np.ndarray) -> np.ndarray:
+    """Filas DESDE sin observaciones en `tasas` tomadas de `respaldo` (mismas dimensiones o difundible)."""
+    sin_historia = tasas.sum(axis=-1) == 0
+    return np.where(sin_historia[..., None], respaldo, tasas)
+
+
+def probabilidad_incumplimiento(tasas: np.ndarray, tasas_respaldo: np.ndarray,
+                                horizonte: int = HORIZONTE_MESES) -> np.ndarray:
+    """
+    Probabilidad [L, S] de llegar a VENCIDO + 360 en `horizonte` meses desde cada estado.
+    Filas sin historia en la línea toman las de tasas_respaldo ([L, S, S] o [S, S]);
+    VENCIDO + 360 y PAGADA son absorbentes.
+    """
+    cadena = completar_tasas(tasas, tasas_respaldo if tasas_respaldo.ndim == 3 else tasas_respaldo[None])
+    absorbentes = [ESTADOS.index(ESTADO_INCUMPLIMIENTO), ESTADOS.index(ESTADO_PAGADA)]
+    identidad = np.eye(len(ESTADOS))
+    cadena[:, absorbentes, :] = identidad[absorbentes]
+    potencia = np.linalg.matrix_power(cadena, horizonte)
+    return potencia[:, :, ESTADOS.index(ESTADO_INCUMPLIMIENTO)]
+
+
+def proyectar_perdida(ultimo: pd.DataFrame, lineas: pd.Index, prob: np.ndarray,
+                      prob_monedas: Dict[str, np.ndarray], prob_todas: np.ndarray) -> pd.DataFrame:
+    """
+    Pérdida esperada por LINEA DE NEGOCIO y bucket con el saldo positivo del último mes.
+    Líneas sin transiciones usan la probabilidad de su MONEDA (o la de todas las líneas).
+    """
+    montos = ultimo[ultimo['SALDO'] > TOLERANCIA_SALDO]
+    saldo = (
+        montos.groupby(['LINEA DE NEGOCIO', 'MONEDA'])[BUCKETS_FACTURA].sum()
+        .clip(lower=0.0).stack().rename('SALDO').reset_index()
+        .rename(columns={'level_2': 'BUCKET'})
+    )
+    fila_linea = lineas.get_indexer(saldo['LINEA DE NEGOCIO'])
+    col_bucket = pd.Categorical(saldo['BUCKET'], categories=ESTADOS).codes
+    prob_respaldo = [prob_monedas.get(moneda, prob_todas)[bucket]
+                     for moneda, bucket in zip(saldo['MONEDA'], col_bucket)]
+    prob_linea = np.where(fila_linea >= 0, prob[np.maximum(fila_linea, 0), col_bucket],
+                          np.asarray(prob_respaldo, dtype=float))
+    saldo['PROB. INCUMPLIMIENTO'] = prob_linea
+    saldo['PERDIDA ESPERADA'] = (saldo['SALDO'] * prob_linea).round(2)
+    return saldo[saldo['SALDO'] != 0].reset_index(drop=True)
+
+
+def _matrices_largas(lineas: Sequence[str], matrices: np.ndarray) -> pd.DataFrame:
+    """Una fila por (LINEA DE NEGOCIO, DESDE) y una columna por estado HACIA."""
+    filas = np.asarray(matrices).reshape(-1, len(ESTADOS))
+    df = pd.DataFrame(filas, columns=ESTADOS)
+    df.insert(0, 'DESDE', np.tile(ESTADOS, len(lineas)))
+    df.insert(0, 'LINEA DE NEGOCIO', np.repeat(np.asarray(lineas, dtype=object), len(ESTADOS)))
+    # La fila PAGADA no tiene origen observado: se omite
+    return df[df['DESDE'] != ESTADO_PAGADA].reset_index(drop=True)
+
+
+def calcular_roll_rates(modelos: List[str], output_path: str,
+                        horizonte: int = HORIZONTE_MESES) -> str:
+    """Matrices de transición y proyección de pérdida a partir de modelos mensuales."""
+    if len(modelos) < 2:
+        raise ValueError("Se necesitan al menos dos modelos de deuda (meses consecutivos)")
+
+    print("\n" + "=" * 62)
+    print("  MATRICES DE TRANSICIÓN ENTRE BUCKETS")
+    print("=" * 62)
+
+    snapshots = []
+    for modelo in modelos:
+        libro, _ = resolver_modelo(modelo)
+        snapshots.append(leer_facturas_modelo(libro))
+        print(f"  [OK] {libro} ({len(snapshots[-1]):,} registros)")
+
+    transiciones = pd.concat(
+        [transiciones_periodo(ant, act) for ant, act in zip(snapshots, snapshots[1:])],
+        ignore_index=True,
+    )
+    if transiciones.empty:
+        raise ValueError("No hay facturas con saldo positivo para calcular transiciones")
+    print(f"  [INFO] {len(transiciones):,} transiciones en {len(snapshots) - 1} periodo(s)")
+
+    lineas, facturas, saldo = acumular_transiciones(transiciones)
+    monedas_linea = (
+        transiciones.groupby('LINEA DE NEGOCIO')['MONEDA'].first().reindex(lineas).to_numpy(dtype=object)
+    )
+    tasas = tasas_transicion(saldo)
+    # Respaldo: tasas de la moneda (por saldo) y, sin historia en la moneda,
+    # las de todas las líneas por número de facturas (no suma saldos de monedas distintas)
+    tasas_todas = tasas_transicion(facturas.sum(axis=0))
+    tasas_monedas = {moneda: completar_tasas(t, tasas_todas)
+                     for moneda, t in tasas_por_moneda(monedas_linea, saldo).items()}
+    respaldo_lineas = np.stack([tasas_monedas[moneda] for moneda in monedas_linea])
+
+    prob = probabilidad_incumplimiento(tasas, respaldo_lineas, horizonte)
+    prob_todas = probabilidad_incumplimiento(tasas_todas[None], tasas_todas, horizonte)[0]
+    prob_monedas = {moneda: probabilidad_incumplimiento(t[None], tasas_todas, horizonte)[0]
+                    for moneda, t in tasas_monedas.items()}
+    perdida = proyectar_perdida(snapshots[-1], lineas, prob, prob_monedas, prob_todas)
+
+    monedas = sorted(tasas_monedas)
+    facturas_monedas = [facturas[monedas_linea == moneda].sum(axis=0) for moneda in monedas]
+    etiquetas = list(lineas) + [f"{LINEA_TODAS} {moneda}" for moneda in monedas] + [LINEA_TODAS]
+    hoja_tasas = _matrices_largas(etiquetas, np.concatenate(
+        [tasas, np.stack([tasas_monedas[m] for m in monedas]), tasas_todas[None]]))
+    hoja_facturas = _matrices_largas(etiquetas, np.concatenate(
+        [facturas, np.stack(facturas_monedas), facturas.sum(axis=0)[None]]))
+
+    with pd.ExcelWriter(output_path, engine='xlsxwriter') as writer:
+        formatos = CacheFormatos(writer.book)
+        fmt_miles = formatos.obtener({'num_format': '#,##0.00;-#,##0.00;"-";@'})
+        fmt_pct = formatos.obtener({'num_format': '0.00%'})
+        fmt_entero = formatos.obtener({'num_format': '#,##0'})
+        fmt_header = formatos.obtener({
+            'bold': True, 'bg_color': '#1F3864', 'font_color': '#FFFFFF',
+            'border': 1, 'align': 'center', 'valign': 'vcenter', 'text_wrap': True
+        })
+        for nombre, df, fmt_valores in (
+            ('TASAS_TRANSICION', hoja_tasas, fmt_pct),
+            ('FACTURAS_TRANSICION', hoja_facturas, fmt_entero),
+        ):
+            df.to_excel(writer, sheet_name=nombre, index=False)
+            ws = writer.sheets[nombre]
+            escribir_encabezados(ws, df.columns, fmt_header, alto=30)
+            ws.set_column(0, 1, 20)
+            ws.set_column(2, len(df.columns) - 1, 16, fmt_valores)
+            ws.freeze_panes(1, 2)
+
+        perdida.to_excel(writer, sheet_name='PROYECCION_PERDIDA', index=False)
+        ws = writer.sheets['PROYECCION_PERDIDA']
+        escribir_encabezados(ws, perdida.columns, fmt_header, alto=30)
+        ws.set_column(0, 2, 20)
+        ws.set_column(3, 3, 20, fmt_miles)
+        ws.set_column(4, 4, 16, fmt_pct)
+        ws.set_column(5, 5, 20, fmt_miles)
+        ws.freeze_panes(1, 0)
+
+    for moneda, total in perdida.groupby('MONEDA')['PERDIDA ESPERADA'].sum().items():
+        print(f"  [INFO] Pérdida esperada {horizonte}m ({moneda}): {total:,.2f}")
+    print(f"\n  ✓ Matrices de transición generadas: {output_path}\n")
+    return output_path
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Matrices de transición (roll rates) entre buckets de vencimiento"
+    )
+    parser.add_argument("modelos", nargs='+',
+                        help="MODELO_DEUDA mensuales en orden cronológico (*.xlsx o *_totales.json)")
+    parser.add_argument("-o", "--output-file",
+                        help="Nombre del archivo de salida (*.xlsx)",
+                        default=None)
+    parser.add_argument("--horizonte", type=int, default=HORIZONTE_MESES,
+                        help="Meses de proyección de la pérdida esperada")
+    args = parser.parse_args()
+
+    if not args.output_file:
+        ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+        args.output_file = f"ROLL_RATES_{ts}.xlsx"
+
+    try:
+        calcular_roll_rates(args.modelos, args.output_file, args.horizonte)
+    except Exception as e:
+        print(f"\n[ERROR] {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
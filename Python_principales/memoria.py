@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Seguimiento de memoria del proceso
+Pico de memoria residente (RSS) por paso y verificación contra un presupuesto,
+usado por el modo de memoria ligera de modelo_deuda.
+"""
+
+import sys
+from typing import List, Optional, Tuple
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:          # Windows
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+MB = 1024 * 1024
+
+
+class PresupuestoMemoriaExcedido(RuntimeError):
+    """El pico de memoria superó el presupuesto (las salidas ya se escribieron)."""
+
+
+def rss_pico_mb() -> Optional[float]:
+    """Pico de memoria residente del proceso en MB (None si no se puede medir)."""
+    if resource is not None:
+        pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux informa KB; macOS informa bytes
+        return pico / MB if sys.platform == 'darwin' else pico / 1024
+    if psutil is not None:
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss) / MB
+    return None
+
+
+def rss_pico_hijos_mb() -> Optional[float]:
+    """
+    Pico de RSS del mayor proceso hijo ya terminado, en MB (lectura en
+    paralelo con procesos). None si no se puede medir o no hubo hijos.
+    """
+    if resource is None:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    if not pico:
+        return None
+    return pico / MB if sys.platform == 'darwin' else pico / 1024
+
+
+def tamano_df_mb(*dfs: pd.DataFrame) -> float:
+    """Memoria ocupada por los DataFrames (incluye el contenido de columnas object)."""
+    return sum(float(df.memory_usage(deep=True).sum()) for df in dfs) / MB
+
+
+class MonitorMemoria:
+    """
+    Registra el pico de RSS al final de cada paso.
+
+    El pico es el máximo de toda la vida del proceso, así que el crecimiento
+    de cada paso se mide contra el pico del paso anterior. Es solo el del
+    proceso principal: el de los procesos de lectura en paralelo lo informa
+    aparte modelo_deuda.LecturaEntradas y no cuenta para el presupuesto.
+    """
+
+    def __init__(self, activo: bool = False, presupuesto_mb: Optional[float] = None):
+        self.activo = activo
+        self.presupuesto_mb = presupuesto_mb
+        self.base_mb = rss_pico_mb()
+        self.entrada_mb: Optional[float] = None
+        self.pasos: List[Tuple[str, Optional[float]]] = []
+
+    def registrar_entrada(self, *dfs: pd.DataFrame) -> None:
+        """Tamaño de los datos de entrada, referencia para el factor pico / entrada."""
+        self.entrada_mb = tamano_df_mb(*dfs)
+        if self.activo:
+            print(f"  [MEM] Datos de entrada: {self.entrada_mb:,.1f} MB")
+
+    def marcar(self, paso: str) -> None:
+        pico = rss_pico_mb()
+        anterior = self.pasos[-1][1] if self.pasos else self.base_mb
+        self.pasos.append((paso, pico))
+        if self.activo and pico is not None:
+            crecimiento = pico - (anterior or pico)
+            print(f"  [MEM] {paso}: pico {pico:,.1f} MB (+{crecimiento:,.1f} MB)")
+
+    def verificar(self) -> bool:
+        """Resumen final; False si el pico supera el presupuesto."""
+        pico = rss_pico_mb()
+        if pico is None:
+            if self.activo:
+                print("  [WARN] No es posible medir la memoria del proceso en esta plataforma")
+            return True
+        uso = pico - (self.base_mb or 0.0)
+        if self.activo and self.entrada_mb:
+            print(f"  [MEM] Pico total {pico:,.1f} MB | uso del modelo {uso:,.1f} MB "
+                  f"= {uso / self.entrada_mb:,.1f}x la entrada")
+        if self.presupuesto_mb is not None and pico > self.presupuesto_mb:
+            print(f"  [WARN] Pico de memoria {pico:,.1f} MB supera el presupuesto "
+                  f"de {self.presupuesto_mb:,.1f} MB")
+            return False
+        return True
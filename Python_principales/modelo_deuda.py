@@ -12,6 +12,21 @@ import logging
 from datetime import datetime, timedelta
 from typing import Any, Optional
 import json
+import csv
+import codecs
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import nullcontext
+
+from exportar_excel import CacheFormatos, escribir_encabezados
+from lectura_excel import elegir_hoja, motor_excel
+from memoria import MonitorMemoria, PresupuestoMemoriaExcedido, rss_pico_hijos_mb
+from clientes import IndiceClientes
+from esquemas import (FUENTES, SUFIJO_TOTALES, atributos_linea, columnas_modelo, convertir_fechas,
+                      renombres_modelo, ruta_totales_modelo, tipos_lectura)
+from reglas import ReglasProvision, cargar_reglas
+from escenarios_fx import (convertir_a_fecha_factura, escenarios_choque, escenarios_historicos,
+                           escenarios_montecarlo, evaluar_escenarios, resumen_percentiles)
 
 # ---------------- Logging unificado ----------------
 try:
@@ -42,51 +57,8 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 SALIDAS_DIR = os.path.join(BASE_DIR, 'salidas')
 os.makedirs(SALIDAS_DIR, exist_ok=True)
 
-# ---------------- Parámetros del negocio ----------------
-LINEAS_PESOS = [
-    ('CT', '80'), ('ED', '41'), ('ED', '44'), ('ED', '47'),
-    ('PL', '10'), ('PL', '15'), ('PL', '20'), ('PL', '21'),
-    ('PL', '23'), ('PL', '25'), ('PL', '28'), ('PL', '29'),
-    ('PL', '31'), ('PL', '32'), ('PL', '53'), ('PL', '56'),
-    ('PL', '60'), ('PL', '62'), ('PL', '63'), ('PL', '64'),
-    ('PL', '65'), ('PL', '66'), ('PL', '69')
-]
-
-LINEAS_DIVISAS = [
-    ('PL', '11'), ('PL', '18'), ('PL', '57'), ('PL', '41')
-]
-
-# *** Tabla Negocio-Canal corregida según procedimiento pág. 7 ***
-# CORRECCIÓN OBS-4: PL10 -> LIBRERIAS 2 (no LIBRERIAS 3 como estaba antes)
-TABLA_NEGOCIO_CANAL = {
-    'PL10': {'NEGOCIO': 'LIBRERIAS 2', 'CANAL': 'LIBRERIAS 2'},
-    'PL15': {'NEGOCIO': 'E-COMMERCE',  'CANAL': 'E-COMMERCE'},
-    'PL20': {'NEGOCIO': 'LIBRERIAS 1', 'CANAL': 'LIBRERIAS 1'},
-    'PL21': {'NEGOCIO': 'LIBRERIAS 2', 'CANAL': 'LIBRERIAS 2'},
-    'PL23': {'NEGOCIO': 'LIBRERIAS 1', 'CANAL': 'LIBRERIAS 1'},
-    'PL25': {'NEGOCIO': 'LIBRERIAS 1', 'CANAL': 'LIBRERIAS 1'},
-    'PL28': {'NEGOCIO': 'SALDOS',      'CANAL': 'SALDOS'},
-    'PL29': {'NEGOCIO': 'SALDOS',      'CANAL': 'SALDOS'},
-    'PL31': {'NEGOCIO': 'SALDOS',      'CANAL': 'SALDOS'},
-    'PL32': {'NEGOCIO': 'DISTRIBUIDORES', 'CANAL': 'DISTRIBUIDORES'},
-    'PL53': {'NEGOCIO': 'LIBRERIAS 3', 'CANAL': 'LIBRERIAS 3'},
-    'PL56': {'NEGOCIO': 'OTROS DIGITAL','CANAL': 'OTROS DIGITAL'},
-    'PL57': {'NEGOCIO': 'PRENSA USD',  'CANAL': 'PRENSA USD'},
-    'PL60': {'NEGOCIO': 'OTROS',       'CANAL': 'OTROS'},
-    'PL62': {'NEGOCIO': 'PRENSA',      'CANAL': 'PRENSA'},
-    'PL63': {'NEGOCIO': 'LIBRERIAS 3', 'CANAL': 'LIBRERIAS 3'},
-    'PL64': {'NEGOCIO': 'OTROS',       'CANAL': 'OTROS'},
-    'PL65': {'NEGOCIO': 'OTROS',       'CANAL': 'OTROS'},
-    'PL66': {'NEGOCIO': 'OTROS DIGITAL','CANAL': 'OTROS DIGITAL'},
-    'PL69': {'NEGOCIO': 'LIBRERIAS 1', 'CANAL': 'LIBRERIAS 1'},
-    'PL11': {'NEGOCIO': 'EXPORTACION USD', 'CANAL': 'EXPORTACION USD'},
-    'PL18': {'NEGOCIO': 'EXPORTACION USD', 'CANAL': 'EXPORTACION USD'},
-    'PL41': {'NEGOCIO': 'EXPORTACION EURO','CANAL': 'EXPORTACION EURO'},
-    'CT80': {'NEGOCIO': 'TINTA CLUB DEL LIBRO', 'CANAL': 'TINTA'},
-    'ED41': {'NEGOCIO': 'EDUCACION',   'CANAL': 'EDUCACION'},
-    'ED44': {'NEGOCIO': 'OTROS DIGITAL','CANAL': 'OTROS DIGITAL'},
-    'ED47': {'NEGOCIO': 'EDUCACION',   'CANAL': 'EDUCACION'},
-}
+# Índice persistente de clientes (se amplía en cada corrida)
+RUTA_INDICE_CLIENTES = os.path.join(SALIDAS_DIR, 'indice_clientes.json')
 
 # --------------------------------------------------
 # ORDEN DE COLUMNAS PARA MODELO DE DEUDA
@@ -183,14 +155,6 @@ def cargar_tasas_cambio(fecha_cierre: str,
 def _last_day_of_month(dt: pd.Timestamp) -> pd.Timestamp:
     return dt.to_period('M').to_timestamp('M')
 
-def _moneda_por_linea(linea_key: str) -> str:
-    k = str(linea_key).strip().upper()
-    if k in ('PL11', 'PL18', 'PL57'):
-        return 'DÓLAR'
-    if k == 'PL41':
-        return 'EURO'
-    return 'PESOS COL'
-
 def _build_linea_key(emp, act):
     emp = str(emp).strip().upper()
     try:
@@ -200,37 +164,76 @@ def _build_linea_key(emp, act):
     act = act.lstrip('0') or '0'
     return f"{emp}{act}"
 
+def _normalizar_actividad(valores: pd.Index) -> np.ndarray:
+    """Equivalente vectorizado de la normalización de ACTIVIDAD en _build_linea_key."""
+    texto = pd.Series(valores, dtype=object).astype(str)
+    num = pd.to_numeric(texto.str.strip(), errors='coerce')
+    num_arr = num.to_numpy(dtype=float)
+    finito = np.isfinite(num_arr) & (np.abs(num_arr) < 2**63)
+    act = texto.str.strip()
+    act[finito] = np.trunc(num[finito]).astype(np.int64).astype(str)
+    act = act.str.lstrip('0').replace('', '0')
+    return act.to_numpy(dtype=object)
+
+def construir_linea_negocio(empresa: pd.Series, actividad: pd.Series) -> pd.Series:
+    """
+    LINEA DE NEGOCIO vectorizada (EMPRESA + ACTIVIDAD sin ceros a la izquierda).
+    EMPRESA y ACTIVIDAD se tratan como categóricas: la clave se arma una sola
+    vez por par único y luego se expande a todas las filas.
+    """
+    emp_cat = pd.Categorical(empresa.astype(str))
+    act_cat = pd.Categorical(actividad.astype(str))
+    emp_norm = emp_cat.categories.str.strip().str.upper().to_numpy(dtype=object)
+    act_norm = _normalizar_actividad(act_cat.categories)
+
+    n_act = max(len(act_norm), 1)
+    par = emp_cat.codes.astype(np.int64) * n_act + act_cat.codes
+    pares_unicos, inversa = np.unique(par, return_inverse=True)
+    claves = emp_norm[pares_unicos // n_act] + act_norm[pares_unicos % n_act]
+    return pd.Series(claves[inversa], index=empresa.index, dtype=object)
+
+def _canal_por_linea(lineas: pd.Series) -> pd.Series:
+    """CANAL de las hojas de vencimientos: la propia línea (solo textos de más de 2 caracteres)."""
+    if lineas.dtype != object:
+        return pd.Series('', index=lineas.index, dtype=object)
+    largo = lineas.str.len()
+    return lineas.astype(str).str.strip().str.upper().where(largo > 2, '')
+
 def _ensure_datetime(series):
     try:
         return pd.to_datetime(series, dayfirst=True, errors='coerce')
     except Exception:
         return pd.to_datetime(series, errors='coerce')
 
-def excluir_pl16_pl68(df: pd.DataFrame, nombre_df: str) -> pd.DataFrame:
-    """Excluye PL16 y PL68 con validación inmediata"""
+def excluir_lineas_modelo(df: pd.DataFrame, nombre_df: str,
+                          reglas: Optional[ReglasProvision] = None) -> pd.DataFrame:
+    """Excluye las líneas de la regla excluir_lineas_modelo (PL16 y PL68) con conteo por línea"""
+    reglas = reglas or cargar_reglas()
+    lineas_regla = reglas['excluir_lineas_modelo'].valores('LINEA DE NEGOCIO')
+    if not lineas_regla:
+        raise ValueError(f"[ERROR] CRÍTICO en {nombre_df}: la regla excluir_lineas_modelo "
+                         f"no declara valores de LINEA DE NEGOCIO")
     before = len(df)
-    pl16_before = len(df[df['LINEA DE NEGOCIO'] == 'PL16'])
-    pl68_before = len(df[df['LINEA DE NEGOCIO'] == 'PL68'])
-
-    df = df[~df['LINEA DE NEGOCIO'].isin(['PL16', 'PL68'])].copy()
-    after = len(df)
-    excluidos = before - after
-
-    pl16_after = len(df[df['LINEA DE NEGOCIO'] == 'PL16'])
-    pl68_after = len(df[df['LINEA DE NEGOCIO'] == 'PL68'])
-
-    print(f"\n  [{nombre_df}] Exclusión de PL16/PL68")
-    print(f"    Antes: {before:,} registros (PL16={pl16_before}, PL68={pl68_before})")
-    print(f"    Excluidos: {excluidos}")
-    print(f"    Después: {after:,} registros")
-
-    if pl16_after > 0 or pl68_after > 0:
+    lineas = df['LINEA DE NEGOCIO']
+    # Registros de las líneas declaradas, sin importar espacios ni mayúsculas
+    declaradas = (lineas.astype(str).str.strip().str.upper()
+                  .isin([str(l).upper() for l in lineas_regla]).to_numpy())
+    df, excluidas = reglas.excluir('excluir_lineas_modelo', df)
+    conteo = lineas[excluidas].value_counts()
+    detalle = ', '.join(f"{linea}={int(conteo.get(linea, 0))}" for linea in lineas_regla)
+
+    print(f"\n  [{nombre_df}] Exclusión de {'/'.join(lineas_regla)}")
+    print(f"    Antes: {before:,} registros ({detalle})")
+    print(f"    Excluidos: {int(excluidas.sum())}")
+    print(f"    Después: {len(df):,} registros")
+
+    restantes = lineas[declaradas & ~excluidas].value_counts()
+    if len(restantes):
         raise ValueError(
-            f"[ERROR] CRÍTICO en {nombre_df}: "
-            f"PL16={pl16_after}, PL68={pl68_after} TODAVÍA PRESENTES"
+            f"[ERROR] CRÍTICO en {nombre_df}: la regla excluir_lineas_modelo no excluyó {dict(restantes)}"
         )
 
-    print(f" [OK] - PL16 y PL68 eliminados correctamente")
+    print(f" [OK] - {' y '.join(lineas_regla)} eliminados correctamente")
     return df
 
 # --------------------------------------------------
@@ -241,51 +244,220 @@ def ordenar_columnas_modelo(df):
     otras_columnas = [c for c in df.columns if c not in columnas_existentes]
     return df[columnas_existentes + otras_columnas]
 
-# ---------------- Lectura flexible de archivos ----------------
-def leer_archivo(archivo: str) -> pd.DataFrame:
+# ---------------- Detección de dialecto CSV ----------------
+BYTES_MUESTRA_CSV = 64 * 1024
+SEPARADORES_CSV = ';|,\t'
+
+# Dialecto detectado por sistema origen (PROVCA, ANTICI, MODELO_DEUDA, ...)
+_DIALECTOS_CSV = {}
+
+def _sistema_origen_csv(archivo: str, encabezado: str) -> str:
+    """Identifica el sistema origen del CSV por sus columnas (o por el nombre del archivo)."""
+    enc = encabezado.upper()
+    if 'PCCDEM' in enc:
+        return 'PROVCA'
+    if 'NCCDEM' in enc:
+        return 'ANTICI'
+    if 'LINEA DE NEGOCIO' in enc:
+        return 'MODELO_DEUDA'
+    return os.path.splitext(os.path.basename(archivo))[0].upper()
+
+def _columnas_encabezado(encabezado: str, sep: str, quotechar: str) -> int:
+    try:
+        return len(next(csv.reader([encabezado], delimiter=sep, quotechar=quotechar)))
+    except (csv.Error, StopIteration):
+        return 0
+
+def detectar_dialecto_csv(archivo: str) -> dict:
+    """
+    Inspecciona los primeros 64 KB del archivo una sola vez y decide
+    encoding, separador y comillas. El resultado se guarda por sistema origen.
+    """
+    with open(archivo, 'rb') as f:
+        muestra = f.read(BYTES_MUESTRA_CSV)
+    if not muestra.strip():
+        raise ValueError(f"El CSV está vacío: {archivo}")
+
+    if muestra.startswith(codecs.BOM_UTF8):
+        encoding = 'utf-8-sig'
+        texto = muestra[len(codecs.BOM_UTF8):].decode('utf-8', errors='ignore')
+    else:
+        try:
+            # final=False tolera un carácter multibyte cortado al final de la muestra
+            texto = codecs.getincrementaldecoder('utf-8')().decode(muestra, final=False)
+            encoding = 'utf-8'
+        except UnicodeDecodeError:
+            encoding = 'latin1'
+            texto = muestra.decode('latin1')
+
+    lineas = texto.splitlines()
+    encabezado = lineas[0] if lineas else ''
+    sistema = _sistema_origen_csv(archivo, encabezado)
+
+    # El dialecto del sistema solo se reutiliza si el encoding detectado coincide
+    cacheado = _DIALECTOS_CSV.get(sistema)
+    if cacheado and cacheado['encoding'] == encoding and \
+            _columnas_encabezado(encabezado, cacheado['sep'], cacheado['quotechar']) > 1:
+        return dict(cacheado)
+
+    # Se descartan las líneas finales por si la muestra cortó un registro
+    fragmento = '\n'.join(lineas[:50] if len(lineas) <= 50 else lineas[:-1][:50])
+    try:
+        sniff = csv.Sniffer().sniff(fragmento, delimiters=SEPARADORES_CSV)
+        sep, quotechar = sniff.delimiter, sniff.quotechar or '"'
+    except csv.Error:
+        sep, quotechar = None, '"'
+
+    if sep is None or _columnas_encabezado(encabezado, sep, quotechar) <= 1:
+        # Respaldo: el separador más frecuente en el encabezado
+        conteos = {c: encabezado.count(c) for c in SEPARADORES_CSV}
+        sep = max(conteos, key=conteos.get)
+        if conteos[sep] == 0:
+            raise ValueError(
+                f"No se pudo detectar el separador del CSV: {archivo}. "
+                f"Se esperaba uno de: ; | , TAB"
+            )
+
+    dialecto = {'sistema': sistema, 'encoding': encoding, 'sep': sep, 'quotechar': quotechar}
+    _DIALECTOS_CSV[sistema] = dialecto
+    return dict(dialecto)
+
+def leer_archivo(archivo: str, fuente: Optional[str] = None) -> pd.DataFrame:
+    """
+    Lee CSV o Excel. Con fuente ('PROVCA' / 'ANTICI') solo se leen las columnas
+    que el modelo consume según esquemas.FUENTES; si además es el CSV PISA
+    original, los textos se leen como str, los montos como float y las fechas
+    AAAAMMDD como datetime.
+    """
     if not os.path.exists(archivo):
         raise FileNotFoundError(f"No se encontró el archivo: {archivo}")
+    registro = FUENTES[fuente] if fuente else None
+    opciones = {}
+    if registro:
+        opciones['usecols'] = columnas_modelo(
+            registro['esquema'], registro['consumo_modelo'], registro['alias_modelo']
+        )
     ext = archivo.lower().split('.')[-1]
     if ext == 'csv':
-        for enc in ['latin1', 'cp1252', 'utf-8-sig', 'utf-8', 'iso-8859-1']:
-            for sep in [';','|',',','\t']:
-                try:
-                    df = pd.read_csv(archivo, encoding=enc, sep=sep)
-                    if df.shape[1] > 1:
-                        return df
-                except:
-                    pass
-        raise ValueError(f"No se pudo leer el CSV: {archivo}")
+        dialecto = detectar_dialecto_csv(archivo)
+        sep_txt = 'TAB' if dialecto['sep'] == '\t' else dialecto['sep']
+        print(f"  [INFO] CSV {dialecto['sistema']}: encoding={dialecto['encoding']}  separador='{sep_txt}'")
+        es_pisa = registro is not None and dialecto['sistema'] == fuente
+        if es_pisa:
+            opciones.update(dtype=tipos_lectura(registro['esquema'], montos_texto=False), decimal=',')
+        encoding = dialecto['encoding']
+        try:
+            try:
+                df = pd.read_csv(archivo, encoding=encoding,
+                                 sep=dialecto['sep'], quotechar=dialecto['quotechar'], **opciones)
+            except UnicodeDecodeError:
+                if encoding != 'utf-8':
+                    raise
+                # Los primeros 64 KB eran ASCII pero el resto del archivo no es UTF-8
+                # (solo para este archivo: el dialecto guardado del sistema no cambia)
+                encoding = 'latin1'
+                print("  [WARN] El CSV no es UTF-8 completo, se lee como latin1")
+                df = pd.read_csv(archivo, encoding=encoding,
+                                 sep=dialecto['sep'], quotechar=dialecto['quotechar'], **opciones)
+        except (UnicodeDecodeError, pd.errors.ParserError) as e:
+            raise ValueError(
+                f"No se pudo leer el CSV {archivo} con encoding={encoding} "
+                f"y separador='{sep_txt}': {e}"
+            ) from e
+        if df.shape[1] <= 1:
+            raise ValueError(
+                f"No se pudo leer el CSV: {archivo} "
+                f"(solo se detectó una columna con separador='{sep_txt}')"
+            )
+        if es_pisa:
+            convertir_fechas(df, registro['esquema'])
+        return df
     elif ext in ['xlsx','xls']:
-        xls = pd.ExcelFile(archivo)
-        hojas = xls.sheet_names
+        # Libro abierto una sola vez; solo se convierte a DataFrame la hoja elegida
+        with pd.ExcelFile(archivo, engine=motor_excel(archivo)) as xls:
+            print(f"  [INFO] Hojas encontradas: {xls.sheet_names}")
+            hoja = elegir_hoja(xls, ['DETALLE', 'CARTERA', 'DATA', 'Sheet1', 'Hoja1'])
+            print(f"  [OK] Usando hoja: {hoja}")
+            return xls.parse(hoja, **opciones)
+    else:
+        raise ValueError(f"Formato no soportado: {archivo}")
 
-        print(f"  [INFO] Hojas encontradas: {hojas}")
+# Con libros Excel de este tamaño (MB) la lectura en paralelo usa procesos:
+# openpyxl es Python puro y dos hilos no se solapan; el parser CSV sí libera el GIL
+UMBRAL_LECTURA_PROCESOS_MB = 20
 
-        hojas_prioridad = ['DETALLE', 'CARTERA', 'DATA', 'Sheet1', 'Hoja1']
 
-        for hoja_preferida in hojas_prioridad:
-            if hoja_preferida in hojas:
-                print(f"  [OK] Usando hoja: {hoja_preferida}")
-                return pd.read_excel(archivo, sheet_name=hoja_preferida, engine='openpyxl')
+def _leer_archivo_cronometrado(archivo: str, fuente: Optional[str]) -> tuple:
+    inicio = time.perf_counter()
+    df = leer_archivo(archivo, fuente)
+    return df, time.perf_counter() - inicio
 
-        for hoja in hojas:
-            try:
-                df = pd.read_excel(archivo, sheet_name=hoja, engine='openpyxl')
-                if len(df) > 0 and len(df.columns) > 1:
-                    print(f"  [OK] Usando hoja: {hoja}")
-                    return df
-            except:
-                continue
-
-        return pd.read_excel(archivo, sheet_name=0, engine='openpyxl')
-    else:
-        raise ValueError(f"Formato no soportado: {archivo}")
+
+class LecturaEntradas:
+    """
+    Lee provisión y anticipos en paralelo desde que se crea; el resultado de
+    cada uno se espera solo cuando se necesita (la provisión puede pedirse
+    antes, p. ej. para deducir la fecha de cierre). Se usa como context
+    manager: si algo falla dentro del bloque se cancela lo pendiente y el
+    ejecutor se cierra igual.
+
+    En modo procesos, con spawn / forkserver (Windows, macOS) cada hijo vuelve
+    a importar este módulo y repite sus efectos de importación (log de inicio,
+    carpeta de salidas). La memoria de los hijos no entra en el pico de
+    MonitorMemoria; cerrar() informa aparte el pico del mayor de ellos.
+    """
+
+    def __init__(self, archivo_provision: str, archivo_anticipos: str):
+        archivos = (archivo_provision, archivo_anticipos)
+        excel_mb = sum(
+            os.path.getsize(a) for a in archivos
+            if a.lower().endswith(('.xlsx', '.xls')) and os.path.exists(a)
+        ) / (1024 * 1024)
+        self.modo = 'procesos' if excel_mb >= UMBRAL_LECTURA_PROCESOS_MB else 'hilos'
+        self.inicio = time.perf_counter()
+        self._ejecutor: Executor = (
+            ProcessPoolExecutor(max_workers=2) if self.modo == 'procesos'
+            else ThreadPoolExecutor(max_workers=2, thread_name_prefix='lectura')
+        )
+        self._provision = self._ejecutor.submit(_leer_archivo_cronometrado, archivo_provision, 'PROVCA')
+        self._anticipos = self._ejecutor.submit(_leer_archivo_cronometrado, archivo_anticipos, 'ANTICI')
+
+    def provision(self) -> pd.DataFrame:
+        return self._provision.result()[0]
+
+    def anticipos(self) -> pd.DataFrame:
+        return self._anticipos.result()[0]
+
+    def cerrar(self) -> None:
+        """Espera ambas lecturas, libera el ejecutor e informa los tiempos."""
+        try:
+            _, t_prov = self._provision.result()
+            _, t_ant = self._anticipos.result()
+        finally:
+            self._ejecutor.shutdown(cancel_futures=True)
+        total = time.perf_counter() - self.inicio
+        print(f"  [OK] Lectura en paralelo ({self.modo}): {total:,.2f} s "
+              f"(provisión {t_prov:,.2f} s, anticipos {t_ant:,.2f} s)")
+        hijos = rss_pico_hijos_mb() if self.modo == 'procesos' else None
+        if hijos is not None:
+            print(f"  [MEM] Pico del mayor proceso de lectura: {hijos:,.1f} MB "
+                  f"(no incluido en el pico del modelo)")
+
+    def __enter__(self) -> 'LecturaEntradas':
+        return self
+
+    def __exit__(self, tipo, valor, traza) -> None:
+        if tipo is None:
+            self.cerrar()
+        else:
+            # La lectura que ya corre termina (no se puede interrumpir) y el ejecutor se libera
+            self._ejecutor.shutdown(cancel_futures=True)
 
 # ============================================================
 # CÁLCULO COMPLETO DE CAMPOS
 # ============================================================
-def calcular_campos_provision(df: pd.DataFrame) -> pd.DataFrame:
+def calcular_campos_provision(df: pd.DataFrame,
+                              reglas: Optional[ReglasProvision] = None) -> pd.DataFrame:
     df.columns = (
         df.columns
         .str.replace('\n', ' ', regex=True)
@@ -313,30 +485,19 @@ def calcular_campos_provision(df: pd.DataFrame) -> pd.DataFrame:
         df['FECHA VTO'] = pd.to_datetime(df['FECHA VTO'], dayfirst=True, errors='coerce')
 
     if 'EMPRESA' in df.columns and 'ACTIVIDAD' in df.columns:
-        df['LINEA DE NEGOCIO'] = df.apply(
-            lambda r: _build_linea_key(r['EMPRESA'], r['ACTIVIDAD']), axis=1
-        )
+        df['LINEA DE NEGOCIO'] = construir_linea_negocio(df['EMPRESA'], df['ACTIVIDAD'])
     elif 'PCCDEM' in df.columns and 'PCCDAC' in df.columns:
         df['EMPRESA'] = df['PCCDEM']
         df['ACTIVIDAD'] = df['PCCDAC']
-        df['LINEA DE NEGOCIO'] = df.apply(
-            lambda r: _build_linea_key(r['EMPRESA'], r['ACTIVIDAD']), axis=1
-        )
+        df['LINEA DE NEGOCIO'] = construir_linea_negocio(df['EMPRESA'], df['ACTIVIDAD'])
     else:
         print("  [WARN] No encontró EMPRESA/ACTIVIDAD o PCCDEM/PCCDAC")
         df['LINEA DE NEGOCIO'] = 'SIN_CLASIFICAR'
 
-    try:
-        if 'ACTIVIDAD' in df.columns and 'SALDO' in df.columns:
-            df['__SAL_NUM__'] = pd.to_numeric(df['SALDO'], errors='coerce')
-            cond = (
-                df['ACTIVIDAD'].astype(str).str.strip() == '30'
-            ) & (
-                df['__SAL_NUM__'].round(0) == -614000
-            )
-            df = df.loc[~cond].drop(columns=['__SAL_NUM__'])
-    except Exception:
-        pass
+    # Regla excluir_actividad30_614000 (ACTIVIDAD 30 con saldo -614.000), si están sus columnas
+    reglas = reglas or cargar_reglas()
+    if not reglas['excluir_actividad30_614000'].faltantes(df):
+        df, _ = reglas.excluir('excluir_actividad30_614000', df)
 
     if 'FECHA' in df.columns and df['FECHA'].notna().any():
         fecha_corte = _last_day_of_month(df['FECHA'].max())
@@ -442,147 +603,156 @@ def calcular_campos_provision(df: pd.DataFrame) -> pd.DataFrame:
 # FIX-OBS-3: La conciliación sigue intacta porque los buckets individuales
 #            (Vencido 30..Vencido+360) permanecen y su suma es el saldo vencido real.
 # ============================================================
-def crear_hoja_vencimientos(df_pesos_final: pd.DataFrame,
-                            df_divisas_final: pd.DataFrame) -> pd.DataFrame:
-
-    columnas_venc = [
-        'VENCIDO 30', 'VENCIDO 60', 'VENCIDO 90',
-        'VENCIDO 180', 'VENCIDO 360', 'VENCIDO + 360'
-    ]
+# FIX-OBS-2: 'SALDO VENCIDO' quitado de las columnas sumables
+COLUMNAS_CUBO = [
+    'SALDO',
+    'SALDO NO VENCIDO',
+    'VENCIDO 30',
+    'VENCIDO 60',
+    'VENCIDO 90',
+    'VENCIDO 180',
+    'VENCIDO 360',
+    'VENCIDO + 360',
+    'DEUDA INCOBRABLE'
+]
 
-    for df_tmp in (df_pesos_final, df_divisas_final):
-        for col in columnas_venc:
-            if col not in df_tmp.columns:
-                df_tmp[col] = 0
-        # FIX-OBS-2: se mantiene SALDO VENCIDO internamente para el ajuste de
-        # anticipos, pero NO se incluirá en columnas_sumables ni en el rename.
+COLUMNAS_CUBO_COP = [f"{c} COP" for c in COLUMNAS_CUBO]
+
+CLAVES_CUBO = ['FUENTE', 'ANTICIPO', 'NEGOCIO', 'CANAL', 'MONEDA', 'CLIENTE', 'CLIENTE_ID']
+
+# FIX-OBS-2: 'SALDO VENCIDO' / 'Saldo Vencido' eliminado del rename
+RENOMBRE_VENCIMIENTOS = {
+    'SALDO':            'SALDO TOTAL',
+    'SALDO NO VENCIDO': 'Saldo No vencido',
+    'VENCIDO 30':       'Vencido 30',
+    'VENCIDO 60':       'Vencido 60',
+    'VENCIDO 90':       'Vencido 90',
+    'VENCIDO 180':      'Vencido 180',
+    'VENCIDO 360':      'Vencido 360',
+    'VENCIDO + 360':    'Vencido + 360',
+    'DEUDA INCOBRABLE': 'DEUDA INCOBRABLE'
+}
 
-    # FIX-OBS-2: 'SALDO VENCIDO' quitado de columnas_sumables
-    columnas_sumables = [
-        'SALDO',
-        'SALDO NO VENCIDO',
-        'VENCIDO 30',
-        'VENCIDO 60',
-        'VENCIDO 90',
-        'VENCIDO 180',
-        'VENCIDO 360',
-        'VENCIDO + 360',
-        'DEUDA INCOBRABLE'
-    ]
 
-    df_all = pd.concat([df_pesos_final, df_divisas_final], ignore_index=True)
-
-    # FIX: excluir PL11, PL18 y PL57 SOLO de la hoja VENCIMIENTO
-    LINEAS_EXCLUIR_VENCIMIENTO = {'PL11', 'PL18', 'PL57'}
-    if 'LINEA DE NEGOCIO' in df_all.columns:
-        antes_excl = len(df_all)
-        df_all = df_all[
-            ~df_all['LINEA DE NEGOCIO'].astype(str).str.strip().str.upper().isin(LINEAS_EXCLUIR_VENCIMIENTO)
-        ].copy()
-        print(f"  [OK] Hoja VENCIMIENTO: excluidas PL11/PL18/PL57 -> {antes_excl - len(df_all)} registros removidos")
-
-    if 'LINEA DE NEGOCIO' in df_all.columns:
-        df_all['NEGOCIO'] = df_all['LINEA DE NEGOCIO'].apply(
-            lambda k: TABLA_NEGOCIO_CANAL.get(
-                str(k).strip().upper(), {'NEGOCIO': 'OTROS', 'CANAL': 'OTROS'}
-            )['NEGOCIO']
-        )
-        df_all['CANAL'] = df_all['LINEA DE NEGOCIO'].apply(
-            lambda k: str(k).strip().upper() if isinstance(k, str) and len(str(k)) > 2 else ''
-        )
-        df_all['MONEDA'] = df_all['LINEA DE NEGOCIO'].apply(
-            lambda k: _moneda_por_linea(str(k).strip().upper())
-        )
-
-    df_all['MONEDA']  = df_all.get('MONEDA', 'PESOS COL').astype(str).str.strip()
-    df_all['CLIENTE'] = df_all.get('DENOMINACION COMERCIAL', '').astype(str).str.strip()
-    df_all['CLIENTE'] = df_all['CLIENTE'].replace('', 'ANTICIPO SIN CLIENTE')
-    df_all['CLIENTE'] = df_all['CLIENTE'].fillna('ANTICIPO SIN CLIENTE')
-
-    df_all['NEGOCIO'] = df_all['NEGOCIO'].astype(str).str.strip()
-    df_all['CANAL']   = df_all['CANAL'].astype(str).str.strip()
-    df_all['MONEDA']  = df_all['MONEDA'].astype(str).str.strip()
-    df_all['CLIENTE'] = df_all['CLIENTE'].astype(str).str.strip().str.upper()
-
-    df_all['MONEDA'] = (
-        df_all['MONEDA']
-        .astype(str).str.strip().str.upper()
-        .str.replace('DÓLAR', 'DOLAR', regex=False)
-        .str.replace('DOLLAR', 'DOLAR', regex=False)
-    )
+def _columna_numerica(df: pd.DataFrame, col: str) -> np.ndarray:
+    if col not in df.columns:
+        return np.zeros(len(df))
+    return pd.to_numeric(df[col], errors='coerce').fillna(0.0).to_numpy(dtype=float)
 
-    grp_cols = ['NEGOCIO', 'CANAL', 'MONEDA', 'CLIENTE']
-    for c in grp_cols:
-        if c not in df_all.columns:
-            df_all[c] = ''
 
-    if 'TIPO' in df_all.columns:
-        es_anticipo = df_all['TIPO'].astype(str).str.upper().str.contains('ANT', na=False)
-    else:
-        es_anticipo = pd.Series(False, index=df_all.index)
+def construir_cubo_vencimientos(df_pesos_final: pd.DataFrame,
+                                df_divisas_final: pd.DataFrame,
+                                df_divisas_cop: pd.DataFrame,
+                                indice_clientes: Optional[IndiceClientes] = None) -> pd.DataFrame:
+    """
+    Cubo de antigüedad (FUENTE, ANTICIPO, NEGOCIO, CANAL, MONEDA, CLIENTE, CLIENTE_ID)
+    x buckets, en moneda original y en COP, calculado con un único groupby.
+    df_divisas_cop debe estar alineado fila a fila con df_divisas_final.
+    Con indice_clientes, CLIENTE_ID es el id canónico resuelto por
+    IDENTIFICACION / CODIGO CLIENTE (o por nombre normalizado si no hay id) y
+    CLIENTE el nombre del periodo para ese id; sin índice CLIENTE_ID queda vacío
+    y se agrupa por nombre.
+    Las hojas VENCIMIENTO y USD_EURO_* son vistas filtradas de este cubo.
+    """
+    partes = []
+    for fuente, df_orig, df_cop in (('PESOS',   df_pesos_final,   df_pesos_final),
+                                    ('DIVISAS', df_divisas_final, df_divisas_cop)):
+        if 'LINEA DE NEGOCIO' in df_orig.columns:
+            lineas = df_orig['LINEA DE NEGOCIO']
+        else:
+            lineas = pd.Series('', index=df_orig.index, dtype=object)
+        atributos = atributos_linea(lineas)
 
-    df_all.loc[es_anticipo, 'SALDO NO VENCIDO'] = df_all.loc[es_anticipo, 'SALDO']
-    df_all.loc[es_anticipo, ['VENCIDO 30','VENCIDO 60','VENCIDO 90',
-                              'VENCIDO 180','VENCIDO 360','VENCIDO + 360']] = 0.0
+        if 'TIPO' in df_orig.columns:
+            es_anticipo = df_orig['TIPO'].astype(str).str.upper().str.contains('ANT', na=False)
+        else:
+            es_anticipo = pd.Series(False, index=df_orig.index)
 
-    df_sum = (
-        df_all
-        .groupby(grp_cols, as_index=False)[columnas_sumables]
-        .sum()
-    )
+        cliente = df_orig.get('DENOMINACION COMERCIAL', pd.Series('', index=df_orig.index))
+        cliente_id = pd.Series('', index=df_orig.index, dtype=object)
+        if indice_clientes is not None:
+            resueltos = indice_clientes.resolver(
+                df_orig.get('IDENTIFICACION'), df_orig.get('CODIGO CLIENTE'), cliente
+            )
+            cliente, cliente_id = resueltos['CLIENTE'], resueltos['CLIENTE_ID']
+
+        parte = pd.DataFrame({
+            'FUENTE':   fuente,
+            'ANTICIPO': es_anticipo.to_numpy(dtype=bool),
+            'NEGOCIO':  atributos['NEGOCIO'].astype(str).str.strip().to_numpy(),
+            'CANAL':    _canal_por_linea(lineas).astype(str).str.strip().to_numpy(),
+            'MONEDA':   (
+                atributos['MONEDA'].astype(str).str.strip().str.upper()
+                .str.replace('DÓLAR', 'DOLAR', regex=False)
+                .str.replace('DOLLAR', 'DOLAR', regex=False)
+                .to_numpy()
+            ),
+            'CLIENTE':  cliente.astype(str).str.strip().to_numpy(),
+            'CLIENTE_ID': cliente_id.astype(str).to_numpy(),
+        })
+        for col, col_cop in zip(COLUMNAS_CUBO, COLUMNAS_CUBO_COP):
+            parte[col]     = _columna_numerica(df_orig, col)
+            parte[col_cop] = _columna_numerica(df_cop, col)
+        parte['REGISTROS'] = 1
+        partes.append(parte)
+
+    combinado = pd.concat(partes, ignore_index=True)
+    # Un solo nombre por id en pesos y divisas (el primero que aparece)
+    con_id = combinado['CLIENTE_ID'] != ''
+    if con_id.any():
+        combinado.loc[con_id, 'CLIENTE'] = (
+            combinado.loc[con_id].groupby('CLIENTE_ID')['CLIENTE'].transform('first')
+        )
+    return combinado.groupby(CLAVES_CUBO, as_index=False)[
+        COLUMNAS_CUBO + COLUMNAS_CUBO_COP + ['REGISTROS']
+    ].sum()
 
-    df_sum = df_sum.loc[:, ~df_sum.columns.duplicated(keep='first')]
 
-    df_sum['MONEDA'] = (
-        df_sum['MONEDA']
-        .astype(str).str.strip().str.upper()
-        .str.replace('DÓLAR', 'DOLAR', regex=False)
-        .str.replace('DOLLAR', 'DOLAR', regex=False)
-    )
+def _vista_cubo(cubo: pd.DataFrame, fuentes, en_cop: bool,
+                reglas: Optional[ReglasProvision] = None, regla_exclusion: Optional[str] = None,
+                normalizar_cliente: bool = False, forzar_anticipos: bool = False) -> pd.DataFrame:
+    """
+    Vista de una hoja de vencimientos: filtra el cubo, reagrupa y agrega totales por moneda.
+    regla_exclusion se evalúa sobre las celdas del cubo (no sobre los registros).
+    """
+    vista = cubo[cubo['FUENTE'].isin(fuentes)]
+
+    if regla_exclusion:
+        regla = (reglas or cargar_reglas())[regla_exclusion]
+        excluidas = regla.mascara(vista)
+        print(f"  [OK] Hoja VENCIMIENTO: excluidas {'/'.join(regla.valores('CANAL'))} "
+              f"-> {int(vista.loc[excluidas, 'REGISTROS'].sum())} registros removidos")
+        vista = vista[~excluidas]
+
+    columnas_valor = COLUMNAS_CUBO_COP if en_cop else COLUMNAS_CUBO
+    vista = vista[CLAVES_CUBO + columnas_valor].rename(columns=dict(zip(columnas_valor, COLUMNAS_CUBO)))
+
+    if forzar_anticipos:
+        # Anticipos siempre como saldo no vencido
+        es_anticipo = vista['ANTICIPO'].to_numpy()
+        vista.loc[es_anticipo, 'SALDO NO VENCIDO'] = vista.loc[es_anticipo, 'SALDO']
+        vista.loc[es_anticipo, ['VENCIDO 30', 'VENCIDO 60', 'VENCIDO 90',
+                                'VENCIDO 180', 'VENCIDO 360', 'VENCIDO + 360']] = 0.0
+
+    if normalizar_cliente:
+        vista['CLIENTE'] = vista['CLIENTE'].replace('', 'ANTICIPO SIN CLIENTE').str.upper()
+
+    # Se agrupa por id de cliente (con el nombre para ordenar): dos clientes
+    # distintos con el mismo nombre quedan en filas separadas y CLIENTE_ID los
+    # distingue en la hoja. Sin índice de clientes la columna no se muestra.
+    df_sum = vista.groupby(['NEGOCIO', 'CANAL', 'MONEDA', 'CLIENTE', 'CLIENTE_ID'],
+                           as_index=False)[COLUMNAS_CUBO].sum()
+    if not (df_sum['CLIENTE_ID'] != '').any():
+        df_sum = df_sum.drop(columns='CLIENTE_ID')
 
     df_sum.insert(0, 'Pais',       'COLOMBIA')
     df_sum.insert(3, 'COBRO/PAGO', 'CLIENTE')
-
-    # FIX-OBS-2: 'SALDO VENCIDO' / 'Saldo Vencido' eliminado del rename
-    df_sum = df_sum.rename(columns={
-        'SALDO':            'SALDO TOTAL',
-        'SALDO NO VENCIDO': 'Saldo No vencido',
-        'VENCIDO 30':       'Vencido 30',
-        'VENCIDO 60':       'Vencido 60',
-        'VENCIDO 90':       'Vencido 90',
-        'VENCIDO 180':      'Vencido 180',
-        'VENCIDO 360':      'Vencido 360',
-        'VENCIDO + 360':    'Vencido + 360',
-        'DEUDA INCOBRABLE': 'DEUDA INCOBRABLE'
-    })
-
-    df_sum['MONEDA'] = (
-        df_sum['MONEDA']
-        .astype(str).str.strip().str.upper()
-        .str.replace('DÓLAR', 'DOLAR', regex=False)
-        .str.replace('DOLLAR', 'DOLAR', regex=False)
-    )
-
-    cols_reagrupar = ['Pais', 'NEGOCIO', 'CANAL', 'COBRO/PAGO', 'MONEDA', 'CLIENTE']
-    # FIX-OBS-2: 'Saldo Vencido' quitado de cols_sumar
-    cols_sumar = [
-        'SALDO TOTAL', 'Saldo No vencido',
-        'Vencido 30', 'Vencido 60', 'Vencido 90',
-        'Vencido 180', 'Vencido 360', 'Vencido + 360', 'DEUDA INCOBRABLE'
-    ]
-
-    df_sum = df_sum.groupby(cols_reagrupar, as_index=False)[cols_sumar].sum()
+    df_sum = df_sum.rename(columns=RENOMBRE_VENCIMIENTOS)
 
     # FIX-OBS-3: totales de moneda incluyen todos los buckets para conciliación
     totales_moneda = (
         df_sum
-        .groupby('MONEDA', as_index=False)[[
-            'SALDO TOTAL',
-            'Saldo No vencido',
-            'Vencido 30', 'Vencido 60', 'Vencido 90',
-            'Vencido 180', 'Vencido 360', 'Vencido + 360',
-            'DEUDA INCOBRABLE'
-        ]]
+        .groupby('MONEDA', as_index=False)[list(RENOMBRE_VENCIMIENTOS.values())]
         .sum()
     )
 
@@ -591,251 +761,183 @@ def crear_hoja_vencimientos(df_pesos_final: pd.DataFrame,
     totales_moneda['CANAL']      = 'TOTAL'
     totales_moneda['COBRO/PAGO'] = ''
     totales_moneda['CLIENTE']    = 'TOTAL GENERAL POR MONEDA'
-    totales_moneda = totales_moneda[df_sum.columns]
+    totales_moneda['CLIENTE_ID'] = ''
+    totales_moneda = totales_moneda.reindex(columns=df_sum.columns)
 
-    df_final = pd.concat([df_sum, totales_moneda], ignore_index=True)
-    return df_final
+    return pd.concat([df_sum, totales_moneda], ignore_index=True)
 
 
-def crear_hoja_usd_euro_vencimientos(df_pesos_final: pd.DataFrame,
-                                     df_divisas_cop: pd.DataFrame) -> pd.DataFrame:
+def crear_hoja_vencimientos(cubo: pd.DataFrame,
+                            reglas: Optional[ReglasProvision] = None) -> pd.DataFrame:
+    """
+    VENCIMIENTO: pesos + divisas convertidas a COP, sin las líneas de la regla
+    excluir_lineas_vencimiento (PL11/PL18/PL57), CLIENTE en mayúsculas y
+    anticipos siempre como no vencidos.
+    """
+    return _vista_cubo(cubo, ('PESOS', 'DIVISAS'), en_cop=True,
+                       reglas=reglas, regla_exclusion='excluir_lineas_vencimiento',
+                       normalizar_cliente=True, forzar_anticipos=True)
+
+
+def crear_hoja_usd_euro_vencimientos(cubo: pd.DataFrame) -> pd.DataFrame:
     """
     Crea vencimientos SOLO con divisas (USD y EUR), YA CONVERTIDAS A COP.
     FIX-OBS-2: 'Saldo Vencido' eliminado de columnas sumables y del rename.
     FIX-OBS-3: Los buckets individuales permanecen para conciliación.
     """
-
-    # FIX-OBS-2: 'SALDO VENCIDO' quitado de columnas_sumables
-    columnas_sumables = [
-        'SALDO',
-        'SALDO NO VENCIDO',
-        'VENCIDO 30',
-        'VENCIDO 60',
-        'VENCIDO 90',
-        'VENCIDO 180',
-        'VENCIDO 360',
-        'VENCIDO + 360',
-        'DEUDA INCOBRABLE'
-    ]
-
-    df_all = df_divisas_cop.copy()
-
-    if 'LINEA DE NEGOCIO' in df_all.columns:
-        df_all['NEGOCIO'] = df_all['LINEA DE NEGOCIO'].apply(
-            lambda k: TABLA_NEGOCIO_CANAL.get(
-                str(k).strip().upper(), {'NEGOCIO': 'OTROS', 'CANAL': 'OTROS'}
-            )['NEGOCIO']
-        )
-        df_all['CANAL'] = df_all['LINEA DE NEGOCIO'].apply(
-            lambda k: str(k).strip().upper() if isinstance(k, str) and len(str(k)) > 2 else ''
-        )
-        df_all['MONEDA'] = df_all['LINEA DE NEGOCIO'].apply(
-            lambda k: _moneda_por_linea(str(k).strip().upper())
-        )
-
-    df_all['MONEDA']  = df_all.get('MONEDA', 'PESOS COL').astype(str).str.strip()
-    df_all['CLIENTE'] = df_all.get('DENOMINACION COMERCIAL', '').astype(str).str.strip()
-
-    df_all['NEGOCIO'] = df_all['NEGOCIO'].astype(str).str.strip()
-    df_all['CANAL']   = df_all['CANAL'].astype(str).str.strip()
-    df_all['MONEDA']  = df_all['MONEDA'].astype(str).str.strip()
-    df_all['CLIENTE'] = df_all['CLIENTE'].astype(str).str.strip()
-
-    grp_cols = ['NEGOCIO', 'CANAL', 'MONEDA', 'CLIENTE']
-    for c in grp_cols:
-        if c not in df_all.columns:
-            df_all[c] = ''
-
-    df_sum = (
-        df_all
-        .groupby(grp_cols, as_index=False)[columnas_sumables]
-        .sum()
-    )
-
-    df_sum = df_sum.loc[:, ~df_sum.columns.duplicated(keep='first')]
-
-    df_sum['MONEDA'] = (
-        df_sum['MONEDA']
-        .astype(str).str.strip().str.upper()
-        .str.replace('DÓLAR', 'DOLAR', regex=False)
-        .str.replace('DOLLAR', 'DOLAR', regex=False)
-    )
-
-    df_sum.insert(0, 'Pais',       'COLOMBIA')
-    df_sum.insert(3, 'COBRO/PAGO', 'CLIENTE')
-
-    # FIX-OBS-2: 'SALDO VENCIDO' / 'Saldo Vencido' eliminado del rename
-    df_sum = df_sum.rename(columns={
-        'SALDO':            'SALDO TOTAL',
-        'SALDO NO VENCIDO': 'Saldo No vencido',
-        'VENCIDO 30':       'Vencido 30',
-        'VENCIDO 60':       'Vencido 60',
-        'VENCIDO 90':       'Vencido 90',
-        'VENCIDO 180':      'Vencido 180',
-        'VENCIDO 360':      'Vencido 360',
-        'VENCIDO + 360':    'Vencido + 360',
-        'DEUDA INCOBRABLE': 'DEUDA INCOBRABLE'
-    })
-
-    df_sum['MONEDA'] = (
-        df_sum['MONEDA']
-        .astype(str).str.strip().str.upper()
-        .str.replace('DÓLAR', 'DOLAR', regex=False)
-        .str.replace('DOLLAR', 'DOLAR', regex=False)
-    )
-
-    cols_reagrupar = ['Pais', 'NEGOCIO', 'CANAL', 'COBRO/PAGO', 'MONEDA', 'CLIENTE']
-    # FIX-OBS-2: 'Saldo Vencido' quitado de cols_sumar
-    cols_sumar = [
-        'SALDO TOTAL', 'Saldo No vencido',
-        'Vencido 30', 'Vencido 60', 'Vencido 90',
-        'Vencido 180', 'Vencido 360', 'Vencido + 360', 'DEUDA INCOBRABLE'
-    ]
-
-    df_sum = df_sum.groupby(cols_reagrupar, as_index=False)[cols_sumar].sum()
-
-    # FIX-OBS-3: totales incluyen todos los buckets
-    totales_moneda = (
-        df_sum
-        .groupby('MONEDA', as_index=False)[[
-            'SALDO TOTAL',
-            'Saldo No vencido',
-            'Vencido 30', 'Vencido 60', 'Vencido 90',
-            'Vencido 180', 'Vencido 360', 'Vencido + 360',
-            'DEUDA INCOBRABLE'
-        ]]
-        .sum()
-    )
-
-    totales_moneda['Pais']       = 'COLOMBIA'
-    totales_moneda['NEGOCIO']    = 'TOTAL'
-    totales_moneda['CANAL']      = 'TOTAL'
-    totales_moneda['COBRO/PAGO'] = ''
-    totales_moneda['CLIENTE']    = 'TOTAL GENERAL POR MONEDA'
-    totales_moneda = totales_moneda[df_sum.columns]
-
-    df_final = pd.concat([df_sum, totales_moneda], ignore_index=True)
-    return df_final
+    return _vista_cubo(cubo, ('DIVISAS',), en_cop=True)
 
 
 # ============================================================
 # NUEVA HOJA: USD_EURO_VENCIMIENTOS EN MONEDA ORIGINAL
 # (misma lógica que crear_hoja_usd_euro_vencimientos, pero
-#  SIN multiplicar por la TRM -- usa df_divisas_final tal cual)
+#  SIN multiplicar por la TRM -- usa los valores originales del cubo)
 # ============================================================
-def crear_hoja_usd_euro_vencimientos_moneda_original(df_divisas_final: pd.DataFrame) -> pd.DataFrame:
+def crear_hoja_usd_euro_vencimientos_moneda_original(cubo: pd.DataFrame) -> pd.DataFrame:
     """
-    Igual a crear_hoja_usd_euro_vencimientos, pero recibe df_divisas_final
-    (moneda original USD/EUR, SIN convertir a COP) en vez de df_divisas_cop.
+    Igual a crear_hoja_usd_euro_vencimientos, pero en moneda original USD/EUR
+    (SIN convertir a COP).
     """
+    return _vista_cubo(cubo, ('DIVISAS',), en_cop=False)
 
-    columnas_sumables = [
-        'SALDO',
-        'SALDO NO VENCIDO',
-        'VENCIDO 30',
-        'VENCIDO 60',
-        'VENCIDO 90',
-        'VENCIDO 180',
-        'VENCIDO 360',
-        'VENCIDO + 360',
-        'DEUDA INCOBRABLE'
-    ]
 
-    df_all = df_divisas_final.copy()
+# ============================================================
+# HOJA CONCENTRACION: principales deudores por NEGOCIO y total
+# ============================================================
+TOP_CONCENTRACION = 20
 
-    if 'LINEA DE NEGOCIO' in df_all.columns:
-        df_all['NEGOCIO'] = df_all['LINEA DE NEGOCIO'].apply(
-            lambda k: TABLA_NEGOCIO_CANAL.get(
-                str(k).strip().upper(), {'NEGOCIO': 'OTROS', 'CANAL': 'OTROS'}
-            )['NEGOCIO']
-        )
-        df_all['CANAL'] = df_all['LINEA DE NEGOCIO'].apply(
-            lambda k: str(k).strip().upper() if isinstance(k, str) and len(str(k)) > 2 else ''
-        )
-        df_all['MONEDA'] = df_all['LINEA DE NEGOCIO'].apply(
-            lambda k: _moneda_por_linea(str(k).strip().upper())
-        )
+NEGOCIO_TODOS = 'TOTAL'
 
-    df_all['MONEDA']  = df_all.get('MONEDA', 'PESOS COL').astype(str).str.strip()
-    df_all['CLIENTE'] = df_all.get('DENOMINACION COMERCIAL', '').astype(str).str.strip()
+COLUMNAS_MORA_VENCIMIENTO = ['Vencido 30', 'Vencido 60', 'Vencido 90',
+                             'Vencido 180', 'Vencido 360', 'Vencido + 360']
 
-    df_all['NEGOCIO'] = df_all['NEGOCIO'].astype(str).str.strip()
-    df_all['CANAL']   = df_all['CANAL'].astype(str).str.strip()
-    df_all['MONEDA']  = df_all['MONEDA'].astype(str).str.strip()
-    df_all['CLIENTE'] = df_all['CLIENTE'].astype(str).str.strip()
 
-    grp_cols = ['NEGOCIO', 'CANAL', 'MONEDA', 'CLIENTE']
-    for c in grp_cols:
-        if c not in df_all.columns:
-            df_all[c] = ''
+def _posiciones_top(valores: np.ndarray, n: int) -> np.ndarray:
+    """Posiciones de los n mayores valores, de mayor a menor (argpartition + orden de solo n)."""
+    if len(valores) > n:
+        candidatos = np.argpartition(-valores, n - 1)[:n]
+    else:
+        candidatos = np.arange(len(valores))
+    return candidatos[np.argsort(-valores[candidatos], kind='stable')]
 
-    df_sum = (
-        df_all
-        .groupby(grp_cols, as_index=False)[columnas_sumables]
-        .sum()
-    )
 
-    df_sum = df_sum.loc[:, ~df_sum.columns.duplicated(keep='first')]
+def _participacion(valores: np.ndarray) -> np.ndarray:
+    """Participación de cada valor positivo en la suma de los positivos (negativos cuentan 0)."""
+    positivos = np.clip(valores, 0.0, None)
+    total = positivos.sum()
+    return positivos / total if total > 0 else np.zeros_like(positivos)
 
-    df_sum['MONEDA'] = (
-        df_sum['MONEDA']
-        .astype(str).str.strip().str.upper()
-        .str.replace('DÓLAR', 'DOLAR', regex=False)
-        .str.replace('DOLLAR', 'DOLAR', regex=False)
-    )
 
-    df_sum.insert(0, 'Pais',       'COLOMBIA')
-    df_sum.insert(3, 'COBRO/PAGO', 'CLIENTE')
-
-    df_sum = df_sum.rename(columns={
-        'SALDO':            'SALDO TOTAL',
-        'SALDO NO VENCIDO': 'Saldo No vencido',
-        'VENCIDO 30':       'Vencido 30',
-        'VENCIDO 60':       'Vencido 60',
-        'VENCIDO 90':       'Vencido 90',
-        'VENCIDO 180':      'Vencido 180',
-        'VENCIDO 360':      'Vencido 360',
-        'VENCIDO + 360':    'Vencido + 360',
-        'DEUDA INCOBRABLE': 'DEUDA INCOBRABLE'
-    })
-
-    df_sum['MONEDA'] = (
-        df_sum['MONEDA']
-        .astype(str).str.strip().str.upper()
-        .str.replace('DÓLAR', 'DOLAR', regex=False)
-        .str.replace('DOLLAR', 'DOLAR', regex=False)
+def calcular_concentracion(df_vencimientos: pd.DataFrame,
+                           top_n: int = TOP_CONCENTRACION) -> tuple:
+    """
+    (resumen, detalle) de concentración de deudores a partir de la hoja VENCIMIENTO (COP).
+    Por NEGOCIO y para el total: top_n clientes por SALDO TOTAL con su participación
+    en el saldo y la mora, y los índices Herfindahl (0-10.000) de saldo y mora.
+    Las participaciones se miden sobre los clientes con saldo / mora positivos,
+    así los anticipos no inflan el peso de los demás.
+    """
+    datos = df_vencimientos[df_vencimientos['NEGOCIO'] != NEGOCIO_TODOS]
+    mora = datos.reindex(columns=COLUMNAS_MORA_VENCIMIENTO, fill_value=0.0).sum(axis=1)
+    # Con índice de clientes se agrupa por CLIENTE_ID (homónimos no se suman)
+    por_cliente = ['CLIENTE', 'CLIENTE_ID'] if 'CLIENTE_ID' in datos.columns else ['CLIENTE']
+    clientes = (
+        datos.assign(MORA=mora.to_numpy())
+        .groupby(['NEGOCIO'] + por_cliente, as_index=False)[['SALDO TOTAL', 'MORA']].sum()
     )
+    total_clientes = clientes.groupby(por_cliente, as_index=False)[['SALDO TOTAL', 'MORA']].sum()
+    total_clientes.insert(0, 'NEGOCIO', NEGOCIO_TODOS)
+
+    grupos = [(NEGOCIO_TODOS, total_clientes)] + list(clientes.groupby('NEGOCIO', sort=True))
+
+    filas_resumen, partes = [], []
+    for negocio, grupo in grupos:
+        saldo = grupo['SALDO TOTAL'].to_numpy(dtype=float)
+        mora_g = grupo['MORA'].to_numpy(dtype=float)
+        part_saldo = _participacion(saldo)
+        part_mora = _participacion(mora_g)
+
+        top = _posiciones_top(saldo, top_n)
+        top = top[saldo[top] > 0]
+        partes.append(pd.DataFrame({
+            'NEGOCIO':           negocio,
+            'POSICION':          np.arange(1, len(top) + 1),
+            'CLIENTE':           grupo['CLIENTE'].to_numpy()[top],
+            'SALDO TOTAL':       saldo[top],
+            '% SALDO':           part_saldo[top],
+            '% SALDO ACUMULADO': np.cumsum(part_saldo[top]),
+            'MORA':              mora_g[top],
+            '% MORA':            part_mora[top],
+        }))
+        filas_resumen.append({
+            'NEGOCIO':                  negocio,
+            'CLIENTES':                 int((saldo > 0).sum()),
+            'SALDO TOTAL':              float(saldo.sum()),
+            'MORA':                     float(mora_g.sum()),
+            f'% SALDO TOP {top_n}':     float(part_saldo[top].sum()),
+            f'% MORA TOP {top_n}':      float(part_mora[top].sum()),
+            'HHI SALDO':                float((part_saldo ** 2).sum() * 10000),
+            'HHI MORA':                 float((part_mora ** 2).sum() * 10000),
+        })
 
-    cols_reagrupar = ['Pais', 'NEGOCIO', 'CANAL', 'COBRO/PAGO', 'MONEDA', 'CLIENTE']
-    cols_sumar = [
-        'SALDO TOTAL', 'Saldo No vencido',
-        'Vencido 30', 'Vencido 60', 'Vencido 90',
-        'Vencido 180', 'Vencido 360', 'Vencido + 360', 'DEUDA INCOBRABLE'
-    ]
+    return pd.DataFrame(filas_resumen), pd.concat(partes, ignore_index=True)
 
-    df_sum = df_sum.groupby(cols_reagrupar, as_index=False)[cols_sumar].sum()
 
-    totales_moneda = (
-        df_sum
-        .groupby('MONEDA', as_index=False)[[
-            'SALDO TOTAL',
-            'Saldo No vencido',
-            'Vencido 30', 'Vencido 60', 'Vencido 90',
-            'Vencido 180', 'Vencido 360', 'Vencido + 360',
-            'DEUDA INCOBRABLE'
-        ]]
-        .sum()
-    )
+# ============================================================
+# RESUMEN DE TOTALES (JSON junto al xlsx)
+# Lo consume procesar_y_actualizar_focus sin reabrir el libro.
+# ============================================================
+VERSION_TOTALES = 2     # 2: totales con el alcance de la hoja VENCIMIENTO
 
-    totales_moneda['Pais']       = 'COLOMBIA'
-    totales_moneda['NEGOCIO']    = 'TOTAL'
-    totales_moneda['CANAL']      = 'TOTAL'
-    totales_moneda['COBRO/PAGO'] = ''
-    totales_moneda['CLIENTE']    = 'TOTAL GENERAL POR MONEDA'
-    totales_moneda = totales_moneda[df_sum.columns]
+def _totales_vista(vista: pd.DataFrame) -> dict:
+    """Totales por bucket (nombres del cubo) de las filas de clientes de una hoja de vencimientos."""
+    datos = vista[vista['NEGOCIO'] != NEGOCIO_TODOS]
+    return {nombre: round(float(datos[col].sum()), 2) for nombre, col in RENOMBRE_VENCIMIENTOS.items()}
+
+def escribir_totales_modelo(df_vencimientos: pd.DataFrame, df_divisas_original: pd.DataFrame,
+                            output_path: str, trm_dolar: float, trm_euro: float, fecha_trm,
+                            reglas: Optional[ReglasProvision] = None) -> str:
+    """
+    Escribe el gran total (COP), los subtotales por moneda (COP y moneda original),
+    el total USD puro, las TRM y la DEUDA INCOBRABLE.
+    El total general y los subtotales en COP salen de la hoja VENCIMIENTO (sin
+    las líneas de excluir_lineas_vencimiento, anticipos como no vencidos), la
+    misma que cuadra con el gran total del Modelo Deuda; los subtotales en
+    moneda original y usd_total, de USD_EURO_VENC_ORIGINAL (todas las divisas).
+    """
+    subtotales_cop = {
+        moneda: _totales_vista(grupo)
+        for moneda, grupo in df_vencimientos.groupby('MONEDA')
+    }
+    subtotales_original = {
+        moneda: _totales_vista(grupo)
+        for moneda, grupo in df_divisas_original.groupby('MONEDA')
+    }
+    total_general = _totales_vista(df_vencimientos)
+    lineas_excluidas = (reglas or cargar_reglas())['excluir_lineas_vencimiento'].valores('CANAL')
+
+    resumen = {
+        'version':                    VERSION_TOTALES,
+        'archivo_modelo':             os.path.basename(output_path),
+        'generado':                   datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'alcance': {
+            'total_general':          'VENCIMIENTO: pesos + divisas en COP, anticipos como no vencidos',
+            'lineas_excluidas':       lineas_excluidas,
+            'usd_total':              'USD_EURO_VENC_ORIGINAL: todas las líneas en divisas',
+        },
+        'trm':                        {'usd': float(trm_dolar), 'eur': float(trm_euro),
+                                       'fecha': str(fecha_trm)},
+        'total_general':              total_general,
+        'subtotales_moneda_cop':      subtotales_cop,
+        'subtotales_moneda_original': subtotales_original,
+        'usd_total':                  subtotales_original.get('DOLAR', {}).get('SALDO', 0.0),
+        'deuda_incobrable':           total_general['DEUDA INCOBRABLE'],
+    }
 
-    df_final = pd.concat([df_sum, totales_moneda], ignore_index=True)
-    return df_final
+    ruta_json = ruta_totales_modelo(output_path)
+    with open(ruta_json, 'w', encoding='utf-8') as f:
+        json.dump(resumen, f, indent=2, ensure_ascii=False)
+    return ruta_json
 
 
 # ============================================================
@@ -845,7 +947,56 @@ def crear_modelo_deuda(archivo_provision: str,
                        archivo_anticipos: str,
                        output_file: str = '1_Modelo_Deuda.xlsx',
                        usd_override: Optional[float] = None,
-                       eur_override: Optional[float] = None) -> str:
+                       eur_override: Optional[float] = None,
+                       escenarios_fx: bool = False,
+                       simulaciones_fx: int = 10000,
+                       archivo_trm_historico: Optional[str] = None,
+                       archivo_trm_diaria: Optional[str] = None,
+                       memoria_ligera: bool = False,
+                       presupuesto_memoria_mb: Optional[float] = None,
+                       archivo_indice_clientes: Optional[str] = RUTA_INDICE_CLIENTES,
+                       archivo_reglas: Optional[str] = None) -> str:
+    """
+    Genera el modelo de deuda. Con memoria_ligera se activa copy-on-write de
+    pandas (los filtros y la copia de divisas a COP no duplican datos) y se
+    informa el pico de memoria por paso. Si el pico del proceso supera
+    presupuesto_memoria_mb, el libro y los JSON se escriben igual y al final
+    se lanza PresupuestoMemoriaExcedido. archivo_indice_clientes=None agrupa CLIENTE
+    por el texto de DENOMINACION COMERCIAL sin resolver identidades.
+    archivo_reglas reemplaza a reglas_provision.json (exclusiones de la política).
+    """
+    monitor = MonitorMemoria(activo=memoria_ligera or presupuesto_memoria_mb is not None,
+                             presupuesto_mb=presupuesto_memoria_mb)
+    modo_copia = pd.option_context('mode.copy_on_write', True) if memoria_ligera else nullcontext()
+    with modo_copia:
+        return _generar_modelo_deuda(
+            archivo_provision, archivo_anticipos, output_file,
+            usd_override, eur_override,
+            escenarios_fx, simulaciones_fx, archivo_trm_historico, archivo_trm_diaria,
+            memoria_ligera, monitor, archivo_indice_clientes, archivo_reglas,
+        )
+
+
+def _generar_modelo_deuda(archivo_provision: str,
+                          archivo_anticipos: str,
+                          output_file: str,
+                          usd_override: Optional[float],
+                          eur_override: Optional[float],
+                          escenarios_fx: bool,
+                          simulaciones_fx: int,
+                          archivo_trm_historico: Optional[str],
+                          archivo_trm_diaria: Optional[str],
+                          memoria_ligera: bool,
+                          monitor: MonitorMemoria,
+                          archivo_indice_clientes: Optional[str],
+                          archivo_reglas: Optional[str]) -> str:
+
+    # Con copy-on-write un filtro ya es independiente de su origen: no hace falta copiar
+    def _copia(df: pd.DataFrame) -> pd.DataFrame:
+        return df if memoria_ligera else df.copy()
+
+    reglas = cargar_reglas(archivo_reglas)
+    reglas.reiniciar()
 
     if USE_UNIFIED_LOGGING:
         log_inicio_proceso("MODELO_DEUDA", f"{archivo_provision} + {archivo_anticipos}")
@@ -856,117 +1007,95 @@ def crear_modelo_deuda(archivo_provision: str,
     print("  MODELO DE DEUDA -- Procedimiento Departamento de Cartera")
     print("=" * 62)
 
-    # -- PASO 1: TRM --
-    print("\n[1/7] Cargando tasas de cambio...")
-
-    try:
-        from trm_config import load_trm
-        trm_data  = load_trm()
-        trm_dolar = trm_data["usd"]
-        trm_euro  = trm_data["eur"]
-        fecha_trm = trm_data["fecha"]
-        if usd_override and usd_override > 0:
-            trm_dolar = usd_override
-        if eur_override and eur_override > 0:
-            trm_euro = eur_override
-        print(f"  [OK] TRM ({fecha_trm})  USD: {trm_dolar:,.4f}  |  EUR: {trm_euro:,.4f}")
-    except ImportError:
-        _df_temp = leer_archivo(archivo_provision)
-        _mapeo_temp = {'PCCDEM': 'EMPRESA', 'PCCDAC': 'ACTIVIDAD', 'PCFEFA': 'FECHA'}
-        _df_temp = _df_temp.rename(columns={k: v for k, v in _mapeo_temp.items() if k in _df_temp.columns})
-        if 'FECHA' in _df_temp.columns:
-            _df_temp['FECHA'] = _ensure_datetime(_df_temp['FECHA'])
-            _fecha_cierre = _last_day_of_month(_df_temp['FECHA'].max()).strftime("%Y-%m-%d")
-        else:
-            _fecha_cierre = datetime.today().strftime("%Y-%m-%d")
-        trm_dolar, trm_euro, fecha_trm = cargar_tasas_cambio(
-            _fecha_cierre, usd_override, eur_override
-        )
-
-    # -- PASO 2: Leer archivos --
-    print("\n[2/7] Leyendo archivos de entrada...")
-
-    df_provision_raw = leer_archivo(archivo_provision)
-    df_anticipos_raw = leer_archivo(archivo_anticipos)
-
-    def limpiar_headers_duplicados(df):
-        columnas = list(df.columns)
-        return df[
-            df.apply(
-                lambda row: list(row.astype(str).str.strip()) != columnas,
-                axis=1
+    # Provisión y anticipos se leen en segundo plano mientras se cargan las tasas
+    with LecturaEntradas(archivo_provision, archivo_anticipos) as lectura:
+        # -- PASO 1: TRM --
+        print("\n[1/7] Cargando tasas de cambio...")
+
+        try:
+            from trm_config import load_trm
+            trm_data  = load_trm()
+            trm_dolar = trm_data["usd"]
+            trm_euro  = trm_data["eur"]
+            fecha_trm = trm_data["fecha"]
+            if usd_override and usd_override > 0:
+                trm_dolar = usd_override
+            if eur_override and eur_override > 0:
+                trm_euro = eur_override
+            print(f"  [OK] TRM ({fecha_trm})  USD: {trm_dolar:,.4f}  |  EUR: {trm_euro:,.4f}")
+        except ImportError:
+            # Fecha de cierre desde la provisión ya leída (sin copiar ni releer el archivo)
+            _df_temp = lectura.provision()
+            _mapeo_temp = renombres_modelo(FUENTES['PROVCA']['esquema'])
+            _col_fecha = next((c for c in _df_temp.columns if _mapeo_temp.get(c, c) == 'FECHA'), None)
+            if _col_fecha is not None:
+                _fecha_cierre = _last_day_of_month(_ensure_datetime(_df_temp[_col_fecha]).max()).strftime("%Y-%m-%d")
+            else:
+                _fecha_cierre = datetime.today().strftime("%Y-%m-%d")
+            trm_dolar, trm_euro, fecha_trm = cargar_tasas_cambio(
+                _fecha_cierre, usd_override, eur_override
             )
-        ].reset_index(drop=True)
 
-    df_provision_raw = limpiar_headers_duplicados(df_provision_raw)
-    df_anticipos_raw = limpiar_headers_duplicados(df_anticipos_raw)
+        # -- PASO 2: Leer archivos --
+        print("\n[2/7] Leyendo archivos de entrada...")
+
+        df_provision_raw = lectura.provision()
+        df_anticipos_raw = lectura.anticipos()
+    del lectura
+
+    def limpiar_headers_duplicados(df, nombre_df):
+        """Elimina filas que repiten el encabezado (comparación columna a columna)."""
+        es_encabezado = np.ones(len(df), dtype=bool)
+        for idx, col in enumerate(df.columns):
+            if not isinstance(col, str):
+                es_encabezado[:] = False
+                break
+            candidatas = np.flatnonzero(es_encabezado)
+            if len(candidatas) == 0:
+                break
+            valores = df.iloc[candidatas, idx].astype(str).str.strip().to_numpy()
+            es_encabezado[candidatas] = valores == col
+        eliminadas = int(es_encabezado.sum())
+        if eliminadas:
+            print(f"  [OK] {nombre_df}: {eliminadas:,} fila(s) de encabezado repetido eliminadas")
+        return df[~es_encabezado].reset_index(drop=True)
+
+    df_provision_raw = limpiar_headers_duplicados(df_provision_raw, "PROVISIÓN")
+    df_anticipos_raw = limpiar_headers_duplicados(df_anticipos_raw, "ANTICIPOS")
 
     print(f"  [OK] Provisión: {len(df_provision_raw):,} registros")
     print(f"  [OK] Anticipos: {len(df_anticipos_raw):,} registros")
+    if monitor.activo:
+        monitor.registrar_entrada(df_provision_raw, df_anticipos_raw)
+    monitor.marcar("Lectura de archivos")
 
     # -- PASO 3: Normalizar provisión --
     print("\n[3/7] Normalizando provisión y calculando vencimientos...")
-    mapeo_cartera = {
-        'PCCDEM': 'EMPRESA',
-        'PCCDAC': 'ACTIVIDAD',
-        'PCDEAC': 'EMPRESA',
-        'PCCDAG': 'CODIGO AGENTE',
-        'PCNMAG': 'AGENTE',
-        'PCCDCO': 'CODIGO COBRADOR',
-        'PCNMCO': 'COBRADOR',
-        'PCCDCL': 'CODIGO CLIENTE',
-        'PCCDDN': 'IDENTIFICACION',
-        'PCNMCL': 'NOMBRE',
-        'PCNMCM': 'DENOMINACION COMERCIAL',
-        'PCNMDO': 'DIRECCION',
-        'PCTLF1': 'TELEFONO',
-        'PCNMPO': 'CIUDAD',
-        'PCNUFC': 'NUMERO FACTURA',
-        'PCORPD': 'TIPO',
-        'PCFEFA': 'FECHA',
-        'PCFEVE': 'FECHA VTO',
-        'PCVAFA': 'VALOR',
-        'PCSALD': 'SALDO',
-    }
+    mapeo_cartera = renombres_modelo(FUENTES['PROVCA']['esquema'])
     df_provision = df_provision_raw.rename(
         columns={k: v for k, v in mapeo_cartera.items() if k in df_provision_raw.columns}
     )
+    del df_provision_raw
 
-    df_provision = calcular_campos_provision(df_provision)
+    df_provision = calcular_campos_provision(df_provision, reglas)
 
-    df_provision = excluir_pl16_pl68(df_provision, "PROVISIÓN")
+    df_provision = excluir_lineas_modelo(df_provision, "PROVISIÓN", reglas)
 
-    lineas_pesos_keys   = {f"{cod}{act}" for cod, act in LINEAS_PESOS}
-    lineas_divisas_keys = {f"{cod}{act}" for cod, act in LINEAS_DIVISAS}
-    lineas_validas      = lineas_pesos_keys | lineas_divisas_keys
     antes = len(df_provision)
-    df_provision = df_provision[df_provision['LINEA DE NEGOCIO'].isin(lineas_validas)].copy()
+    atributos_prov = atributos_linea(df_provision['LINEA DE NEGOCIO'])
+    df_provision = _copia(df_provision[
+        (atributos_prov['ES_PESOS'] | atributos_prov['ES_DIVISAS']).to_numpy()
+    ])
     print(f"  [OK] Filtro lineas validas: {antes - len(df_provision):,} lineas no validas eliminadas -> {len(df_provision):,} registros")
+    monitor.marcar("Normalización de provisión")
 
     # -- PASO 4: Procesar anticipos --
     print("\n[4/7] Procesando anticipos (registros negativos, no compensación)...")
-    mapeo_anticipos = {
-        'NCCDEM': 'EMPRESA',
-        'NCCDAC': 'ACTIVIDAD',
-        'NCCDCL': 'CODIGO CLIENTE',
-        'WWNIT':  'IDENTIFICACION',         
-        'NRO DOCUMENTO': 'IDENTIFICACION', 
-        'WWNMCL': 'DENOMINACION COMERCIAL',
-        'WWNMDO': 'DIRECCION',
-        'WWTLF1': 'TELEFONO',
-        'WWNMPO': 'CIUDAD',
-        'CCCDFB': 'CODIGO AGENTE',
-        'BDNMNM': 'NOMBRE AGENTE',
-        'BDNMPA': 'APELLIDO AGENTE',
-        'NCMOMO': 'TIPO ANTICIPO',
-        'NCCDR3': 'NUMERO ANTICIPO',
-        'NCIMAN': 'VALOR ANTICIPO',
-        'ANTICIPO': 'VALOR ANTICIPO', 
-        'NCFEGR': 'FECHA',
-    }
+    mapeo_anticipos = renombres_modelo(FUENTES['ANTICI']['esquema'], FUENTES['ANTICI']['alias_modelo'])
     df_anticipos = df_anticipos_raw.rename(
         columns={k: v for k, v in mapeo_anticipos.items() if k in df_anticipos_raw.columns}
     )
+    del df_anticipos_raw
 
     # -------------------------------------------------------
     # FIX-OBS-1: IDENTIFICACION en anticipos = cédula (WWNIT)
@@ -992,11 +1121,11 @@ def crear_modelo_deuda(archivo_provision: str,
           "No se usa CODIGO CLIENTE como sustituto.")
 
     if 'EMPRESA' in df_anticipos.columns and 'ACTIVIDAD' in df_anticipos.columns:
-        df_anticipos['LINEA DE NEGOCIO'] = df_anticipos.apply(
-            lambda r: _build_linea_key(r['EMPRESA'], r['ACTIVIDAD']), axis=1
+        df_anticipos['LINEA DE NEGOCIO'] = construir_linea_negocio(
+            df_anticipos['EMPRESA'], df_anticipos['ACTIVIDAD']
         )
 
-    df_anticipos = excluir_pl16_pl68(df_anticipos, "ANTICIPOS")
+    df_anticipos = _copia(excluir_lineas_modelo(df_anticipos, "ANTICIPOS", reglas))
 
     if 'VALOR ANTICIPO' in df_anticipos.columns:
         valor_ant = pd.to_numeric(df_anticipos['VALOR ANTICIPO'], errors='coerce').fillna(0.0)
@@ -1059,13 +1188,14 @@ def crear_modelo_deuda(archivo_provision: str,
     df_anticipos['DIAS POR VENCER'] = df_anticipos['DIAS POR VENCER'].fillna(0).astype(int)
 
     print(f"  [OK] {len(df_anticipos):,} anticipos procesados")
+    monitor.marcar("Anticipos")
 
     # -- PASO 5: Separar PESOS y DIVISAS --
-    lineas_pesos_keys   = {f"{cod}{act}" for cod, act in LINEAS_PESOS}
-    lineas_divisas_keys = {f"{cod}{act}" for cod, act in LINEAS_DIVISAS}
+    atributos_prov = atributos_linea(df_provision['LINEA DE NEGOCIO'])
 
-    df_pesos   = df_provision[df_provision['LINEA DE NEGOCIO'].isin(lineas_pesos_keys)].copy()
-    df_divisas = df_provision[df_provision['LINEA DE NEGOCIO'].isin(lineas_divisas_keys)].copy()
+    df_pesos   = _copia(df_provision[atributos_prov['ES_PESOS'].to_numpy()])
+    df_divisas = _copia(df_provision[atributos_prov['ES_DIVISAS'].to_numpy()])
+    del df_provision
 
     print("\nLineas en PESOS:")
     print(df_pesos['LINEA DE NEGOCIO'].value_counts())
@@ -1073,7 +1203,7 @@ def crear_modelo_deuda(archivo_provision: str,
     print(df_divisas['LINEA DE NEGOCIO'].value_counts())
 
     df_pesos['MONEDA']   = 'PESOS COL'
-    df_divisas['MONEDA'] = df_divisas['LINEA DE NEGOCIO'].apply(_moneda_por_linea)
+    df_divisas['MONEDA'] = atributos_prov.loc[atributos_prov['ES_DIVISAS'], 'MONEDA'].to_numpy()
 
     df_pesos   = ordenar_columnas_modelo(df_pesos)
     df_divisas = ordenar_columnas_modelo(df_divisas)
@@ -1110,10 +1240,11 @@ def crear_modelo_deuda(archivo_provision: str,
     # -------------------------------------------------------
     # SEPARAR ANTICIPOS POR MONEDA
     # -------------------------------------------------------
-    df_anticipos['MONEDA'] = df_anticipos['LINEA DE NEGOCIO'].apply(_moneda_por_linea)
+    df_anticipos['MONEDA'] = atributos_linea(df_anticipos['LINEA DE NEGOCIO'])['MONEDA']
     df_anticipos['MONEDA'] = df_anticipos['MONEDA'].fillna('PESOS COL')
-    ant_div   = df_anticipos[df_anticipos['MONEDA'] != 'PESOS COL'].copy()
-    ant_pesos = df_anticipos[df_anticipos['MONEDA'] == 'PESOS COL'].copy()
+    ant_div   = _copia(df_anticipos[df_anticipos['MONEDA'] != 'PESOS COL'])
+    ant_pesos = _copia(df_anticipos[df_anticipos['MONEDA'] == 'PESOS COL'])
+    del df_anticipos
 
     # -------------------------------------------------------
     # COLUMNAS OFICIALES DEL MODELO
@@ -1140,7 +1271,6 @@ def crear_modelo_deuda(archivo_provision: str,
             if col not in df.columns:
                 df[col] = None
         df = df.reindex(columns=columnas_modelo)
-        df = df[columnas_modelo]
         for col in columnas_modelo:
             if col in df.columns:
                 try:
@@ -1162,6 +1292,7 @@ def crear_modelo_deuda(archivo_provision: str,
 
     df_pesos_final   = pd.concat([df_pesos,   ant_pesos], ignore_index=True)
     df_divisas_final = pd.concat([df_divisas, ant_div],   ignore_index=True)
+    del df_pesos, ant_pesos, df_divisas, ant_div
 
     # =====================================================
     # REPARAR ANTICIPOS DESPUÉS DEL CONCAT
@@ -1221,11 +1352,12 @@ def crear_modelo_deuda(archivo_provision: str,
     total_div   = df_divisas_final['SALDO'].sum() if 'SALDO' in df_divisas_final.columns else 0.0
     print(f"  [OK] Registros PESOS:   {len(df_pesos_final):,}  |  Saldo: ${total_pesos:,.0f}")
     print(f"  [OK] Registros DIVISAS: {len(df_divisas_final):,}  |  Saldo moneda original: {total_div:,.2f}")
+    monitor.marcar("Separación PESOS / DIVISAS")
 
     # =====================================================
     # CONVERTIR DIVISAS A COP
     # =====================================================
-    df_divisas_cop = df_divisas_final.copy()
+    df_divisas_cop = df_divisas_final.copy(deep=not memoria_ligera)
 
     if 'MONEDA' not in df_divisas_cop.columns:
         raise ValueError("La columna MONEDA no existe en df_divisas_cop")
@@ -1248,7 +1380,7 @@ def crear_modelo_deuda(archivo_provision: str,
     print(f"  [OK] Total DIVISAS convertido a COP: ${total_divisas_cop:,.0f}")
 
     if 'MONEDA' not in df_divisas_cop.columns:
-        df_divisas_cop['MONEDA'] = df_divisas_cop['LINEA DE NEGOCIO'].apply(_moneda_por_linea)
+        df_divisas_cop['MONEDA'] = atributos_linea(df_divisas_cop['LINEA DE NEGOCIO'])['MONEDA']
 
     df_divisas_cop = df_divisas_cop.reset_index(drop=True)
 
@@ -1296,22 +1428,32 @@ def crear_modelo_deuda(archivo_provision: str,
 
     # -- PASO 6: Hoja VENCIMIENTO --
     print("\n[6/7] Generando hoja VENCIMIENTO...")
-    df_vencimientos = crear_hoja_vencimientos(df_pesos_final, df_divisas_cop)
+    indice_clientes = IndiceClientes(archivo_indice_clientes) if archivo_indice_clientes else None
+    cubo_vencimientos = construir_cubo_vencimientos(
+        df_pesos_final, df_divisas_final, df_divisas_cop, indice_clientes
+    )
+    print(f"  [OK] Cubo de vencimientos: {len(cubo_vencimientos):,} celdas")
+    if indice_clientes is not None:
+        print(f"  [OK] Índice de clientes: {indice_clientes.aciertos:,} encontrados, "
+              f"{indice_clientes.nuevos:,} nuevos ({len(indice_clientes.nombres):,} clientes)")
+
+    df_vencimientos = crear_hoja_vencimientos(cubo_vencimientos, reglas)
 
-    df_usd_euro_vencimientos = crear_hoja_usd_euro_vencimientos(df_pesos_final, df_divisas_cop)
+    df_usd_euro_vencimientos = crear_hoja_usd_euro_vencimientos(cubo_vencimientos)
     print(f"  [OK] {len(df_usd_euro_vencimientos):,} filas USD_EURO_VENCIMIENTOS")
     print(f"  [OK] {len(df_vencimientos):,} filas en hoja VENCIMIENTO")
 
     # NUEVA HOJA: misma info pero en moneda original (sin convertir por TRM)
-    df_usd_euro_vencimientos_original = crear_hoja_usd_euro_vencimientos_moneda_original(df_divisas_final)
+    df_usd_euro_vencimientos_original = crear_hoja_usd_euro_vencimientos_moneda_original(cubo_vencimientos)
     print(f"  [OK] {len(df_usd_euro_vencimientos_original):,} filas USD_EURO_VENCIMIENTOS_MONEDA_ORIGINAL")
+    monitor.marcar("Cubo y hojas de vencimiento")
 
+    # Las fechas se mantienen como datetime64; el formato de fecha lo aplica el ExcelWriter
     for dfX in (df_pesos_final, df_divisas_final, df_divisas_cop, df_vencimientos,
                 df_usd_euro_vencimientos, df_usd_euro_vencimientos_original):
-        if 'FECHA' in dfX.columns:
-            dfX['FECHA'] = pd.to_datetime(dfX['FECHA'], errors='coerce').dt.date
-        if 'FECHA VTO' in dfX.columns:
-            dfX['FECHA VTO'] = pd.to_datetime(dfX['FECHA VTO'], errors='coerce').dt.date
+        for col in ('FECHA', 'FECHA VTO'):
+            if col in dfX.columns and not pd.api.types.is_datetime64_any_dtype(dfX[col]):
+                dfX[col] = pd.to_datetime(dfX[col], errors='coerce')
 
     # -- PASO 7: Exportar a Excel --
     print("\n[7/7] Guardando archivo Excel...")
@@ -1325,39 +1467,44 @@ def crear_modelo_deuda(archivo_provision: str,
         'Saldo No vencido', 'Saldo Vencido',
         'Vencido 30', 'Vencido 60', 'Vencido 90',
         'Vencido 180', 'Vencido 360', 'Vencido + 360',
+        'SALDO COP FECHA FACTURA', 'SALDO COP CIERRE', 'DIFERENCIA EN CAMBIO',
     ]
 
-    with pd.ExcelWriter(output_path, engine='xlsxwriter') as writer:
+    with pd.ExcelWriter(
+        output_path,
+        engine='xlsxwriter',
+        date_format='YYYY-MM-DD',
+        datetime_format='YYYY-MM-DD'
+    ) as writer:
         wb = writer.book
-        fmt_miles  = wb.add_format({'num_format': '#,##0.00;-#,##0.00;"-";@'})
-        fmt_pct    = wb.add_format({'num_format': '0%'})
-        fmt_texto  = wb.add_format({'num_format': '@'})
-        fmt_header = wb.add_format({
+        formatos   = CacheFormatos(wb)
+        fmt_miles  = formatos.obtener({'num_format': '#,##0.00;-#,##0.00;"-";@'})
+        fmt_pct    = formatos.obtener({'num_format': '0%'})
+        fmt_texto  = formatos.obtener({'num_format': '@'})
+        fmt_header = formatos.obtener({
             'bold': True, 'bg_color': '#1F3864', 'font_color': '#FFFFFF',
             'border': 1, 'align': 'center', 'valign': 'vcenter', 'text_wrap': True
         })
-        fmt_total     = wb.add_format({
+        fmt_total     = formatos.obtener({
             'bold': True, 'bg_color': '#D6E4F0',
             'num_format': '#,##0.00;-#,##0.00;"-";@', 'border': 1
         })
-        fmt_total_txt = wb.add_format({'bold': True, 'bg_color': '#D6E4F0', 'border': 1})
+        fmt_total_txt = formatos.obtener({'bold': True, 'bg_color': '#D6E4F0', 'border': 1})
 
         def _limpiar_df(df_data: pd.DataFrame) -> pd.DataFrame:
-            df_out = df_data.copy()
-            for col in df_out.columns:
+            """Sanea NaN/inf del bloque numérico en el mismo DataFrame (sin copia)."""
+            for col in df_data.columns:
                 if col in cols_num or col == '% DOTACION':
-                    df_out[col] = pd.to_numeric(df_out[col], errors='coerce').fillna(0.0)
-                    df_out[col] = df_out[col].replace([float('inf'), float('-inf')], 0.0)
-            return df_out
-
-        def _safe_num(val):
-            try:
-                v = float(val)
-                if v != v or v == float('inf') or v == float('-inf'):
-                    return 0.0
-                return v
-            except (TypeError, ValueError):
-                return 0.0
+                    serie = df_data[col]
+                    convertida = not pd.api.types.is_numeric_dtype(serie)
+                    if convertida:
+                        serie = pd.to_numeric(serie, errors='coerce')
+                    valores = serie.to_numpy()
+                    if valores.dtype.kind == 'f' and not np.isfinite(valores).all():
+                        df_data[col] = np.where(np.isfinite(valores), valores, 0.0)
+                    elif convertida:
+                        df_data[col] = serie
+            return df_data
 
         def _escribir_hoja(df_data: pd.DataFrame, nombre_hoja: str,
                            fila_total_marker: Optional[str] = None,
@@ -1366,8 +1513,9 @@ def crear_modelo_deuda(archivo_provision: str,
             df_data.to_excel(writer, sheet_name=nombre_hoja, index=False, startrow=0)
             ws = writer.sheets[nombre_hoja]
 
-            for col_idx, col_name in enumerate(df_data.columns):
-                ws.write(0, col_idx, col_name, fmt_header)
+            escribir_encabezados(ws, df_data.columns, fmt_header)
+
+            es_num = np.array([c in cols_num or c == '% DOTACION' for c in df_data.columns], dtype=bool)
 
             for col_idx, col_name in enumerate(df_data.columns):
                 width = 20
@@ -1379,17 +1527,22 @@ def crear_modelo_deuda(archivo_provision: str,
                     ws.set_column(col_idx, col_idx, width, fmt_texto)
 
             if fila_total_marker and col_total_marker and col_total_marker in df_data.columns:
-                for row_idx, val in enumerate(df_data[col_total_marker]):
-                    if str(val).startswith(fila_total_marker):
-                        for c_idx, c_name in enumerate(df_data.columns):
-                            cell_val = df_data.iloc[row_idx][c_name]
-                            if c_name in cols_num:
-                                ws.write(row_idx + 1, c_idx, _safe_num(cell_val), fmt_total)
-                            elif c_name == '% DOTACION':
-                                ws.write(row_idx + 1, c_idx, _safe_num(cell_val), fmt_total)
+                filas_total = np.flatnonzero(
+                    df_data[col_total_marker].astype(str).str.startswith(fila_total_marker).to_numpy()
+                )
+                if len(filas_total):
+                    # Tramos consecutivos de columnas con el mismo formato (numérico / texto)
+                    cortes = np.flatnonzero(np.diff(es_num)) + 1
+                    tramos = list(zip(np.r_[0, cortes], np.r_[cortes, len(es_num)]))
+                    bloque = df_data.iloc[filas_total].to_numpy(dtype=object)
+                    for fila, valores in zip(filas_total, bloque):
+                        for ini, fin in tramos:
+                            if es_num[ini]:
+                                datos = np.asarray(valores[ini:fin], dtype=float).tolist()
+                                ws.write_row(fila + 1, ini, datos, fmt_total)
                             else:
-                                ws.write(row_idx + 1, c_idx,
-                                         str(cell_val) if cell_val else '', fmt_total_txt)
+                                datos = ['' if pd.isna(v) or not v else str(v) for v in valores[ini:fin]]
+                                ws.write_row(fila + 1, ini, datos, fmt_total_txt)
 
             ws.freeze_panes(1, 0)
 
@@ -1475,6 +1628,37 @@ def crear_modelo_deuda(archivo_provision: str,
             _escribir_hoja(df_vencimientos, 'VENCIMIENTO', 'TOTAL GENERAL', 'CLIENTE')
             print("  [OK] Hoja VENCIMIENTO escrita")
 
+        # ===================================
+        # HOJA CONCENTRACION (principales deudores y Herfindahl)
+        # ===================================
+        if not df_vencimientos.empty:
+            df_conc_resumen, df_conc_detalle = calcular_concentracion(df_vencimientos)
+            df_conc_resumen.to_excel(writer, sheet_name='CONCENTRACION', index=False)
+            ws_conc = writer.sheets['CONCENTRACION']
+            escribir_encabezados(ws_conc, df_conc_resumen.columns, fmt_header, alto=30)
+            fila_detalle = len(df_conc_resumen) + 3
+            df_conc_detalle.to_excel(writer, sheet_name='CONCENTRACION', index=False, startrow=fila_detalle)
+            escribir_encabezados(ws_conc, df_conc_detalle.columns, fmt_header, fila=fila_detalle, alto=30)
+            # Columnas compartidas por los dos bloques: formato por posición
+            fmt_pct2 = formatos.obtener({'num_format': '0.00%'})
+            fmt_entero = formatos.obtener({'num_format': '#,##0'})
+            ws_conc.set_column(0, 0, 20)
+            ws_conc.set_column(1, 1, 12, fmt_entero)
+            ws_conc.set_column(2, 2, 40)
+            ws_conc.set_column(3, 3, 20, fmt_miles)
+            ws_conc.set_column(4, 5, 18, fmt_pct2)
+            ws_conc.set_column(6, 6, 20, fmt_miles)
+            ws_conc.set_column(7, 7, 18, fmt_pct2)
+            # En el bloque resumen: columnas 2-3 son montos, 4-5 porcentajes y 6-7 índices HHI
+            for fila, valores in enumerate(df_conc_resumen.itertuples(index=False), start=1):
+                ws_conc.write_row(fila, 2, [valores[2], valores[3]], fmt_miles)
+                ws_conc.write_row(fila, 6, [valores[6], valores[7]], fmt_entero)
+            ws_conc.freeze_panes(1, 1)
+            total = df_conc_resumen.iloc[0]
+            print(f"  [OK] Hoja CONCENTRACION escrita (top {TOP_CONCENTRACION}: "
+                  f"{total[f'% SALDO TOP {TOP_CONCENTRACION}']:.1%} del saldo, "
+                  f"HHI saldo {total['HHI SALDO']:,.0f})")
+
         # ===================================
         # HOJA USD_EURO_VENCIMIENTOS (convertida a COP)
         # ===================================
@@ -1506,14 +1690,81 @@ def crear_modelo_deuda(archivo_provision: str,
 
         df_tasas.to_excel(writer, sheet_name='TASAS_TRM', index=False, startrow=1, header=False)
         ws_tasas = writer.sheets['TASAS_TRM']
-        ws_tasas.write(0, 0, 'Concepto', fmt_header)
-        ws_tasas.write(0, 1, 'Valor',    fmt_header)
-        ws_tasas.write(0, 2, 'Unidad',   fmt_header)
+        escribir_encabezados(ws_tasas, ['Concepto', 'Valor', 'Unidad'], fmt_header)
         ws_tasas.set_column(0, 0, 30)
         ws_tasas.set_column(1, 1, 15)
         ws_tasas.set_column(2, 2, 15)
         print("  [OK] Hoja TASAS_TRM escrita")
 
+        # ===================================
+        # HOJA DIFERENCIA_CAMBIO (opcional): TRM de la fecha de factura vs TRM de cierre
+        # ===================================
+        if archivo_trm_diaria and not df_divisas_final.empty:
+            df_dif = convertir_a_fecha_factura(
+                df_divisas_final, leer_archivo(archivo_trm_diaria), trm_dolar, trm_euro
+            )
+            sin_trm = int(df_dif['TRM FECHA FACTURA'].isna().sum())
+            if sin_trm:
+                print(f"  [WARN] {sin_trm} registro(s) sin TRM para su FECHA (fecha vacía o anterior a la serie)")
+            tot_dif = df_dif[['SALDO COP FECHA FACTURA', 'SALDO COP CIERRE', 'DIFERENCIA EN CAMBIO']].sum().to_frame().T
+            tot_dif['LINEA DE NEGOCIO'] = 'TOTAL GENERAL'
+            df_dif = pd.concat([df_dif, tot_dif], ignore_index=True)
+            _escribir_hoja(df_dif, 'DIFERENCIA_CAMBIO', 'TOTAL GENERAL', 'LINEA DE NEGOCIO')
+            ws_dif = writer.sheets['DIFERENCIA_CAMBIO']
+            for col_trm in ('TRM FECHA FACTURA', 'TRM CIERRE'):
+                idx = df_dif.columns.get_loc(col_trm)
+                ws_dif.set_column(idx, idx, 14, fmt_miles)
+            print(f"  [OK] Hoja DIFERENCIA_CAMBIO escrita "
+                  f"(diferencia en cambio: {tot_dif['DIFERENCIA EN CAMBIO'].iloc[0]:,.2f} COP)")
+
+        # ===================================
+        # HOJAS ESCENARIOS FX (opcional)
+        # ===================================
+        if escenarios_fx:
+            divisas_cubo = cubo_vencimientos[cubo_vencimientos['FUENTE'] == 'DIVISAS']
+            escenarios = [escenarios_choque(trm_dolar, trm_euro)]
+            if archivo_trm_historico:
+                escenarios.append(escenarios_historicos(leer_archivo(archivo_trm_historico)))
+            df_escenarios = evaluar_escenarios(
+                divisas_cubo, pd.concat(escenarios, ignore_index=True), trm_dolar, trm_euro
+            )
+            df_escenarios.to_excel(writer, sheet_name='ESCENARIOS_FX', index=False)
+            ws_esc = writer.sheets['ESCENARIOS_FX']
+            escribir_encabezados(ws_esc, df_escenarios.columns, fmt_header)
+            ws_esc.set_column(0, 0, 26)
+            ws_esc.set_column(1, len(df_escenarios.columns) - 1, 20, fmt_miles)
+            ws_esc.freeze_panes(1, 1)
+            print(f"  [OK] Hoja ESCENARIOS_FX escrita ({len(df_escenarios):,} escenarios)")
+
+            if simulaciones_fx and simulaciones_fx > 0:
+                df_mc = evaluar_escenarios(
+                    divisas_cubo,
+                    escenarios_montecarlo(trm_dolar, trm_euro, simulaciones_fx),
+                    trm_dolar, trm_euro
+                )
+                df_pct = resumen_percentiles(df_mc)
+                df_pct.to_excel(writer, sheet_name='ESCENARIOS_FX_PERCENTILES', index=False)
+                ws_pct = writer.sheets['ESCENARIOS_FX_PERCENTILES']
+                escribir_encabezados(ws_pct, df_pct.columns, fmt_header)
+                ws_pct.set_column(0, 0, 12)
+                ws_pct.set_column(1, len(df_pct.columns) - 1, 20, fmt_miles)
+                ws_pct.freeze_panes(1, 1)
+                print(f"  [OK] Hoja ESCENARIOS_FX_PERCENTILES escrita ({simulaciones_fx:,} simulaciones)")
+
+    monitor.marcar("Exportación a Excel")
+
+    ruta_totales = escribir_totales_modelo(
+        df_vencimientos, df_usd_euro_vencimientos_original,
+        output_path, trm_dolar, trm_euro, fecha_trm, reglas
+    )
+    print(f"  [OK] Resumen de totales: {ruta_totales}")
+    # El índice solo se persiste si el libro se exportó completo
+    if indice_clientes is not None:
+        print(f"  [OK] Índice de clientes guardado: {indice_clientes.guardar()}")
+    for linea in reglas.resumen():
+        print(linea)
+    excedido = monitor.activo and not monitor.verificar()
+
     print("\n" + "=" * 62)
     print("  MODELO DE DEUDA GENERADO EXITOSAMENTE")
     print(f"  Archivo : {output_path}")
@@ -1524,6 +1775,11 @@ def crear_modelo_deuda(archivo_provision: str,
     if USE_UNIFIED_LOGGING:
         log_fin_proceso("MODELO_DEUDA", output_file)
 
+    if excedido:
+        raise PresupuestoMemoriaExcedido(
+            f"Pico de memoria por encima del presupuesto de {monitor.presupuesto_mb:,.1f} MB "
+            f"(el modelo se generó: {output_path})"
+        )
     return output_path
 
 
@@ -1545,6 +1801,26 @@ def main():
                         help="TRM USD override (ej: 4350.50). Ignora trm.json para USD.")
     parser.add_argument("--eur", type=float,
                         help="TRM EUR override (ej: 4712.80). Ignora trm.json para EUR.")
+    parser.add_argument("--escenarios-fx", action="store_true",
+                        help="Agrega hojas de escenarios de TRM (choques ±5/10/20%% y Monte Carlo)")
+    parser.add_argument("--simulaciones", type=int, default=10000,
+                        help="Número de simulaciones Monte Carlo (0 = sin simulación)")
+    parser.add_argument("--trm-historico",
+                        help="CSV/XLSX con columnas FECHA, USD, EUR para escenarios históricos")
+    parser.add_argument("--trm-diaria",
+                        help="CSV/XLSX con columnas FECHA, USD, EUR: agrega la hoja DIFERENCIA_CAMBIO "
+                             "(cada factura a la TRM de su FECHA vs la TRM de cierre)")
+    parser.add_argument("--indice-clientes", default=RUTA_INDICE_CLIENTES,
+                        help="JSON del índice de resolución de clientes (se actualiza en cada corrida)")
+    parser.add_argument("--sin-indice-clientes", action="store_true",
+                        help="Agrupa CLIENTE por el texto de DENOMINACION COMERCIAL, sin resolver identidades")
+    parser.add_argument("--reglas", default=None,
+                        help="JSON de reglas de la política de provisión (por defecto reglas_provision.json)")
+    parser.add_argument("--memoria-ligera", action="store_true",
+                        help="Copy-on-write de pandas y reporte del pico de memoria por paso")
+    parser.add_argument("--presupuesto-memoria", type=float, default=None,
+                        help="Pico de memoria máximo en MB: si se supera, el modelo se genera "
+                             "igual pero el proceso termina con código 3")
     args = parser.parse_args()
 
     if not args.output_file:
@@ -1558,7 +1834,19 @@ def main():
             args.output_file,
             usd_override=args.usd,
             eur_override=args.eur,
+            escenarios_fx=args.escenarios_fx,
+            simulaciones_fx=args.simulaciones,
+            archivo_trm_historico=args.trm_historico,
+            archivo_trm_diaria=args.trm_diaria,
+            memoria_ligera=args.memoria_ligera,
+            presupuesto_memoria_mb=args.presupuesto_memoria,
+            archivo_indice_clientes=None if args.sin_indice_clientes else args.indice_clientes,
+            archivo_reglas=args.reglas,
         )
+    except PresupuestoMemoriaExcedido as e:
+        print(f"\n[ERROR] {e}")
+        logging.error(f"Modelo de deuda fuera del presupuesto de memoria: {e}")
+        sys.exit(3)
     except Exception as e:
         if USE_UNIFIED_LOGGING:
             log_error_proceso("MODELO_DEUDA", str(e))
@@ -15,6 +15,9 @@ import logging
 import re
 from datetime import datetime
 
+from exportar_excel import CacheFormatos, escribir_encabezados, estimar_ancho
+from esquemas import ESQUEMA_ANTICI, columnas_procesador, renombres, tipos_lectura
+
 # Configuración de logging unificado
 try:
     from config_logging import logger, log_inicio_proceso, log_fin_proceso, log_error_proceso
@@ -46,37 +49,7 @@ OUT_DIR = os.path.join(BASE_DIR, 'salidas')
 os.makedirs(OUT_DIR, exist_ok=True)
 
 # Mapeo de columnas según especificación PISA para anticipos
-RENOMBRES = {
-         "NCCDEM": "EMPRESA",
-         "NCCDAC": "ACTIVIDAD",
-         "NCCDCL": "CODIGO CLIENTE",
-         "WWNIT": "NRO DOCUMENTO",
-         "WWNMCL": "NOMBRE COMERCIAL",
-         "WWNMDO": "DIRECCION",
-         "WWTLF1": "TELEFONO",
-         "WWNMPO": "CIUDAD", 
-         "CCCDFB": "CODIGO AGENTE",
-         "BDNMNM": "NOMBRE AGENTE",
-         "BDNMPA": "APELLIDO AGENTE",
-         "NCMOMO": "TIPO ANTICIPO",
-         "NCCDR3": "NRO ANTICIPO",
-         "NCIMAN": "VALOR ANTICIPO",
-         "NCFEGR": "FECHA ANTICIPO",
-         '"NCCDEM"': "EMPRESA",
-         '"NCCDAC"': "ACTIVIDAD",
-         '"NCCDCL"': "CODIGO CLIENTE",
-         '"WWNIT"': "NRO DOCUMENTO",
-         '"WWNMCL"': "NOMBRE COMERCIAL",
-         '"WWNMDO"': "DIRECCION",
-         '"WWTLF1"': "TELEFONO",
-         '"CCCDFB"': "CODIGO AGENTE",
-         '"BDNMNM"': "NOMBRE AGENTE",
-         '"BDNMPA"': "APELLIDO AGENTE",
-         '"NCMOMO"': "TIPO ANTICIPO",
-         '"NCCDR3"': "NRO ANTICIPO",
-         '"NCIMAN"': "VALOR ANTICIPO",
-         '"NCFEGR"': "FECHA ANTICIPO"
-}
+RENOMBRES = renombres(ESQUEMA_ANTICI, con_comillas=True)
 
 def info(msg):
     print(msg)
@@ -138,24 +111,8 @@ def parse_fecha_segura(serie):
 
     return fechas
 
-def procesar_anticipos(input_path, output_path=None, fecha_cierre_str="2025-11-30"):
-    """
-    Procesa el archivo de anticipos según procedimiento.
-    Los anticipos van en las columnas: SALDO, SALDO NO VENCIDO (por vencer)
-    y deben tener la misma estructura que cartera para consolidación.
-    """
-    if USE_UNIFIED_LOGGING:
-        log_inicio_proceso("ANTICIPOS", input_path)
-    
-    info("\n=== PROCESADOR DE ANTICIPOS ===")
-    info(f"Fecha de cierre: {fecha_cierre_str}")
-    
-    if not os.path.exists(input_path):
-        raise FileNotFoundError(f"No se encontró el archivo: {input_path}")
-    
-    # -------------------------
-    # 1. LEER ARCHIVO CSV
-    # -------------------------
+def leer_csv_anticipos(input_path):
+    """Lee un CSV de anticipos PISA probando encodings"""
     encodings = ['utf-8-sig', 'latin1', 'cp1252']
     df = None
 
@@ -165,18 +122,174 @@ def procesar_anticipos(input_path, output_path=None, fecha_cierre_str="2025-11-3
                 input_path,
                 sep=";",
                 encoding=enc,
-                dtype=str,
+                usecols=columnas_procesador(ESQUEMA_ANTICI),
+                dtype=tipos_lectura(ESQUEMA_ANTICI),
                 keep_default_na=False,
                 na_values=[""]
             )
             if len(df) > 0:
-                info(f"✓ Archivo leído con encoding {enc}")
+                info(f"✓ Archivo {os.path.basename(input_path)} leído con encoding {enc}")
                 break
         except:
             continue
 
     if df is None:
-        raise ValueError("No se pudo leer el archivo")
+        raise ValueError(f"No se pudo leer el archivo: {input_path}")
+
+    return df
+
+# Campos que identifican un anticipo: NCCDEM, NCCDAC, NCCDR3, NCIMAN, NCFEGR
+CLAVE_ANTICIPO = [
+    "EMPRESA",
+    "ACTIVIDAD",
+    "NRO ANTICIPO",
+    "VALOR ANTICIPO",
+    "FECHA ANTICIPO",
+]
+
+def _normalizar_valor_texto(serie):
+    """Versión vectorizada de convertir_valor_to_float para construir claves"""
+    s = serie.astype(str).str.replace(r"[\s$\u200b]", "", regex=True)
+    ambos = s.str.contains(",", regex=False) & s.str.contains(".", regex=False)
+    s = s.where(~ambos, s.str.replace(".", "", regex=False))
+    s = s.str.replace(",", ".", regex=False)
+    return pd.to_numeric(s, errors="coerce").fillna(0.0).round(2)
+
+def hash_anticipos(df):
+    """
+    Calcula una clave de 64 bits por registro a partir de los campos
+    normalizados de CLAVE_ANTICIPO (espacios, ceros a la izquierda y
+    formato del valor no cuentan como diferencia).
+    Todas las columnas de la clave deben existir: sin alguna, anticipos
+    distintos quedarían con la misma clave y se eliminarían como duplicados.
+    """
+    faltantes = [col for col in CLAVE_ANTICIPO if col not in df.columns]
+    if faltantes:
+        raise ValueError(f"Faltan columnas de la clave de anticipos: {', '.join(faltantes)}")
+    normalizado = pd.DataFrame(index=df.index)
+    for col in CLAVE_ANTICIPO:
+        if col == "VALOR ANTICIPO":
+            normalizado[col] = _normalizar_valor_texto(df[col])
+        else:
+            texto = df[col].fillna("").astype(str).str.strip().str.upper()
+            if col in ("ACTIVIDAD", "NRO ANTICIPO"):
+                texto = texto.str.lstrip("0")
+            normalizado[col] = texto
+    return pd.util.hash_pandas_object(normalizado, index=False).to_numpy()
+
+def etiquetas_origen(rutas):
+    """
+    Nombre de cada archivo de entrada para el reporte de solapamiento: el
+    nombre del archivo, o la ruta relativa a la carpeta común si dos archivos
+    se llaman igual (y un sufijo #n si es la misma ruta repetida).
+    """
+    nombres = [os.path.basename(r) for r in rutas]
+    if len(set(nombres)) < len(nombres):
+        absolutas = [os.path.abspath(r) for r in rutas]
+        comun = os.path.dirname(os.path.commonprefix(absolutas)) if len(rutas) > 1 else ""
+        nombres = [os.path.relpath(r, comun) if comun else r for r in absolutas]
+    etiquetas, vistos = [], {}
+    for nombre in nombres:
+        vistos[nombre] = vistos.get(nombre, 0) + 1
+        etiquetas.append(nombre if vistos[nombre] == 1 else f"{nombre} #{vistos[nombre]}")
+    return etiquetas
+
+def deduplicar_anticipos(df):
+    """
+    Elimina anticipos repetidos (misma clave de 64 bits) en una sola pasada
+    y reporta el solapamiento entre archivos de origen.
+    Retorna (df_sin_duplicados, df_solapamiento).
+    """
+    claves = hash_anticipos(df)
+    duplicado = pd.Series(claves).duplicated(keep="first").to_numpy()
+
+    archivos = list(dict.fromkeys(df["__ORIGEN__"]))
+    origen = df["__ORIGEN__"].to_numpy()
+    claves_por_archivo = {a: np.unique(claves[origen == a]) for a in archivos}
+
+    filas = []
+    for a in archivos:
+        mask = origen == a
+        fila = {
+            "ARCHIVO": a,
+            "REGISTROS": int(mask.sum()),
+            "NUEVOS": int((mask & ~duplicado).sum()),
+            "DUPLICADOS": int((mask & duplicado).sum()),
+        }
+        for b in archivos:
+            fila[f"COMUNES CON {b}"] = int(
+                np.intersect1d(claves_por_archivo[a], claves_por_archivo[b], assume_unique=True).size
+            )
+        filas.append(fila)
+    solapamiento = pd.DataFrame(filas)
+
+    total_duplicados = int(duplicado.sum())
+    if len(archivos) > 1:
+        info(f"✓ {len(archivos)} archivos combinados")
+        for fila in filas:
+            info(f"  - {fila['ARCHIVO']}: {fila['REGISTROS']} registros, "
+                 f"{fila['NUEVOS']} nuevos, {fila['DUPLICADOS']} duplicados")
+    info(f"✓ Registros duplicados eliminados: {total_duplicados}")
+
+    return df.loc[~duplicado].reset_index(drop=True), solapamiento
+
+# Rangos de antigüedad del anticipo (días desde FECHA ANTICIPO hasta el cierre).
+# Cada rango es (etiqueta, día inicial, día final); el último queda abierto.
+RANGOS_ANTIGUEDAD = [
+    ("0-30", 0, 30),
+    ("31-90", 31, 90),
+    ("91-180", 91, 180),
+    (">180", 181, None),
+]
+
+def asignar_rango_antiguedad(dias, rangos=RANGOS_ANTIGUEDAD):
+    """
+    Asigna a cada registro el índice de su rango de antigüedad en una sola
+    operación vectorizada. Los registros sin fecha quedan con -1.
+    """
+    valores = pd.to_numeric(dias, errors="coerce").to_numpy(dtype=float)
+    limites = np.array([inicio for _, inicio, _ in rangos[1:]], dtype=float)
+    codigos = np.searchsorted(limites, valores, side="right")
+    codigos[np.isnan(valores)] = -1
+    return codigos
+
+def procesar_anticipos(input_path, output_path=None, fecha_cierre_str="2025-11-30",
+                       rangos_antiguedad=None):
+    """
+    Procesa el archivo de anticipos según procedimiento.
+    Los anticipos van en las columnas: SALDO, SALDO NO VENCIDO (por vencer)
+    y deben tener la misma estructura que cartera para consolidación.
+
+    input_path puede ser una ruta o una lista de rutas (exportaciones
+    ANTICI solapadas del mismo mes); los registros repetidos se eliminan.
+
+    rangos_antiguedad permite reemplazar RANGOS_ANTIGUEDAD para las columnas
+    informativas de antigüedad (no afectan lo que consolida modelo_deuda).
+    """
+    rangos_antiguedad = rangos_antiguedad or RANGOS_ANTIGUEDAD
+    rutas_entrada = [input_path] if isinstance(input_path, (str, os.PathLike)) else list(input_path)
+
+    if USE_UNIFIED_LOGGING:
+        log_inicio_proceso("ANTICIPOS", " + ".join(str(r) for r in rutas_entrada))
+    
+    info("\n=== PROCESADOR DE ANTICIPOS ===")
+    info(f"Fecha de cierre: {fecha_cierre_str}")
+    
+    if not rutas_entrada:
+        raise ValueError("No se recibió archivo de entrada")
+    for ruta in rutas_entrada:
+        if not os.path.exists(ruta):
+            raise FileNotFoundError(f"No se encontró el archivo: {ruta}")
+    
+    # -------------------------
+    # 1. LEER ARCHIVO(S) CSV
+    # -------------------------
+    frames = [leer_csv_anticipos(ruta) for ruta in rutas_entrada]
+
+    # Una sola concatenación para todas las exportaciones del mes
+    for etiqueta, df_archivo in zip(etiquetas_origen(rutas_entrada), frames):
+        df_archivo["__ORIGEN__"] = etiqueta
+    df = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
 
     info(f"✓ Total registros iniciales: {len(df)}")
     
@@ -185,6 +298,12 @@ def procesar_anticipos(input_path, output_path=None, fecha_cierre_str="2025-11-3
     # -------------------------
     df.rename(columns=RENOMBRES, inplace=True)
     info("✓ Columnas renombradas")
+
+    # -------------------------
+    # 2.1 DEDUPLICAR REGISTROS ENTRE EXPORTACIONES
+    # -------------------------
+    df, solapamiento = deduplicar_anticipos(df)
+    df.drop(columns=["__ORIGEN__"], inplace=True)
     
     # -------------------------
     # LIMPIAR ESPACIOS EN NOMBRES
@@ -289,6 +408,25 @@ def procesar_anticipos(input_path, output_path=None, fecha_cierre_str="2025-11-3
     df["DIA VTO"] = df["FECHA VTO"].dt.day
     df["MES VTO"] = df["FECHA VTO"].dt.month
     df["AÑO VTO"] = df["FECHA VTO"].dt.year
+
+    # -------------------------
+    # 7.1 ANTIGÜEDAD DEL ANTICIPO (informativa para Tesorería)
+    # Los buckets de cartera siguen en NO VENCIDO; estas columnas solo
+    # muestran cuánto tiempo lleva el anticipo sin aplicar.
+    # -------------------------
+    df["DIAS ANTICIPO"] = (fecha_cierre - df["FECHA ANTICIPO"]).dt.days.clip(lower=0)
+    codigos_rango = asignar_rango_antiguedad(df["DIAS ANTICIPO"], rangos_antiguedad)
+    etiquetas_rango = np.array([etiqueta for etiqueta, _, _ in rangos_antiguedad] + ["SIN FECHA"])
+    df["RANGO ANTIGUEDAD"] = etiquetas_rango[codigos_rango]
+
+    columnas_antiguedad = []
+    for i, (etiqueta, _, _) in enumerate(rangos_antiguedad):
+        nombre_col = f"ANTIGUEDAD {etiqueta}"
+        df[nombre_col] = np.where(codigos_rango == i, df["VALOR ANTICIPO"], 0.0)
+        columnas_antiguedad.append(nombre_col)
+
+    info("✓ Antigüedad de anticipos calculada por rangos: "
+         + ", ".join(etiqueta for etiqueta, _, _ in rangos_antiguedad))
     
     # -------------------------
     # 8. ASEGURAR TODAS LAS COLUMNAS DE CARTERA
@@ -308,8 +446,10 @@ def procesar_anticipos(input_path, output_path=None, fecha_cierre_str="2025-11-3
         "TIPO ANTICIPO",
         "NRO ANTICIPO",
         "VALOR ANTICIPO",
-        "FECHA ANTICIPO"
-    ]
+        "FECHA ANTICIPO",
+        "DIAS ANTICIPO",
+        "RANGO ANTIGUEDAD",
+    ] + columnas_antiguedad
     
     for col in columnas_cartera:
         if col not in df.columns:
@@ -348,17 +488,31 @@ def procesar_anticipos(input_path, output_path=None, fecha_cierre_str="2025-11-3
     # -------------------------
     # 10. RESUMEN
     # -------------------------
+    # Totales por rango de antigüedad en una sola pasada (SIN FECHA al final)
+    totales_rango = np.bincount(
+        np.where(codigos_rango < 0, len(rangos_antiguedad), codigos_rango),
+        weights=df["VALOR ANTICIPO"].to_numpy(dtype=float),
+        minlength=len(rangos_antiguedad) + 1
+    )
+    conceptos_rango = [f"ANTIGUEDAD {etiqueta}" for etiqueta, _, _ in rangos_antiguedad]
+    valores_rango = list(totales_rango[:len(rangos_antiguedad)])
+    if (codigos_rango < 0).any():
+        conceptos_rango.append("ANTIGUEDAD SIN FECHA")
+        valores_rango.append(totales_rango[-1])
+
     resumen = pd.DataFrame({
         "CONCEPTO": [
             "SALDO TOTAL ANTICIPOS",
             "NO VENCIDO (POR VENCER)",
-            "TOTAL REGISTROS"
-        ],
+            "TOTAL REGISTROS",
+            "REGISTROS DUPLICADOS ELIMINADOS"
+        ] + conceptos_rango,
         "VALOR": [
             df["SALDO"].sum(),
             df["NO VENCIDO"].sum(),
-            len(df)
-        ]
+            len(df),
+            int(solapamiento["DUPLICADOS"].sum())
+        ] + valores_rango
     })
     
     # -------------------------
@@ -377,16 +531,19 @@ def procesar_anticipos(input_path, output_path=None, fecha_cierre_str="2025-11-3
         df_salida = df[columnas_cartera]
         df_salida.to_excel(writer, index=False, sheet_name="ANTICIPOS")
         resumen.to_excel(writer, index=False, sheet_name="RESUMEN")
+        if len(solapamiento) > 1:
+            solapamiento.to_excel(writer, index=False, sheet_name="SOLAPAMIENTO")
 
         workbook = writer.book
         worksheet = writer.sheets["ANTICIPOS"]
         worksheet_resumen = writer.sheets["RESUMEN"]
         
         # Formatos
-        date_format = workbook.add_format({'num_format': 'dd/mm/yyyy'})
-        number_format = workbook.add_format({'num_format': '#,##0.00'})
-        percent_format = workbook.add_format({'num_format': '0%'})
-        header_format = workbook.add_format({
+        formatos = CacheFormatos(workbook)
+        date_format = formatos.obtener({'num_format': 'dd/mm/yyyy'})
+        number_format = formatos.obtener({'num_format': '#,##0.00'})
+        percent_format = formatos.obtener({'num_format': '0%'})
+        header_format = formatos.obtener({
             'bold': True,
             'bg_color': "#020066",
             'font_color': 'white',
@@ -396,8 +553,7 @@ def procesar_anticipos(input_path, output_path=None, fecha_cierre_str="2025-11-3
         })
         
         # Aplicar formato a encabezados
-        for col_num, value in enumerate(df_salida.columns.values):
-            worksheet.write(0, col_num, value, header_format)
+        escribir_encabezados(worksheet, df_salida.columns, header_format)
         
         # Identificar columnas por tipo
         fecha_cols = []
@@ -412,7 +568,7 @@ def procesar_anticipos(input_path, output_path=None, fecha_cierre_str="2025-11-3
             elif col in ["SALDO", "VALOR", "NO VENCIDO", "VENCIDO 30", "VENCIDO 60", 
                         "VENCIDO 90", "VENCIDO 180", "VENCIDO 360", "VENCIDO +360",
                         "DEUDA INCOBRABLE", "MORA TOTAL", "SALDO VENCIDO TOTAL",
-                        "VALOR DOTACION", "TOTAL POR VENCER", "VALOR ANTICIPO"]:
+                        "VALOR DOTACION", "TOTAL POR VENCER", "VALOR ANTICIPO"] + columnas_antiguedad:
                 valor_cols.append(i)
         
         # Autoajustar columnas
@@ -423,14 +579,8 @@ def procesar_anticipos(input_path, output_path=None, fecha_cierre_str="2025-11-3
                 worksheet.set_column(i, i, 15, date_format)
                 continue
         
-            # Calcular ancho
-            if df_salida[col].dtype == 'datetime64[ns]':
-                max_len = max(len(col), 12) + 2
-            else:
-                max_len = max(
-                    df_salida[col].astype(str).map(len).max(),
-                    len(col)
-                ) + 2
+            # Calcular ancho (muestra acotada de la columna)
+            max_len = estimar_ancho(df_salida[col], col)
         
             # Aplicar formato
             if i in fecha_cols:
@@ -446,8 +596,14 @@ def procesar_anticipos(input_path, output_path=None, fecha_cierre_str="2025-11-3
         worksheet_resumen.set_column(0, 0, 30)
         worksheet_resumen.set_column(1, 1, 20, number_format)
         
-        for col_num, value in enumerate(resumen.columns.values):
-            worksheet_resumen.write(0, col_num, value, header_format)
+        escribir_encabezados(worksheet_resumen, resumen.columns, header_format)
+
+        # Formato para solapamiento entre archivos
+        if len(solapamiento) > 1:
+            worksheet_solap = writer.sheets["SOLAPAMIENTO"]
+            worksheet_solap.set_column(0, 0, 35)
+            worksheet_solap.set_column(1, len(solapamiento.columns) - 1, 18)
+            escribir_encabezados(worksheet_solap, solapamiento.columns, header_format)
 
     info(f"\n✓ Archivo generado: {output_path}")
     info(f"✓ Total registros: {len(df)}")
@@ -461,30 +617,35 @@ def procesar_anticipos(input_path, output_path=None, fecha_cierre_str="2025-11-3
 def main():
     """Punto de entrada principal"""
     try:
-        input_path = None
+        input_paths = []
         output_path = None
         # Fecha cierre automática: último día del mes actual
         hoy = datetime.today()
         ultimo_dia_mes = pd.Period(hoy.strftime("%Y-%m")).end_time.date()
         fecha_cierre = str(ultimo_dia_mes)
 
-        if len(sys.argv) > 1:
-            input_path = sys.argv[1]
+        # Uso: procesador_anticipos.py <csv> [csv2 ...] [output|fecha] [fecha]
+        args = sys.argv[1:]
+        if args:
+            input_paths.append(args.pop(0))
+        while args and args[0].lower().endswith(".csv"):
+            input_paths.append(args.pop(0))
 
-        if len(sys.argv) > 2:
-            arg2 = sys.argv[2]
+        if len(args) > 0:
+            arg2 = args[0]
             try:
                 pd.to_datetime(arg2, format="%Y-%m-%d")
                 fecha_cierre = arg2
             except:
                 output_path = arg2
 
-        if len(sys.argv) > 3:
-            fecha_cierre = sys.argv[3]
+        if len(args) > 1:
+            fecha_cierre = args[1]
 
-        if not input_path:
+        if not input_paths:
             raise ValueError("No se recibió archivo de entrada")
 
+        input_path = input_paths[0] if len(input_paths) == 1 else input_paths
         resultado = procesar_anticipos(input_path, output_path, fecha_cierre)
 
         info(f"\n{'='*60}")
@@ -11,6 +11,10 @@ import logging
 from datetime import datetime
 import numpy as np
 
+from exportar_excel import CacheFormatos, escribir_encabezados, estimar_ancho, reescribir_fechas
+from esquemas import ESQUEMA_PROVCA, columnas_procesador, renombres, tipos_lectura
+from reglas import cargar_reglas
+
 # ---------------------
 # Configurar encoding para Windows
 # ---------------------
@@ -57,28 +61,7 @@ os.makedirs(OUT_DIR, exist_ok=True)
 # ---------------------
 # MAPEO DE COLUMNAS SEGÚN PROCEDIMIENTO
 # ---------------------
-RENOMBRES = {
-    'PCCDEM': 'EMPRESA',
-    'PCCDAC': 'ACTIVIDAD',
-    'PCDEAC': 'EMPRESA CODIGO AGENTE',
-    'PCCDAG': 'CODIGO AGENTE',
-    'PCNMAG': 'AGENTE',
-    'PCCDCO': 'CODIGO COBRADOR',
-    'PCNMCO': 'COBRADOR',
-    'PCCDCL': 'CODIGO CLIENTE',
-    'PCCDDN': 'IDENTIFICACION',
-    'PCNMCL': 'NOMBRE',
-    'PCNMCM': 'DENOMINACION COMERCIAL',
-    'PCNMDO': 'DIRECCION',
-    'PCTLF1': 'TELEFONO',
-    'PCNMPO': 'CIUDAD',
-    'PCNUFC': 'NUMERO FACTURA',
-    'PCORPD': 'TIPO',
-    'PCFEFA': 'FECHA',
-    'PCFEVE': 'FECHA VTO',
-    'PCVAFA': 'VALOR',
-    'PCSALD': 'SALDO'
-}
+RENOMBRES = renombres(ESQUEMA_PROVCA, con_comillas=True)
 
 # ---------------------
 # Funciones auxiliares
@@ -129,7 +112,7 @@ def parse_fecha_segura(serie):
 # ---------------------
 # Función principal
 # ---------------------
-def procesar_cartera(input_path, output_path=None, fecha_cierre_str=None):
+def procesar_cartera(input_path, output_path=None, fecha_cierre_str=None, archivo_reglas=None):
     
     # Calcular fecha de cierre automática si no se proporciona
     if fecha_cierre_str is None:
@@ -143,6 +126,9 @@ def procesar_cartera(input_path, output_path=None, fecha_cierre_str=None):
     if not os.path.exists(input_path):
         raise FileNotFoundError(f"No se encontró el archivo: {input_path}")
 
+    reglas = cargar_reglas(archivo_reglas)
+    reglas.reiniciar()
+
     # -------------------------
     # 1. LEER ARCHIVO
     # -------------------------
@@ -151,7 +137,9 @@ def procesar_cartera(input_path, output_path=None, fecha_cierre_str=None):
 
     for enc in encodings:
         try:
-            df = pd.read_csv(input_path, sep=';', encoding=enc, dtype=str)
+            df = pd.read_csv(input_path, sep=';', encoding=enc,
+                             usecols=columnas_procesador(ESQUEMA_PROVCA),
+                             dtype=tipos_lectura(ESQUEMA_PROVCA))
             if len(df) > 0:
                 info(f"✓ Archivo leído con encoding {enc}")
                 break
@@ -165,11 +153,8 @@ def procesar_cartera(input_path, output_path=None, fecha_cierre_str=None):
     info(f"✓ Columnas originales: {list(df.columns)}")
 
     # -------------------------
-    # 2. ELIMINAR COLUMNA PCIMCO (columna U)
+    # 2. COLUMNA PCIMCO (columna U): se omite en la lectura (usecols del esquema)
     # -------------------------
-    if 'PCIMCO' in df.columns:
-        df.drop(columns=['PCIMCO'], inplace=True)
-        info("✓ Columna PCIMCO eliminada")
 
     # -------------------------
     # 3. RENOMBRAR COLUMNAS según procedimiento
@@ -217,17 +202,8 @@ def procesar_cartera(input_path, output_path=None, fecha_cierre_str=None):
         actividades_pl = df[df["EMPRESA"] == "PL"]["ACTIVIDAD"].unique()
         info(f"ℹ️  Actividades de PL: {list(actividades_pl)}")
     
-    # Contar registros PL30 antes de eliminar
-    registros_pl30 = len(df[(df["EMPRESA"] == "PL") & (df["ACTIVIDAD"] == "30")])
-    if registros_pl30 > 0:
-        info(f"ℹ️  Encontrados {registros_pl30} registros de PL30 (EMPRESA='PL' y ACTIVIDAD='30')")
-        # Mostrar saldos de estos registros
-        saldos_pl30 = df[(df["EMPRESA"] == "PL") & (df["ACTIVIDAD"] == "30")]["SALDO"].tolist()
-        info(f"ℹ️  Saldos PL30: {saldos_pl30}")
-    
-    # Eliminar registros donde EMPRESA='PL' Y ACTIVIDAD='30'
-    mask_pl30 = (df["EMPRESA"] == "PL") & (df["ACTIVIDAD"] == "30")
-    df = df[~mask_pl30]
+    # Eliminar registros de la regla excluir_pl30 (EMPRESA='PL' Y ACTIVIDAD='30')
+    df, _ = reglas.excluir("excluir_pl30", df)
     registros_eliminados = registros_antes - len(df)
     
     if registros_eliminados > 0:
@@ -379,14 +355,14 @@ def procesar_cartera(input_path, output_path=None, fecha_cierre_str=None):
     info("✓ Columnas reordenadas correctamente (DIAS VENCIDO y DIAS POR VENCER después de SALDO VENCIDO)")
     
     # -------------------------
-    # 13. CALCULAR % DOTACIÓN (100% si días vencidos >= 180)
+    # 13. CALCULAR % DOTACIÓN (regla dotacion_180: 100% si días vencidos >= 180)
     # -------------------------
-    df["% DOTACION"] = df["DIAS VENCIDO"].apply(lambda x: 1.0 if x >= 180 else 0.0)
+    df["% DOTACION"], mask_dotacion = reglas.asignar("dotacion_180", df)
     
     # -------------------------
-    # 14. CALCULAR VALOR DOTACIÓN (saldo si días >= 180)
+    # 14. CALCULAR VALOR DOTACIÓN (saldo de los registros con dotación)
     # -------------------------
-    df["VALOR DOTACION"] = df["SALDO"].where(df["DIAS VENCIDO"] >= 180, 0)
+    df["VALOR DOTACION"] = df["SALDO"].where(mask_dotacion, 0)
     info("✓ % Dotación y Valor Dotación calculados")
 
     # -------------------------
@@ -777,7 +753,8 @@ def procesar_cartera(input_path, output_path=None, fecha_cierre_str=None):
         # =========================
         # Crear formatos (ANTES DE USARLOS)
         # =========================
-        header_format = workbook.add_format({
+        formatos = CacheFormatos(workbook)
+        header_format = formatos.obtener({
             'bold': True,
             'bg_color': "#123269",
             'font_color': 'white',
@@ -786,15 +763,11 @@ def procesar_cartera(input_path, output_path=None, fecha_cierre_str=None):
             'border': 1,
             'text_wrap': True
         })
-    
-        text_format = workbook.add_format({
-            'align': 'left'
-        })
-    
-        number_format = workbook.add_format({
-            'num_format': '#,##0.00',
-            'align': 'right'
-        })
+        text_format = formatos.obtener({'align': 'left'})
+        number_format = formatos.obtener({'num_format': '#,##0.00', 'align': 'right'})
+        date_format = formatos.obtener({'num_format': 'dd/mm/yyyy', 'align': 'center'})
+        percent_format = formatos.obtener({'num_format': '0%', 'align': 'center'})
+        integer_format = formatos.obtener({'align': 'center'})
     
         # =========================
         # Obtener worksheets
@@ -809,42 +782,10 @@ def procesar_cartera(input_path, output_path=None, fecha_cierre_str=None):
         # =========================
         worksheet_dinamica.set_column(0, 0, 20, text_format)
         worksheet_dinamica.set_column(1, 4, 25, number_format)
-    
-        for col_num, value in enumerate(tabla_dinamica.columns.values):
-            worksheet_dinamica.write(0, col_num, value, header_format)
-    
-        worksheet_dinamica.set_row(0, 30)
-          
-        # Formatos mejorados
-        date_format = workbook.add_format({
-            'num_format': 'dd/mm/yyyy',
-            'align': 'center'
-        })
-        number_format = workbook.add_format({
-            'num_format': '#,##0.00',
-            'align': 'right'
-        })
-        percent_format = workbook.add_format({
-            'num_format': '0%',
-            'align': 'center'
-        })
-        header_format = workbook.add_format({
-            'bold': True,
-            'bg_color': "#123269",
-            'font_color': 'white',
-            'align': 'center',
-            'valign': 'vcenter',
-            'border': 1,
-            'text_wrap': True
-        })
-        text_format = workbook.add_format({
-            'align': 'left'
-        })
+        escribir_encabezados(worksheet_dinamica, tabla_dinamica.columns, header_format, alto=30)
         
         # Aplicar formato a encabezados del detalle
-        for col_num, value in enumerate(df.columns.values):
-            worksheet_detalle.write(0, col_num, value, header_format)
-            worksheet_detalle.set_row(0, 30)  # Altura de fila de encabezado
+        escribir_encabezados(worksheet_detalle, df.columns, header_format, alto=30)
         
         # Identificar columnas por tipo
         fecha_cols = []
@@ -869,17 +810,8 @@ def procesar_cartera(input_path, output_path=None, fecha_cierre_str=None):
                 valor_cols.append(i)
         
         
-        # Reescribir fechas como datetime real (blindaje total)
-        for row_num, row_data in enumerate(df.values):
-            for col_num, cell_data in enumerate(row_data):
-        
-                if col_num in fecha_cols and pd.notna(cell_data):
-                    worksheet_detalle.write_datetime(
-                        row_num + 1,
-                        col_num,
-                        cell_data,
-                        date_format
-                    )
+        # Reescribir fechas como datetime real (blindaje total), solo columnas de fecha
+        reescribir_fechas(worksheet_detalle, df, fecha_cols, date_format)
         
         # Autoajustar columnas con anchos mínimos garantizados
         for i, col in enumerate(df.columns):
@@ -897,11 +829,10 @@ def procesar_cartera(input_path, output_path=None, fecha_cierre_str=None):
             elif i in percent_cols:
                 max_len = max(12, len(col) + 2)
             else:
-                # Para textos, calcular dinámicamente
+                # Para textos, calcular dinámicamente sobre una muestra acotada
                 try:
-                    max_len_data = df[col].astype(str).map(len).max()
-                    max_len = max(max_len_data, len(col)) + 2
-                except:
+                    max_len = estimar_ancho(df[col], col)
+                except Exception:
                     max_len = len(col) + 2
             
             # Limitar ancho máximo para evitar columnas muy anchas
@@ -918,9 +849,7 @@ def procesar_cartera(input_path, output_path=None, fecha_cierre_str=None):
                 worksheet_detalle.set_column(i, i, max_len, number_format)
             
             elif i in integer_cols:
-                worksheet_detalle.set_column(i, i, max_len, workbook.add_format({
-                    'align': 'center'
-                }))
+                worksheet_detalle.set_column(i, i, max_len, integer_format)
             
             else:
                 worksheet_detalle.set_column(i, i, max_len, text_format)
@@ -930,37 +859,31 @@ def procesar_cartera(input_path, output_path=None, fecha_cierre_str=None):
         worksheet_resumen.set_column(1, 1, 25, number_format)
         
         # Aplicar formato a encabezados del resumen
-        for col_num, value in enumerate(resumen.columns.values):
-            worksheet_resumen.write(0, col_num, value, header_format)
-        worksheet_resumen.set_row(0, 30)
+        escribir_encabezados(worksheet_resumen, resumen.columns, header_format, alto=30)
         
         # Formato para hoja validaciones
         worksheet_validaciones.set_column(0, 0, 40, text_format)
         worksheet_validaciones.set_column(1, 1, 25, text_format)
         
         # Aplicar formato a encabezados de validaciones
-        for col_num, value in enumerate(validaciones.columns.values):
-            worksheet_validaciones.write(0, col_num, value, header_format)
-        worksheet_validaciones.set_row(0, 30)
+        escribir_encabezados(worksheet_validaciones, validaciones.columns, header_format, alto=30)
         
         # Formatear hojas de errores si existen
         if len(registros_mora_vencer_invalidos) > 0:
             worksheet_error_mora = writer.sheets["ERROR_MORA_VENCER"]
-            for col_num, value in enumerate(registros_mora_vencer_invalidos.columns.values):
-                worksheet_error_mora.write(0, col_num, value, header_format)
-            worksheet_error_mora.set_row(0, 30)
+            escribir_encabezados(worksheet_error_mora, registros_mora_vencer_invalidos.columns, header_format, alto=30)
             
         if len(registros_rangos_invalidos) > 0:
             worksheet_error_rangos = writer.sheets["ERROR_RANGOS"]
-            for col_num, value in enumerate(registros_rangos_invalidos.columns.values):
-                worksheet_error_rangos.write(0, col_num, value, header_format)
-            worksheet_error_rangos.set_row(0, 30)
+            escribir_encabezados(worksheet_error_rangos, registros_rangos_invalidos.columns, header_format, alto=30)
         
     info(f"\n✓ Archivo generado correctamente: {output_path}")
     info(f"✓ Total registros procesados: {len(df)}")
     info(f"✓ Saldo total: ${df['SALDO'].sum():,.2f}")
     info(f"✓ Mora total: ${df['MORA TOTAL'].sum():,.2f}")
     info(f"✓ Deuda incobrable: ${df['DEUDA INCOBRABLE'].sum():,.2f}")
+    for linea in reglas.resumen():
+        info(linea)
     
     return output_path
 
@@ -988,7 +911,10 @@ def main():
         if len(sys.argv) >= 4:
             output_path = sys.argv[3]
 
-        resultado = procesar_cartera(input_path, output_path, fecha_cierre)
+        # Si envían un archivo de reglas de provisión distinto al predeterminado
+        archivo_reglas = sys.argv[4] if len(sys.argv) >= 5 else None
+
+        resultado = procesar_cartera(input_path, output_path, fecha_cierre, archivo_reglas)
 
         info(f"\n{'='*60}")
         info("PROCESO COMPLETADO EXITOSAMENTE")
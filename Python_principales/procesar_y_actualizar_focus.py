@@ -9,11 +9,14 @@ import re
 import time
 import logging
 import tempfile
+import unicodedata
+from functools import lru_cache
 from logging.handlers import RotatingFileHandler
 from typing import Optional, Tuple, Dict, Any, List, Union
 from pathlib import Path
 from datetime import datetime, timedelta
 
+import numpy as np
 import pandas as pd
 import openpyxl
 from openpyxl import load_workbook, Workbook
@@ -21,6 +24,9 @@ from openpyxl.utils import get_column_letter
 from openpyxl.worksheet.worksheet import Worksheet
 from openpyxl.styles import PatternFill
 
+from lectura_excel import InstantaneaLibro, leer_hoja_excel, motor_excel
+from evaluador_formulas import EvaluadorFormulas, completar_con_valores, guardar_valores
+
 # Importar xlrd y xlwt para manejo de archivos .xls
 try:
     import xlrd
@@ -149,17 +155,41 @@ def obtener_mes_siguiente(mes_actual: str) -> str:
         return mes_actual
 
 
+@lru_cache(maxsize=65536)
+def _normalizar_cadena(s: str) -> str:
+    s = unicodedata.normalize('NFC', s.lower())
+    # Reemplazar separadores comunes pero preservar caracteres especiales
+    return ''.join(ch if ch.isalnum() or ch.isspace() or ch in 'ñáéíóúü' else ' ' for ch in s)
+
+
 def normalize_text(value: str) -> str:
-    """Normaliza texto: minúsculas, preservando ñ y caracteres especiales del español."""
-    try:
-        import unicodedata
-        s = str(value).lower()
-        # Normalizar pero preservar ñ y otros caracteres especiales del español
-        s = unicodedata.normalize('NFC', s)
-        # Reemplazar separadores comunes pero preservar caracteres especiales
-        return ''.join(ch if ch.isalnum() or ch.isspace() or ch in 'ñáéíóúü' else ' ' for ch in s)
-    except Exception:
-        return str(value).lower()
+    """Normaliza texto: minúsculas, preservando ñ y caracteres especiales del español (con caché por valor)."""
+    return _normalizar_cadena(str(value))
+
+
+class TextoNormalizado:
+    """
+    Vista normalize_text de todas las celdas de un DataFrame, construida una
+    sola vez: cada valor distinto se normaliza una vez (str(v), como al
+    recorrer las filas) y las búsquedas son máscaras vectorizadas por fila.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.columnas = df.columns
+        valores = df.to_numpy(dtype=object)
+        codigos, unicos = pd.factorize(valores.ravel(), use_na_sentinel=False)
+        self.codigos = codigos.reshape(valores.shape)
+        self.unicos = pd.Series([normalize_text(v) for v in unicos], dtype=object)
+
+    def filas_igual(self, columna, objetivo: str) -> np.ndarray:
+        """Filas cuya celda en la columna, normalizada y sin espacios extremos, es igual al objetivo."""
+        por_valor = self.unicos.str.strip().eq(objetivo).to_numpy()
+        return por_valor[self.codigos[:, self.columnas.get_loc(columna)]]
+
+    def filas_contienen(self, objetivo: str) -> np.ndarray:
+        """Filas con alguna celda cuya normalización contiene el objetivo."""
+        por_valor = self.unicos.str.contains(objetivo, regex=False).to_numpy()
+        return por_valor[self.codigos].any(axis=1)
 
 
 def to_float(valor) -> float:
@@ -215,14 +245,12 @@ def leer_excel(ruta: Path, hoja=0):
         # Seleccionar el motor apropiado según la extensión
         file_ext = ruta.suffix.lower()
         
-        if file_ext in ['.xlsx', '.xlsm', '.xltx', '.xltm']:
-            # Usar openpyxl para archivos .xlsx y formatos modernos
-            print(f"  [INFO] Leyendo archivo {ruta.name} con motor openpyxl...")
-            return pd.read_excel(ruta, sheet_name=hoja, engine='openpyxl')
-        elif file_ext == '.xls':
-            # Usar xlrd 2.0.1+ para archivos .xls modernos
-            print(f"  [INFO] Leyendo archivo {ruta.name} con motor xlrd...")
-            return pd.read_excel(ruta, sheet_name=hoja, engine='xlrd')
+        if file_ext in ['.xlsx', '.xlsm', '.xltx', '.xltm', '.xls']:
+            # Un solo libro abierto en modo solo lectura; solo se convierte la hoja pedida
+            # (calamine si está instalado, openpyxl para .xlsx, xlrd 2.0.1+ para .xls)
+            print(f"  [INFO] Leyendo archivo {ruta.name} con motor {motor_excel(ruta)}...")
+            df, _ = leer_hoja_excel(ruta, hoja)
+            return df
         else:
             raise ValueError(f"Formato de archivo no soportado: {file_ext}")
         
@@ -796,36 +824,33 @@ def procesar_situacion(df: pd.DataFrame) -> Tuple[float, float, float, float]:
     S01_NORM       = normalize_text('S01 - COBROS DE CLIENTES')
     TOTAL_S01_NORM = normalize_text('Total S01 - COBROS DE CLIENTES')
 
+    # Vista normalizada de la hoja (una sola vez) para las tres estrategias
+    texto = TextoNormalizado(df)
+
+    def _primera_fila(mascara: np.ndarray, etiqueta: str) -> Optional[pd.Series]:
+        posiciones = np.flatnonzero(mascara)
+        if not len(posiciones):
+            return None
+        print(f"  [{etiqueta}] Fila encontrada en idx={df.index[posiciones[0]]}")
+        return df.iloc[posiciones[0]]
+
     # ── Estrategia 1 (FIX): buscar la fila de TOTAL real por texto exacto ────
     if col_cat1:
-        for idx, row in df.iterrows():
-            cat1_val = normalize_text(str(row.get(col_cat1, '') or '')).strip()
-            if cat1_val == TOTAL_S01_NORM:
-                fila_encontrada = row
-                encontrado = True
-                print(f"  [S01-TOTAL] Fila encontrada en idx={idx}")
-                break
+        fila_encontrada = _primera_fila(texto.filas_igual(col_cat1, TOTAL_S01_NORM), 'S01-TOTAL')
+        encontrado = fila_encontrada is not None
 
     # ── Estrategia 2 (fallback): "Total S01..." en cualquier celda ───────────
     if not encontrado:
         print("  [WARN] Estrategia 1 no encontró la fila. Intentando fallback por texto...")
-        for idx, row in df.iterrows():
-            if any(TOTAL_S01_NORM in normalize_text(str(v)) for v in row.values):
-                fila_encontrada = row
-                encontrado = True
-                print(f"  [S01-fallback] Fila encontrada en idx={idx}")
-                break
+        fila_encontrada = _primera_fila(texto.filas_contienen(TOTAL_S01_NORM), 'S01-fallback')
+        encontrado = fila_encontrada is not None
 
     # ── Estrategia 3 (último recurso): Total 01010 genérico ──────────────────
     if not encontrado:
         print("  [WARN] Fallback S01 tampoco encontró. Usando Total 01010 genérico...")
         TARGET_GENERICO = normalize_text('TOTAL 01010')
-        for idx, row in df.iterrows():
-            if any(TARGET_GENERICO in normalize_text(str(v)) for v in row.values):
-                fila_encontrada = row
-                encontrado = True
-                print(f"  [S01-generico] Fila encontrada en idx={idx}")
-                break
+        fila_encontrada = _primera_fila(texto.filas_contienen(TARGET_GENERICO), 'S01-generico')
+        encontrado = fila_encontrada is not None
 
     if not encontrado or fila_encontrada is None:
         print("  [ERROR] No se encontró fila de cobros S01 en ninguna estrategia")
@@ -880,35 +905,146 @@ def procesar_situacion(df: pd.DataFrame) -> Tuple[float, float, float, float]:
 
     return cobros_vencida_mes, cobros_no_vencida_mes, cobros_total, cobros_acum
 
-def _encontrar_fila_total_modelo(ws) -> Optional[int]:
+# Columnas del Modelo Deuda (base 0) que leen los escáneres de filas
+_COL_MODELO = {letra: i for i, letra in enumerate('ABCDEFGHIJKLMNOPQRS')}
+_COLS_BUSQUEDA_TOTAL = 19   # 'Total' se busca en las columnas A hasta S
+
+
+def _valor_fila(fila: Optional[tuple], letra: str) -> float:
+    """Valor numérico de una columna en una fila de iter_rows(values_only) (0 si no existe)."""
+    if fila is None:
+        return 0.0
+    idx = _COL_MODELO[letra]
+    return to_float(fila[idx]) if idx < len(fila) else 0.0
+
+
+def _escanear_modelo(ws) -> Dict[str, Optional[Tuple[int, tuple]]]:
     """
-    Busca la ÚLTIMA fila del Modelo Deuda que:
-    - Contenga la palabra 'Total' exacto en CUALQUIER columna (A hasta T)
-    - Tenga un valor numérico grande en columna G (> 1e6)
-    Se sobreescribe en cada match → al terminar queda la última = gran total.
+    Recorre UNA vez la hoja del Modelo Deuda (iter_rows con values_only) y
+    devuelve (número de fila, valores) de las filas clave:
+    - 'total':    ÚLTIMA fila con 'Total' exacto en A..S y G > 1e6 (gran total)
+    - 'pesos':    subtotal 'moneda local' en E con G > 0
+    - 'usd_puro': subtotal 'Total moneda extranjera USD' en F
+    - 'trm':      fila 'Dólar' en E con la TRM (> 1000) en F
+    Cada una se sobreescribe en cada match, así que queda la última.
     """
-    from openpyxl.utils import column_index_from_string
-    fila_total = None
-
-    for row_idx in range(1, ws.max_row + 1):
-        col_g = to_float(ws.cell(row=row_idx, column=column_index_from_string('G')).value)
-        if col_g <= 1e6:
-            continue  # no es fila de totales grandes, skip rápido
-
-        # Revisar TODAS las celdas de la fila buscando 'total' exacto
-        for col_idx in range(1, 20):  # columnas A hasta T
-            val = str(ws.cell(row=row_idx, column=col_idx).value or '').strip().lower()
-            if val == 'total':
-                fila_total = row_idx  # se sobreescribe → siempre queda la última
-                print(f"  [TOTAL candidato] fila {row_idx} col {col_idx}: G={col_g:,.0f}")
-                break  # encontrado en esta fila, pasar a la siguiente
-
-    if fila_total:
-        print(f"  [TOTAL GENERAL] Última fila seleccionada: {fila_total}")
+    filas: Dict[str, Optional[Tuple[int, tuple]]] = {
+        'total': None, 'pesos': None, 'usd_puro': None, 'trm': None,
+    }
+    if hasattr(ws, 'reset_dimensions'):
+        ws.reset_dimensions()      # no confiar en la dimensión declarada del archivo
+
+    for row_idx, fila in enumerate(ws.iter_rows(values_only=True), start=1):
+        col_e = str(fila[4] or '').strip().lower() if len(fila) > 4 else ''
+        col_f_val = fila[5] if len(fila) > 5 else None
+        col_f = str(col_f_val or '').strip().lower()
+        col_g = _valor_fila(fila, 'G')
+
+        # Gran total: solo filas con G grande, buscando 'total' exacto
+        if col_g > 1e6:
+            for col_idx, val in enumerate(fila[:_COLS_BUSQUEDA_TOTAL], start=1):
+                if isinstance(val, str) and val.strip().lower() == 'total':
+                    filas['total'] = (row_idx, fila)
+                    print(f"  [TOTAL candidato] fila {row_idx} col {col_idx}: G={col_g:,.0f}")
+                    break
+
+        # Fila subtotal PESOS COL
+        if 'moneda local' in col_e and col_g > 0:
+            filas['pesos'] = (row_idx, fila)
+            print(f"  [PESOS] Encontrado en fila {row_idx}: G={col_g:,.0f}")
+
+        # Fila subtotal USD puro
+        if 'total moneda extranjera usd' in col_f:
+            filas['usd_puro'] = (row_idx, fila)
+            print(f"  [USD PURO] Encontrado en fila {row_idx}")
+
+        # Fila TRM (conversión USD→COP)
+        if 'dólar' in col_e or 'dolar' in col_e:
+            trm_val = to_float(str(col_f_val or '').strip())
+            if trm_val > 1000:
+                filas['trm'] = (row_idx, fila)
+                print(f"  [TRM] Encontrado en fila {row_idx}: TRM={trm_val}")
+
+    if filas['total']:
+        print(f"  [TOTAL GENERAL] Última fila seleccionada: {filas['total'][0]}")
     else:
         print("  [ERROR] No se encontró fila 'Total' con valores grandes")
 
-    return fila_total
+    return filas
+
+
+def _abrir_hoja_modelo(ruta: Path):
+    """(libro en solo lectura, hoja 'MODELO DEUDA' o la primera) del Modelo Deuda."""
+    wb = load_workbook(ruta, read_only=True, data_only=True)
+    ws_nombre = next(
+        (h for h in wb.sheetnames if 'MODELO DEUDA' in h.strip().upper()),
+        wb.sheetnames[0]
+    )
+    return wb, wb[ws_nombre]
+
+
+# Resumen JSON que modelo_deuda.crear_modelo_deuda escribe junto al xlsx
+SUFIJO_TOTALES_MODELO = '_totales.json'
+VERSION_TOTALES_MODELO = 2
+
+def leer_totales_modelo(ruta: Path) -> Optional[Dict[str, Any]]:
+    """
+    Lee el resumen de totales del Modelo Deuda (<archivo>_totales.json).
+    Devuelve None si no existe, es anterior al xlsx o no es válido;
+    en ese caso se recorre el libro como antes (archivos heredados).
+    """
+    ruta_json = ruta.with_name(ruta.stem + SUFIJO_TOTALES_MODELO)
+    if not ruta_json.exists():
+        return None
+    if ruta_json.stat().st_mtime < ruta.stat().st_mtime:
+        print(f"  [WARN] {ruta_json.name} es anterior al Modelo Deuda, se ignora")
+        return None
+    try:
+        with open(ruta_json, 'r', encoding='utf-8') as f:
+            totales = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"  [WARN] No se pudo leer {ruta_json.name}: {e}")
+        return None
+    if totales.get('version') != VERSION_TOTALES_MODELO or 'total_general' not in totales:
+        print(f"  [WARN] {ruta_json.name} con formato no reconocido, se ignora")
+        return None
+    print(f"  [OK] Totales leídos de {ruta_json.name}")
+    return totales
+
+
+def _resultado_desde_totales(totales: Dict[str, Any], resultado: Dict[str, float]) -> Dict[str, float]:
+    """Mismos valores que el recorrido de filas, tomados del resumen JSON."""
+    vencidos = ['VENCIDO 30', 'VENCIDO 60', 'VENCIDO 90', 'VENCIDO 180', 'VENCIDO 360', 'VENCIDO + 360']
+    pesos = totales.get('subtotales_moneda_cop', {}).get('PESOS COL', {})
+    gran = totales['total_general']
+
+    h22 = to_float(pesos.get('SALDO')) / 1000.0
+    d22 = sum(to_float(pesos.get(c)) for c in vencidos) / 1000.0
+    f22 = to_float(pesos.get('SALDO NO VENCIDO')) / 1000.0
+    print(f"  [PESOS] H22={h22:,.3f} | D22={d22:,.3f} | F22={f22:,.3f}")
+
+    usd_total = to_float(totales.get('usd_total'))
+    print(f"  [USD] usd_total={usd_total:,.3f} USD puros")
+
+    saldo_total_gran   = to_float(gran.get('SALDO'))
+    venc_30_gran       = to_float(gran.get('VENCIDO 30'))
+    suma_vencidos_gran = sum(to_float(gran.get(c)) for c in vencidos[1:])
+    incobrable_gran    = to_float(gran.get('DEUDA INCOBRABLE'))
+    print(f"  [TOTAL G] Saldo={saldo_total_gran:,.0f} | Venc30={venc_30_gran:,.0f} | "
+          f"SumaJ:N={suma_vencidos_gran:,.0f} | Incobrable={incobrable_gran:,.0f}")
+
+    resultado.update({
+        'h22':                h22,
+        'd22':                d22,
+        'f22':                f22,
+        'usd_total':          usd_total,
+        'saldo_total_gran':   saldo_total_gran,
+        'venc_30_gran':       venc_30_gran,
+        'suma_vencidos_gran': suma_vencidos_gran,
+        'incobrable_gran':    incobrable_gran,
+        'trm_usd_archivo':    to_float(totales.get('trm', {}).get('usd')),
+    })
+    return resultado
 
 
 def procesar_modelo_como_espana(ruta: Path) -> Dict[str, float]:
@@ -919,62 +1055,39 @@ def procesar_modelo_como_espana(ruta: Path) -> Dict[str, float]:
         'incobrable_gran': 0.0,
     }
 
+    totales = leer_totales_modelo(ruta)
+    if totales:
+        return _resultado_desde_totales(totales, resultado)
+
     try:
-        wb = load_workbook(ruta, data_only=True)
-        ws_nombre = next(
-            (h for h in wb.sheetnames if 'MODELO DEUDA' in h.strip().upper()),
-            wb.sheetnames[0]
-        )
-        ws = wb[ws_nombre]
-        print(f"  Hoja seleccionada: {ws_nombre}")
-
-        from openpyxl.utils import column_index_from_string
-        def gv(row, col_letter):
-            return to_float(ws.cell(row=row, column=column_index_from_string(col_letter)).value)
-
-        # ── Usar helper compartido para fila_total ───────────────────────────
-        fila_total = _encontrar_fila_total_modelo(ws)
-
-        # ── Recorrer filas para pesos, USD puro y TRM ───────────────────────
-        fila_pesos    = None
-        fila_usd_puro = None
-        fila_trm      = None
-
-        for row_idx in range(1, ws.max_row + 1):
-            col_e   = str(ws.cell(row=row_idx, column=5).value or '').strip()
-            col_f   = str(ws.cell(row=row_idx, column=6).value or '').strip()
-            col_g   = to_float(ws.cell(row=row_idx, column=7).value)
-
-            # Fila subtotal PESOS COL
-            if 'moneda local' in col_e.lower() and col_g > 0:
-                fila_pesos = row_idx
-                print(f"  [PESOS] Encontrado en fila {row_idx}: G={col_g:,.0f}")
-
-            # Fila subtotal USD puro
-            if 'total moneda extranjera usd' in col_f.lower():
-                fila_usd_puro = row_idx
-                print(f"  [USD PURO] Encontrado en fila {row_idx}")
-
-            # Fila TRM (conversión USD→COP)
-            trm_val = to_float(col_f)
-            if ('dólar' in col_e.lower() or 'dolar' in col_e.lower()) and trm_val > 1000:
-                fila_trm = row_idx
-                print(f"  [TRM] Encontrado en fila {row_idx}: TRM={trm_val}")
+        wb, ws = _abrir_hoja_modelo(ruta)
+        print(f"  Hoja seleccionada: {ws.title}")
+
+        # ── Una sola pasada: gran total, pesos, USD puro y TRM ──────────────
+        filas = _escanear_modelo(ws)
+        wb.close()
+        fila_total    = filas['total']
+        fila_pesos    = filas['pesos']
+        fila_usd_puro = filas['usd_puro']
+        fila_trm      = filas['trm']
 
         if not all([fila_pesos, fila_usd_puro, fila_total]):
             print(f"  [ERROR] Filas clave faltantes: "
-                  f"pesos={fila_pesos}, usd={fila_usd_puro}, total={fila_total}")
+                  f"pesos={fila_pesos and fila_pesos[0]}, usd={fila_usd_puro and fila_usd_puro[0]}, "
+                  f"total={fila_total and fila_total[0]}")
             return resultado
 
+        pesos, usd_puro, total = fila_pesos[1], fila_usd_puro[1], fila_total[1]
+
         # ── PESOS COL: H22, D22, F22 ────────────────────────────────────────
-        G_pesos = gv(fila_pesos, 'G')
-        H_pesos = gv(fila_pesos, 'H')
-        I_pesos = gv(fila_pesos, 'I')
-        J_pesos = gv(fila_pesos, 'J')
-        K_pesos = gv(fila_pesos, 'K')
-        L_pesos = gv(fila_pesos, 'L')
-        M_pesos = gv(fila_pesos, 'M')
-        N_pesos = gv(fila_pesos, 'N')
+        G_pesos = _valor_fila(pesos, 'G')
+        H_pesos = _valor_fila(pesos, 'H')
+        I_pesos = _valor_fila(pesos, 'I')
+        J_pesos = _valor_fila(pesos, 'J')
+        K_pesos = _valor_fila(pesos, 'K')
+        L_pesos = _valor_fila(pesos, 'L')
+        M_pesos = _valor_fila(pesos, 'M')
+        N_pesos = _valor_fila(pesos, 'N')
         vencido_pesos = I_pesos + J_pesos + K_pesos + L_pesos + M_pesos + N_pesos
 
         h22 = G_pesos       / 1000.0
@@ -983,26 +1096,24 @@ def procesar_modelo_como_espana(ruta: Path) -> Dict[str, float]:
         print(f"  [PESOS] H22={h22:,.3f} | D22={d22:,.3f} | F22={f22:,.3f}")
 
         # ── USD puro ─────────────────────────────────────────────────────────
-        usd_total = gv(fila_usd_puro, 'G')
+        usd_total = _valor_fila(usd_puro, 'G')
         print(f"  [USD] usd_total={usd_total:,.3f} USD puros")
 
         # ── GRAN TOTAL (última fila 'Total') ─────────────────────────────────
-        saldo_total_gran   = gv(fila_total, 'G')
-        venc_30_gran       = gv(fila_total, 'I')
-        venc_60_gran       = gv(fila_total, 'J')
-        venc_90_gran       = gv(fila_total, 'K')
-        venc_180_gran      = gv(fila_total, 'L')
-        venc_360_gran      = gv(fila_total, 'M')
-        venc_360p_gran     = gv(fila_total, 'N')
-        incobrable_gran    = gv(fila_total, 'O')
+        saldo_total_gran   = _valor_fila(total, 'G')
+        venc_30_gran       = _valor_fila(total, 'I')
+        venc_60_gran       = _valor_fila(total, 'J')
+        venc_90_gran       = _valor_fila(total, 'K')
+        venc_180_gran      = _valor_fila(total, 'L')
+        venc_360_gran      = _valor_fila(total, 'M')
+        venc_360p_gran     = _valor_fila(total, 'N')
+        incobrable_gran    = _valor_fila(total, 'O')
         suma_vencidos_gran = (venc_60_gran + venc_90_gran + venc_180_gran
                               + venc_360_gran + venc_360p_gran)
 
         print(f"  [TOTAL G] Saldo={saldo_total_gran:,.0f} | Venc30={venc_30_gran:,.0f} | "
               f"SumaJ:N={suma_vencidos_gran:,.0f} | Incobrable={incobrable_gran:,.0f}")
 
-        wb.close()
-
     except Exception as e:
         print(f"  [ERROR] No se pudo leer el archivo Modelo Deuda: {e}")
         import traceback; print(traceback.format_exc())
@@ -1017,7 +1128,7 @@ def procesar_modelo_como_espana(ruta: Path) -> Dict[str, float]:
         'venc_30_gran':       venc_30_gran,
         'suma_vencidos_gran': suma_vencidos_gran,
         'incobrable_gran':    incobrable_gran,
-        'trm_usd_archivo':    gv(fila_trm, 'F') if fila_trm else 0.0,
+        'trm_usd_archivo':    _valor_fila(fila_trm[1], 'F') if fila_trm else 0.0,
     })
 
     return resultado
@@ -1026,27 +1137,23 @@ def procesar_modelo_como_espana(ruta: Path) -> Dict[str, float]:
 def procesar_modelo_vencimiento(ruta: Path) -> float:
     """Lee deuda incobrable total de col O de la ÚLTIMA fila con 'Total' y G > 1e6."""
     print("\n=== PROCESANDO MODELO VENCIMIENTO (incobrable total) ===")
-    try:
-        wb = load_workbook(ruta, data_only=True)
-        ws_nombre = next(
-            (h for h in wb.sheetnames if 'MODELO DEUDA' in h.strip().upper()),
-            wb.sheetnames[0]
-        )
-        ws = wb[ws_nombre]
+    totales = leer_totales_modelo(ruta)
+    if totales:
+        incobrable = to_float(totales.get('deuda_incobrable'))
+        print(f"  [OK] Incobrable (resumen JSON) = {incobrable:,.2f}")
+        return incobrable
 
-        fila_total = _encontrar_fila_total_modelo(ws)
+    try:
+        wb, ws = _abrir_hoja_modelo(ruta)
+        fila_total = _escanear_modelo(ws)['total']
+        wb.close()
 
         if not fila_total:
             print("  [ERROR] No se encontró fila Total en Modelo Vencimiento")
-            wb.close()
             return 0.0
 
-        from openpyxl.utils import column_index_from_string
-        incobrable = to_float(
-            ws.cell(row=fila_total, column=column_index_from_string('O')).value
-        )
-        print(f"  [OK] Incobrable fila {fila_total} col O = {incobrable:,.2f}")
-        wb.close()
+        incobrable = _valor_fila(fila_total[1], 'O')
+        print(f"  [OK] Incobrable fila {fila_total[0]} col O = {incobrable:,.2f}")
         return incobrable
 
     except Exception as e:
@@ -1282,10 +1389,21 @@ def insertar_formula(ws, celda: str, formula: str, descripcion: str = ""):
         print(f"  [WARN] Error insertando fórmula {descripcion} en {celda}: {str(e)}")
         return False
        
-def rotar_finales_a_iniciales(ws_modelo: Worksheet, ruta_archivo: Path) -> None:
+def es_hoja_modelo(nombre: str) -> bool:
+    return "MODELO" in nombre.strip().upper()
+
+
+def es_hoja_base(nombre: str) -> bool:
+    """Hojas del FOCUS cuyos valores se consultan del archivo base: MODELO DEUDA y S22."""
+    return es_hoja_modelo(nombre) or nombre.strip().upper() == "S22"
+
+
+def rotar_finales_a_iniciales(ws_modelo: Worksheet,
+                              base: Union[Path, InstantaneaLibro]) -> None:
     """
-    Lee los valores FINALES del archivo guardado (data_only=True) y los
-    escribe como INICIALES en ws_modelo (que está abierto para edición).
+    Lee los valores FINALES del archivo guardado (valores en caché, vía la
+    instantánea del libro base) y los escribe como INICIALES en ws_modelo
+    (que está abierto para edición).
 
     NOTA: el bloque ACUM (filas 35 y 44, "Inicial ACUM") ya NO se alimenta de
     su "Final ACUM" correspondiente (filas 43 y 50). En la plantilla actual
@@ -1297,14 +1415,9 @@ def rotar_finales_a_iniciales(ws_modelo: Worksheet, ruta_archivo: Path) -> None:
     """
     print("\n=== ROTANDO FINALES A INICIALES ===")
 
-    wb_readonly = load_workbook(ruta_archivo, data_only=True)
-    ws_readonly = None
-    for sn in wb_readonly.sheetnames:
-        if "MODELO" in sn.strip().upper():
-            ws_readonly = wb_readonly[sn]
-            break
-    if ws_readonly is None:
-        ws_readonly = wb_readonly.active
+    if not isinstance(base, InstantaneaLibro):
+        base = InstantaneaLibro(base, es_hoja_base)
+    ws_readonly = base.hoja_o_activa(es_hoja_modelo)
 
     columnas = ['D', 'F', 'H', 'J', 'L', 'N']
 
@@ -1338,8 +1451,6 @@ def rotar_finales_a_iniciales(ws_modelo: Worksheet, ruta_archivo: Path) -> None:
             except Exception as e:
                 print(f"  [WARN] Error inesperado {celda_origen} -> {celda_destino}: {e}")
 
-    wb_readonly.close()
-
     try:
         mes_nuevo = ws_modelo['B5'].value or ""
         titulo_actual = ws_modelo.title
@@ -1460,6 +1571,18 @@ def procesar_y_actualizar_focus(
         print(f"  Nombres de hojas: {', '.join(wb.sheetnames)}")
     except Exception as e:
         raise Exception(f"Error al cargar archivo FOCUS: {e}")
+
+    # Valores en caché del archivo base (MODELO y S22), leídos una sola vez:
+    # los iniciales, los acumulados, la rotación y la validación consultan este mapa
+    try:
+        base = InstantaneaLibro(archivo_focus, es_hoja_base)
+        print(f"  Instantánea de valores: {', '.join(base.hojas)} ({base.total_celdas():,} celdas)")
+        # Fórmulas sin valor en caché (libro generado aquí y no recalculado en Excel)
+        completadas = completar_con_valores(base.hoja_o_activa(es_hoja_modelo), archivo_focus)
+        if completadas:
+            print(f"  Valores recalculados del mes anterior: {completadas} celdas completadas")
+    except Exception as e:
+        raise Exception(f"Error al leer los valores del archivo FOCUS: {e}")
  
     # ── Buscar hoja MODELO DEUDA para TRM/rotación/totales ──────────────────
     ws_modelo: Optional[Worksheet] = None
@@ -1473,6 +1596,15 @@ def procesar_y_actualizar_focus(
     if ws_modelo is None:
         ws_modelo = ws
         print("  [WARN] No se encontró hoja MODELO, usando hoja activa para TRM")
+
+    # Evaluador de las fórmulas del MODELO: parte del estado base y recalcula lo que escribamos
+    evaluador: Optional[EvaluadorFormulas] = None
+    try:
+        evaluador = EvaluadorFormulas(ws_modelo, base.hoja_o_activa(es_hoja_modelo))
+        print(f"  Fórmulas del MODELO compiladas: {len(evaluador.formulas)}"
+              + (f" ({len(evaluador.no_soportadas)} no soportadas)" if evaluador.no_soportadas else ""))
+    except ValueError as e:
+        print(f"  [WARN] No se pueden evaluar las fórmulas del MODELO: {e}")
  
     # Detectar mes actual del FOCUS
     mes_actual = detectar_mes_archivo(archivo_focus)
@@ -1535,6 +1667,7 @@ def procesar_y_actualizar_focus(
     cobros_sit_vencida = 0.0
     cobros_sit_no_vencida = 0.0
     total_situacion_acum = 0.0
+    h22_esperado: Optional[float] = None
  
     if archivo_situacion and archivo_situacion.exists():
         print("\nProcesando Situación...")
@@ -1589,20 +1722,12 @@ def procesar_y_actualizar_focus(
  
             # Leer iniciales del archivo base (finales del mes anterior)
             # ANTES de escribir nada — estos son los valores correctos
-            _wb_init = load_workbook(archivo_focus, data_only=True)
-            _ws_init = None
-            for _sn in _wb_init.sheetnames:
-                if "MODELO" in _sn.strip().upper():
-                    _ws_init = _wb_init[_sn]
-                    break
-            if _ws_init is None:
-                _ws_init = _wb_init.active
+            _ws_init = base.hoja_o_activa(es_hoja_modelo)
 
             d14_val = to_float(_ws_init['D22'].value) or 0.0  # Final vencida → inicial
             f14_val = to_float(_ws_init['F22'].value) or 0.0  # Final no vencida → inicial
             h14_val = to_float(_ws_init['H22'].value) or 0.0  # Final total → inicial
             d23_val = to_float(_ws_init['D29'].value) or 0.0  # Final prov. acum → inicial
-            _wb_init.close()
 
             print(f"  [MODELO] D14(=D22_ant)={d14_val:,.2f}, F14(=F22_ant)={f14_val:,.2f}, H14(=H22_ant)={h14_val:,.2f}")
             print(f"  [MODELO] D23(=D29_ant)={d23_val:,.2f} (provisión acumulada inicial)")
@@ -1631,17 +1756,6 @@ def procesar_y_actualizar_focus(
             # Antes: cobros_no_vencida_mes = cobros_sit_no_vencida (detección dinámica)
             # Ahora: celda fija I18/I19 de Situación ÷ 1000, menos D15 (ya calculado), en negativo
             valor_i18_i19_miles = cobro_no_vencida_celda_fija / 1000.0
-            # F15 = H15 del FOCUS anterior - D15
-            _wb_h15 = load_workbook(archivo_focus, data_only=True)
-            _ws_h15 = None
-            for _sn in _wb_h15.sheetnames:
-                if "MODELO" in _sn.strip().upper():
-                    _ws_h15 = _wb_h15[_sn]
-                    break
-            if _ws_h15 is None:
-                _ws_h15 = _wb_h15.active
-            
-            _wb_h15.close()
 
             # Reutilizamos el valor ya calculado dinámicamente más arriba
             # (cobro_no_vencida_celda_fija = leer_celda_fija_situacion(archivo_situacion))
@@ -1693,6 +1807,7 @@ def procesar_y_actualizar_focus(
             # Pero H17 en el modelo es D17+F17 = d17_calc - d17_calc = 0
             # así que simplificamos:
             h22_final_calc = saldo_total_gran_miles  # G_total/1000 = deuda bruta final
+            h22_esperado = h22_final_calc
             f16_calc = h22_final_calc - h14_total - h15_total - (d17_calc + f17_calc)
 
             print(f"  [F16] saldo_total/1000={saldo_total_gran_miles:,.3f}")
@@ -1737,17 +1852,10 @@ def procesar_y_actualizar_focus(
             # ── Acumulados ──────────────────────────────────────────────────
             print("\n  === LEYENDO ACUMULADOS DEL FOCUS BASE (MES ANTERIOR) ===")
             try:
-                wb_base = load_workbook(archivo_focus, data_only=True)
-                ws_base_modelo = None
-                for sn in wb_base.sheetnames:
-                    if "MODELO" in sn.strip().upper():
-                        ws_base_modelo = wb_base[sn]
-                        break
-                if ws_base_modelo is None:
-                    ws_base_modelo = wb_base.active
+                ws_base_modelo = base.hoja_o_activa(es_hoja_modelo)
 
                 def leer_base(celda):
-                    return to_float(ws_base_modelo[celda].value)
+                    return to_float(ws_base_modelo.valor(celda))
 
                 # Acumulados del mes anterior
                 d36_anterior = leer_base('D36')
@@ -1769,8 +1877,6 @@ def procesar_y_actualizar_focus(
                 d25_val = to_float(ws_modelo['D25'].value)
                 f30_val = to_float(ws_modelo['F30'].value)
 
-                wb_base.close()
-
                 print(f"  D36_ant={d36_anterior:,.3f}  F36_ant={f36_anterior:,.3f}")
                 print(f"  D37_ant={d37_anterior:,.3f}  F37_ant={f37_anterior:,.3f}")
                 print(f"  D38_ant={d38_anterior:,.3f}  F38_ant={f38_anterior:,.3f}")
@@ -1879,16 +1985,21 @@ def procesar_y_actualizar_focus(
     # ── Actualizar TRM en hoja FOCUS ─────────────────────────────────────────
     actualizar_celdas_trm(ws, BASE_DIR, mes_actual)
  
+    # ── Recalcular fórmulas del MODELO con lo escrito ────────────────────────
+    if evaluador is not None:
+        recalculadas = evaluador.sincronizar(ws_modelo)
+        print(f"\n[RECALC] {recalculadas} fórmulas recalculadas: "
+              + ", ".join(f"{c}={to_float(evaluador.valor(c)):,.3f}" for c in ('H22', 'D22', 'F22', 'D29')))
+        for celda, error in sorted(evaluador.errores.items()):
+            print(f"  [WARN] {celda}: {error}")
+        if h22_esperado is not None and abs(to_float(evaluador.valor('H22')) - h22_esperado) > 0.01:
+            print(f"[ERROR] ERROR: H22 recalculado ({to_float(evaluador.valor('H22')):,.3f}) "
+                  f"!= saldo total del modelo / 1000 ({h22_esperado:,.3f})")
+
     # ── Validar totales ───────────────────────────────────────────────────────
     if total_vencido > 0:
-        wb_values = load_workbook(archivo_focus, data_only=True)
-        ws_values = None
-        for sn in wb_values.sheetnames:
-            if sn.strip().upper() == "S22" or "MODELO" in sn.strip().upper():
-                ws_values = wb_values[sn]
-                break
+        ws_values = evaluador if evaluador is not None else base.buscar(es_hoja_base)
         validar_datos(ws_modelo, ws_values, total_vencido * 1000, total_vencido)
-        wb_values.close()
  
     # ── Definir output_path y crear backup ───────────────────────────────────
     if not output_path:
@@ -1905,6 +2016,8 @@ def procesar_y_actualizar_focus(
     wb.save(output_path)
     print(f"\n[OK] Archivo FOCUS actualizado guardado: {output_path}")
     print(f"[OK] Tamaño: {output_path.stat().st_size / 1024:.2f} KB")
+    if evaluador is not None:
+        print(f"[OK] Valores recalculados: {guardar_valores(output_path, evaluador)}")
     return str(output_path)
  
 def actualizar_hoja_focus(
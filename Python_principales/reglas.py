@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+Reglas de la política de provisión
+Las exclusiones y el % DOTACION se declaran en reglas_provision.json. Cada
+regla se compila una sola vez en una lista de condiciones vectorizadas sobre
+columnas tipadas (texto / numero) y lleva la cuenta de filas afectadas y del
+tiempo de evaluación, que se informa al final de cada proceso.
+"""
+
+import json
+import os
+import time
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+RUTA_REGLAS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'reglas_provision.json')
+
+VERSION_REGLAS = 1
+
+ACCIONES = {'excluir', 'asignar'}
+
+# Reglas que algún proceso aplica (por nombre). Una regla nueva en el JSON no
+# tiene efecto hasta que un proceso la use y se agregue aquí.
+REGLAS_APLICADAS = {
+    'excluir_pl30':               'procesador_cartera',
+    'dotacion_180':               'procesador_cartera',
+    'excluir_actividad30_614000': 'modelo_deuda',
+    'excluir_lineas_modelo':      'modelo_deuda',
+    'excluir_lineas_vencimiento': 'modelo_deuda',
+}
+
+OPERADORES = {
+    '==':    lambda v, x: v == x,
+    '!=':    lambda v, x: v != x,
+    '>=':    lambda v, x: v >= x,
+    '>':     lambda v, x: v > x,
+    '<=':    lambda v, x: v <= x,
+    '<':     lambda v, x: v < x,
+    'en':    lambda v, x: np.isin(v, x),
+    'no_en': lambda v, x: ~np.isin(v, x),
+    'entre': lambda v, x: (v >= x[0]) & (v <= x[1]),
+}
+
+Condicion = Callable[[pd.DataFrame], np.ndarray]
+
+
+def _valores_texto(serie: pd.Series) -> Tuple[np.ndarray, np.ndarray]:
+    """(códigos, valores únicos sin espacios): las condiciones de texto se evalúan una vez por valor."""
+    codigos, unicos = pd.factorize(serie)
+    return codigos, np.asarray([str(u).strip() for u in unicos], dtype=object)
+
+
+def compilar_condicion(definicion: Dict[str, Any]) -> Condicion:
+    """Convierte {'columna', 'tipo', 'op', 'valor'[, 'redondeo']} en una función df -> máscara."""
+    columna = definicion['columna']
+    tipo = definicion.get('tipo', 'texto')
+    op = definicion['op']
+    if op not in OPERADORES:
+        raise ValueError(f"Operador '{op}' no soportado en la condición sobre {columna}")
+    comparar = OPERADORES[op]
+    valor = definicion['valor']
+
+    if tipo == 'texto':
+        objetivo = [str(v) for v in valor] if isinstance(valor, list) else str(valor)
+
+        def _condicion(df: pd.DataFrame) -> np.ndarray:
+            codigos, unicos = _valores_texto(df[columna])
+            por_valor = np.append(np.asarray(comparar(unicos, objetivo), dtype=bool), False)
+            return por_valor[codigos]          # código -1 (nulo) -> False
+
+    elif tipo == 'numero':
+        redondeo = definicion.get('redondeo')
+        objetivo = [float(v) for v in valor] if isinstance(valor, list) else float(valor)
+
+        def _condicion(df: pd.DataFrame) -> np.ndarray:
+            numeros = pd.to_numeric(df[columna], errors='coerce').to_numpy(dtype=float)
+            if redondeo is not None:
+                numeros = np.round(numeros, redondeo)
+            with np.errstate(invalid='ignore'):
+                return np.asarray(comparar(numeros, objetivo), dtype=bool)
+
+    else:
+        raise ValueError(f"Tipo '{tipo}' no soportado en la condición sobre {columna}")
+
+    _condicion.columna = columna
+    return _condicion
+
+
+class Regla:
+    """Regla compilada: conjunción de condiciones con contadores de uso."""
+
+    def __init__(self, definicion: Dict[str, Any]):
+        self.nombre: str = definicion['nombre']
+        self.descripcion: str = definicion.get('descripcion', '')
+        self.accion: str = definicion.get('accion', 'excluir')
+        if self.accion not in ACCIONES:
+            raise ValueError(f"Regla {self.nombre}: acción '{self.accion}' no soportada")
+        self.valor = definicion.get('valor')
+        self.defecto = definicion.get('defecto')
+        self.definiciones: List[Dict[str, Any]] = definicion['condiciones']
+        self.condiciones: List[Condicion] = [compilar_condicion(c) for c in self.definiciones]
+        self.columnas = [c.columna for c in self.condiciones]
+        self.reiniciar()
+
+    def reiniciar(self) -> None:
+        self.evaluaciones = 0
+        self.filas = 0
+        self.coincidencias = 0
+        self.segundos = 0.0
+
+    def faltantes(self, df: pd.DataFrame) -> List[str]:
+        """Columnas de las condiciones que no están en df."""
+        return [col for col in self.columnas if col not in df.columns]
+
+    def mascara(self, df: pd.DataFrame) -> np.ndarray:
+        """Filas que cumplen todas las condiciones; KeyError si falta alguna columna de la regla."""
+        faltantes = self.faltantes(df)
+        if faltantes:
+            raise KeyError(f"Regla {self.nombre}: columnas {faltantes} no encontradas "
+                           f"(disponibles: {list(df.columns)})")
+        inicio = time.perf_counter()
+        mascara = np.ones(len(df), dtype=bool)
+        for condicion in self.condiciones:
+            mascara &= condicion(df)
+        self.evaluaciones += 1
+        self.filas += len(df)
+        self.coincidencias += int(mascara.sum())
+        self.segundos += time.perf_counter() - inicio
+        return mascara
+
+    def valores(self, columna: str) -> List[Any]:
+        """Valores de las condiciones 'en' / '==' sobre una columna (p. ej. las líneas excluidas)."""
+        encontrados = []
+        for c in self.definiciones:
+            if c['columna'] == columna and c['op'] in ('en', '=='):
+                encontrados.extend(c['valor'] if isinstance(c['valor'], list) else [c['valor']])
+        return encontrados
+
+
+class ReglasProvision:
+    """Conjunto de reglas de un archivo, indexado por nombre."""
+
+    def __init__(self, ruta: str = RUTA_REGLAS):
+        self.ruta = ruta
+        with open(ruta, encoding='utf-8') as f:
+            datos = json.load(f)
+        if datos.get('version') != VERSION_REGLAS:
+            raise ValueError(f"Versión de reglas no soportada en {ruta}: {datos.get('version')}")
+        self.reglas: Dict[str, Regla] = {}
+        for definicion in datos.get('reglas', []):
+            regla = Regla(definicion)
+            if regla.nombre in self.reglas:
+                raise ValueError(f"Regla duplicada en {ruta}: {regla.nombre}")
+            self.reglas[regla.nombre] = regla
+        for nombre in self.sin_aplicar():
+            print(f"  [WARN] Regla '{nombre}' de {os.path.basename(ruta)}: ningún proceso la aplica, "
+                  f"se ignora")
+
+    def sin_aplicar(self) -> List[str]:
+        """Reglas del archivo que ningún proceso consume (REGLAS_APLICADAS)."""
+        return [nombre for nombre in self.reglas if nombre not in REGLAS_APLICADAS]
+
+    def __getitem__(self, nombre: str) -> Regla:
+        if nombre not in self.reglas:
+            raise KeyError(f"La regla '{nombre}' no está definida en {self.ruta}")
+        return self.reglas[nombre]
+
+    def excluir(self, nombre: str, df: pd.DataFrame) -> Tuple[pd.DataFrame, np.ndarray]:
+        """(df sin las filas de la regla, máscara de filas excluidas)."""
+        mascara = self[nombre].mascara(df)
+        return (df[~mascara] if mascara.any() else df), mascara
+
+    def asignar(self, nombre: str, df: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+        """(valor de la regla donde se cumple y su defecto en el resto, máscara)."""
+        regla = self[nombre]
+        mascara = regla.mascara(df)
+        return np.where(mascara, regla.valor, regla.defecto), mascara
+
+    def reiniciar(self) -> None:
+        for regla in self.reglas.values():
+            regla.reiniciar()
+
+    def resumen(self) -> List[str]:
+        """Una línea por regla evaluada: filas afectadas / evaluadas y tiempo acumulado."""
+        lineas = []
+        for regla in self.reglas.values():
+            if regla.evaluaciones == 0:
+                continue
+            lineas.append(
+                f"  [REGLA] {regla.nombre}: {regla.coincidencias:,} de {regla.filas:,} filas "
+                f"({regla.evaluaciones} evaluación(es), {regla.segundos * 1000:,.1f} ms)"
+            )
+        return lineas
+
+
+@lru_cache(maxsize=None)
+def _reglas_compiladas(ruta: str) -> ReglasProvision:
+    return ReglasProvision(ruta)
+
+
+def cargar_reglas(ruta: Optional[str] = None) -> ReglasProvision:
+    """Reglas compiladas del archivo (una sola compilación por archivo y proceso)."""
+    return _reglas_compiladas(os.path.abspath(ruta or RUTA_REGLAS))